@@ -0,0 +1,229 @@
+#!/usr/bin/python
+import os, sys, time, shutil, tempfile
+import argparse
+import logging
+from cStringIO import StringIO
+
+BENCH_DIR = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(os.path.join(BENCH_DIR, "..", "bin"))
+sys.path.append(os.path.join(BENCH_DIR, "..", "lib"))
+
+import texttable as tt
+from colorama import Fore, Style
+
+import pysel_core         as core
+import pysel_util_core    as util_core
+import pysel_directives   as directives
+import pysel_screenshot   as screenshot
+import pysel_reporter     as reporter
+import pysel_events       as events
+from pysel_context        import RunContext
+from pysel_fakedriver     import FakeDriver
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+FILE_BASELINE        = os.path.join(BENCH_DIR, "baseline.json")
+REGRESSION_THRESHOLD = 0.20 # Flag anything this much slower than its baseline
+
+######################################################################
+# Swallow what pySel prints (warnings, tables) while timing
+######################################################################
+class _Quiet:
+  def __enter__(self):
+    self.stdout = sys.stdout
+    sys.stdout = StringIO()
+
+  def __exit__(self, excType, excValue, tb):
+    sys.stdout = self.stdout
+    return False
+
+######################################################################
+# Run fn a number of times, returning throughput and commands sent per call
+######################################################################
+def timeIt(fn, iterations, driver=None):
+  if driver:
+    driver.resetCounts()
+  with _Quiet():
+    start = time.time()
+    for i in range(iterations):
+      fn()
+    elapsed = max(time.time() - start, 1e-9)
+  result = {"ops_per_sec": iterations / elapsed, "commands_per_op": 0.0}
+  if driver:
+    result["commands_per_op"] = driver.commandCount() / float(iterations)
+  return result
+
+def _visibleIndex(driver, start):
+  for element in driver.elements[start:]:
+    if element.displayed and element.enabled:
+      return element._id
+  return 1
+
+def _selector(driver, index, numKeys):
+  element = driver.elements[index]
+  keys = [
+    ("id",         element.attrs["id"]),
+    ("name",       element.attrs["name"]),
+    ("class_name", element.attrs["class"]),
+    ("tag_name",   element.tag),
+  ]
+  return dict(keys[:numKeys])
+
+######################################################################
+# _getObject with one to four selector keys, by script and per key
+######################################################################
+def benchGetObject(args, results):
+  driver = FakeDriver(args.elements, args.latency)
+  core.DRIVER = driver
+  selectorIndex = _visibleIndex(driver, args.elements / 2)
+  for numKeys in range(1, 5):
+    selector = _selector(driver, selectorIndex, numKeys)
+    for scripts in [True, False]:
+      driver.scripts = scripts
+      name = "getObject[keys=%s,%s]" % (numKeys, "script" if scripts else "per-key")
+      results[name] = timeIt(lambda: directives._getObject(driver, selector, 1), args.iterations, driver)
+
+######################################################################
+# executeTest over generated plans of 1k and 10k steps
+######################################################################
+def _plan(driver, numSteps):
+  steps = []
+  for stepNum in range(numSteps):
+    selector = _selector(driver, _visibleIndex(driver, (stepNum * 37) % len(driver.elements)), 2)
+    kind = stepNum % 10
+    if kind == 0:
+      steps.append({"navigateUrl": {"value": "http://localhost/%s" % stepNum}})
+    elif kind < 5:
+      steps.append({"typeKeys": {"selector": selector, "value": "value %s" % stepNum}})
+    elif kind < 7:
+      steps.append({"click": {"selector": selector}})
+    else:
+      steps.append({"assertElement": {"selector": selector}})
+  return steps
+
+def benchExecuteTest(args, results, workDir):
+  driver = FakeDriver(args.elements, args.latency)
+  core.DRIVER = driver
+  core.SILENT = True
+  core.AUTO_PILOT = True
+  core.RUN = RunContext("bench", os.path.join(workDir, "report"))
+  core.SCREENSHOT_WRITER.blobDir = os.path.join(workDir, "blobs")
+  for numSteps in [1000, 10000]:
+    testObject = {"steps": _plan(driver, numSteps)}
+    core.RUN.recordWriter = reporter.RecordWriter(os.path.join(workDir, "raw", "bench.jsonl"))
+    def run():
+      core.RUN.screenshots = []
+      core.RUN.steps = []
+      directives.clearCache()
+      core.executeTest("bench", testObject)
+      events.flush()
+      core.SCREENSHOT_WRITER.flush()
+    result = timeIt(run, 1, driver)
+    result["ops_per_sec"] = result["ops_per_sec"] * numSteps # Steps per second
+    result["commands_per_op"] = result["commands_per_op"] / numSteps
+    results["executeTest[steps=%s]" % numSteps] = result
+    core.RUN.recordWriter.close()
+    core.RUN.recordWriter = None
+
+######################################################################
+# loadTestfile through import_test chains, with and without the plan cache
+######################################################################
+def _writeChain(testDir, depth, stepsPerTest=20):
+  for level in range(depth):
+    steps = []
+    if level + 1 < depth:
+      steps.append({"import_test": {"name": "chain_%s.json" % (level + 1)}})
+    for stepNum in range(stepsPerTest):
+      steps.append({"typeKeys": {"selector": {"id": "el%s" % stepNum}, "value": "level %s" % level}})
+    with open(os.path.join(testDir, "chain_%s.json" % level), 'w') as testFile:
+      json.dump({"steps": steps}, testFile)
+  return os.path.join(testDir, "chain_0.json")
+
+def benchLoadTestfile(args, results, workDir):
+  for depth in [10, 50]:
+    testDir = os.path.join(workDir, "tests_%s" % depth)
+    os.makedirs(testDir)
+    testPath = _writeChain(testDir, depth)
+
+    util_core.PLAN_CACHE_DIR = None
+    results["loadTestfile[depth=%s,cold]" % depth] = timeIt(lambda: util_core.loadTestfile(testPath), args.iterations)
+
+    util_core.PLAN_CACHE_DIR = os.path.join(workDir, "cache")
+    util_core.loadTestfile(testPath) # Prime the cache
+    results["loadTestfile[depth=%s,cached]" % depth] = timeIt(lambda: util_core.loadTestfile(testPath), args.iterations)
+
+######################################################################
+# displayTest rendering
+######################################################################
+def benchDisplayTest(args, results):
+  driver = FakeDriver(100)
+  for numSteps in [100, 1000]:
+    testObject = {"steps": _plan(driver, numSteps)}
+    result = timeIt(lambda: util_core.displayTest(testObject), max(args.iterations / 20, 1))
+    result["ops_per_sec"] = result["ops_per_sec"] * numSteps # Rows per second
+    results["displayTest[steps=%s]" % numSteps] = result
+
+######################################################################
+# Compare against the saved baseline and print a table
+######################################################################
+def report(results, baseline):
+  tab = tt.Texttable(max_width=1000)
+  tab.header(["Benchmark", "Ops/s", "Cmds/op", "Baseline Ops/s", "Change"])
+  regressions = []
+  for name in sorted(results.keys()):
+    result = results[name]
+    row = [name, "%.1f" % result["ops_per_sec"], "%.2f" % result["commands_per_op"], "-", "-"]
+    if name in baseline:
+      base = baseline[name]["ops_per_sec"]
+      change = (result["ops_per_sec"] - base) / base
+      row[3] = "%.1f" % base
+      row[4] = "%+.1f%%" % (change * 100)
+      if change < -REGRESSION_THRESHOLD:
+        regressions.append(name)
+    tab.add_row(row)
+  print Style.BRIGHT + Fore.CYAN + tab.draw() + Style.RESET_ALL
+  for name in regressions:
+    print Fore.RED + "Regression: %s is more than %i%% slower than its baseline" % (name, REGRESSION_THRESHOLD * 100) + Style.RESET_ALL
+  return regressions
+
+def generateParser():
+  parser = argparse.ArgumentParser(description="Benchmark pySel's hot paths against a fake WebDriver")
+  parser.add_argument('--elements', type=int, default=1000, help='Number of elements in the fake DOM')
+  parser.add_argument('--latency', type=float, default=0.0, help='Seconds of latency per WebDriver command')
+  parser.add_argument('--iterations', type=int, default=200, help='Iterations for the per-call benchmarks')
+  parser.add_argument('--save-baseline', action='store_true', help='Store these results as the new baseline')
+  return parser
+
+def main(argv):
+  args = generateParser().parse_args()
+  logging.basicConfig(level=logging.CRITICAL)
+
+  baseline = {}
+  if os.path.exists(FILE_BASELINE):
+    with open(FILE_BASELINE, 'r') as baselineFile:
+      baseline = json.load(baselineFile)
+
+  results = {}
+  workDir = tempfile.mkdtemp(prefix="pysel_bench_")
+  try:
+    benchGetObject(args, results)
+    benchExecuteTest(args, results, workDir)
+    benchLoadTestfile(args, results, workDir)
+    benchDisplayTest(args, results)
+  finally:
+    core.SCREENSHOT_WRITER.close()
+    shutil.rmtree(workDir, True)
+
+  regressions = report(results, baseline)
+  if args.save_baseline:
+    with open(FILE_BASELINE, 'w') as baselineFile:
+      json.dump(results, baselineFile, indent=2, sort_keys=True)
+    print "Baseline saved to %s" % FILE_BASELINE
+    return 0
+  return 1 if regressions else 0
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
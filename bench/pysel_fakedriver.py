@@ -0,0 +1,174 @@
+#!/usr/bin/python
+import time
+from selenium.common.exceptions import WebDriverException
+
+######################################################################
+# In-process stand-in for a WebDriver: a generated DOM of configurable
+# size, a fixed latency per command and a count of every command sent.
+######################################################################
+TAGS = ["div", "span", "input", "a", "button", "li"]
+
+# pySel checks dir(parent) for these, so they have to be real methods
+class _Finder:
+  def find_elements_by_id(self, value):
+    return self._find("id", value)
+
+  def find_elements_by_name(self, value):
+    return self._find("name", value)
+
+  def find_elements_by_class_name(self, value):
+    return self._find("class_name", value)
+
+  def find_elements_by_tag_name(self, value):
+    return self._find("tag_name", value)
+
+  def find_elements_by_xpath(self, value):
+    return self._find("xpath", value)
+
+class FakeElement(_Finder):
+  def __init__(self, driver, index, parent):
+    self.driver    = driver
+    self._id       = index
+    self.parent    = parent
+    self.children  = []
+    self.tag       = TAGS[index % len(TAGS)]
+    self.attrs     = {
+      "id":    "el%s" % index,
+      "name":  "name%s" % (index % 50),
+      "class": "cls%s" % (index % 10),
+    }
+    self.text      = "text %s" % index
+    self.displayed = index % 7 != 0  # Some hidden elements to filter out
+    self.enabled   = index % 11 != 0
+
+  def descendants(self):
+    for child in self.children:
+      yield child
+      for grandchild in child.descendants():
+        yield grandchild
+
+  def is_displayed(self):
+    self.driver._command("isElementDisplayed")
+    return self.displayed
+
+  def is_enabled(self):
+    self.driver._command("isElementEnabled")
+    return self.enabled
+
+  def send_keys(self, value):
+    self.driver._command("sendKeysToElement")
+
+  def click(self):
+    self.driver._command("clickElement")
+
+  def _find(self, by, value):
+    return self.driver._findElements(self.descendants(), by, value)
+
+class FakeDriver(_Finder):
+  def __init__(self, numElements=1000, latency=0.0, scripts=True):
+    self.latency    = latency   # Seconds slept per command, to model the wire
+    self.scripts    = scripts   # False makes execute_script fail, forcing the per-key path
+    self.session_id = "fake"
+    self.window_handles = ["main"]
+    self.current_url = "about:blank"
+    self.commands   = {}
+    self.elements   = []
+    # Every 20th element is a container (a form) for the 19 that follow it
+    container = None
+    for index in range(numElements):
+      element = FakeElement(self, index, container)
+      if container is not None:
+        container.children.append(element)
+      if index % 20 == 0:
+        container = element
+        element.tag = "form"
+      self.elements.append(element)
+
+  def resetCounts(self):
+    self.commands = {}
+
+  def commandCount(self):
+    return sum(self.commands.values())
+
+  def _command(self, name):
+    self.commands[name] = self.commands.get(name, 0) + 1
+    if self.latency:
+      time.sleep(self.latency)
+
+  #---------------------------------------------------------------------
+  # Element lookup, shared by the driver and elements
+  #---------------------------------------------------------------------
+  def _matches(self, element, by, value):
+    if by in ("id", "name"):
+      return element.attrs[by] == value
+    if by == "class_name":
+      return element.attrs["class"] == value
+    if by == "tag_name":
+      return element.tag == value
+    if by == "text":
+      return value in element.text
+    if by == "xpath": # Only the //*[contains(.,'...')] form pySel generates
+      return value.split("'")[1] in element.text
+    return False
+
+  def _findElements(self, candidates, by, value):
+    self._command("findElements")
+    return [e for e in candidates if self._matches(e, by, value)]
+
+  def _find(self, by, value):
+    return self._findElements(self.elements, by, value)
+
+  #---------------------------------------------------------------------
+  # Commands
+  #---------------------------------------------------------------------
+  def execute_script(self, script, *args):
+    self._command("executeScript")
+    if not self.scripts:
+      raise WebDriverException("javascript disabled")
+    if "var selectors = arguments[1]" in script: # pysel_directives._RESOLVE_ALL_SCRIPT
+      return [self._resolve(args[0], pairs)[:2] for pairs in args[1]]
+    if "var root = arguments[0]" in script: # pysel_directives._RESOLVE_SCRIPT
+      return self._resolve(args[0], args[1])
+    return None
+
+  def _resolve(self, root, pairs):
+    candidates = list(root.descendants()) if root is not None else self.elements
+    primary = None
+    for by, value in pairs:
+      visible = [e for e in candidates if self._matches(e, by, value) and e.displayed and e.enabled]
+      if not visible:
+        return []
+      if not primary:
+        primary = visible
+      else:
+        primaryIds = set([e._id for e in primary])
+        primary = [e for e in visible if e._id in primaryIds]
+      if len(primary) == 1:
+        break
+    return primary or []
+
+  def execute_async_script(self, script, *args):
+    self._command("executeAsyncScript")
+    if not self.scripts:
+      raise WebDriverException("javascript disabled")
+    return True # The page is always settled
+
+  def set_script_timeout(self, seconds):
+    self._command("setTimeouts")
+
+  def get(self, url):
+    self._command("get")
+    self.current_url = url
+
+  def implicitly_wait(self, seconds):
+    self._command("setTimeouts")
+
+  def get_screenshot_as_png(self):
+    self._command("screenshot")
+    return "fake-png"
+
+  def delete_all_cookies(self):
+    self._command("deleteAllCookies")
+
+  def quit(self):
+    self._command("quit")
@@ -1,6 +1,12 @@
 #!/usr/bin/python
-import sys, os
+import sys, os, time
 import pysel_core
+import pysel_suite
+import pysel_screenshot
+import pysel_shard
+import pysel_stats
+import pysel_optimize
+from pysel_runner import Runner
 import logging
 import argparse
 
@@ -32,11 +38,47 @@ def generateParser():
                     help='Starts pySel in Silent-mode for automation purposes')
   parser.add_argument('-l', '--nolog', action='count',
                     help='Brings output to stdout instead of log')
+  parser.add_argument('--trace-sample', action='store', type=float, default=pysel_core.TRACE_SAMPLE, metavar='RATE',
+                    help='Log this fraction of steps in full (e.g. 0.01), whatever the verbosity')
+  parser.add_argument('--durations', action='store', default=pysel_core.FILE_DURATIONS, metavar='PATH',
+                    help='Test durations to balance shards on (read only by sharded runs, updated by the others)')
+  parser.add_argument('--profile', action='store', default=pysel_core.DRIVER_PROFILE,
+                    help='Driver profile from conf.json for tests that do not name one')
+  parser.add_argument('--max-session-uses', action='store', type=int, default=pysel_core.SESSION_MAX_USES,
+                    help='Number of tests a warm browser runs before it is recycled (0 = never)')
+  parser.add_argument('--max-session-memory', action='store', type=int, default=pysel_core.SESSION_MAX_MEMORY_MB,
+                    help='JS heap size in MB at which a warm browser is recycled (0 = never)')
+
+  parser.add_argument('--checkpoint-every', action='store', type=int, default=pysel_core.CHECKPOINT_EVERY,
+                    help='Steps between browser state checkpoints (0 = only steps marked "checkpoint": true)')
+  parser.add_argument('--screenshots', action='store', choices=pysel_screenshot.POLICIES, default=pysel_screenshot.POLICY_ALL,
+                    help='When to take screenshots (failed steps are always captured)')
+  parser.add_argument('--screenshot-every', action='store', type=int, default=1,
+                    help='Steps between screenshots for the "every" policy')
+  parser.add_argument('--screenshot-scale', action='store', type=float, default=1.0,
+                    help='Downscale screenshots by this factor (needs PIL)')
+  parser.add_argument('--screenshot-quality', action='store', type=int, default=0,
+                    help='Save screenshots as JPEG at this quality instead of PNG (needs PIL)')
 
   # A test command
   test_parser = subparsers.add_parser('test', help='Execute a selenium test')
-  test_parser.add_argument('test_name', action='store', type=isValidTestName, help='Name of selenium testcase')
+  test_parser.add_argument('test_name', action='store', type=isValidTestName, nargs='?', help='Name of selenium testcase (omit with --shard)')
+  test_parser.add_argument('--resume-from', action='store', type=int, metavar='N', help='Restore the nearest checkpoint at or before step N and continue from there')
+  test_parser.add_argument('--rerun-failed', action='store_true', help='Resume from the step that failed in the last run')
+  test_parser.add_argument('--shard', action='store', type=pysel_shard.parseShard, help='Run shard i of N of all tests (e.g. 2/4), balanced on past durations')
+  suite_parser = subparsers.add_parser('suite', help='Execute every selenium test in a directory or glob')
+  suite_parser.add_argument('pattern', action='store', help='Directory or glob of testcases (relative to the test directory or cwd)')
+  suite_parser.add_argument('--shard', action='store', type=pysel_shard.parseShard, help='Run shard i of N of the matching tests (e.g. 2/4), balanced on past durations')
+  suite_parser.add_argument('--share-prefix', action='store_true', help='Run the leading steps tests have in common once and start each test from a copy of the browser state after them')
+  suite_parser.add_argument('-j', '--jobs', action='store', type=int, default=0, help='Number of worker processes, each with its own driver (default: number of cores)')
   create_parser = subparsers.add_parser('create', help='Create a selenium test using an interactive session with the driver')
+  optimize_parser = subparsers.add_parser('optimize', help='Replay a test and rewrite its selectors to the cheapest unique ones')
+  optimize_parser.add_argument('test_name', action='store', type=isValidTestName, help='Name of selenium testcase')
+  optimize_parser.add_argument('--dry-run', action='store_true', help='Only report the savings, leave the test file alone')
+  stats_parser = subparsers.add_parser('stats', help='Show the slowest steps, flakiest selectors and duration trends of past runs')
+  stats_parser.add_argument('test_name', action='store', nargs='?', help='Only show this test')
+  stats_parser.add_argument('--days', action='store', type=int, default=30, help='How far back to look (default: 30)')
+  stats_parser.add_argument('--limit', action='store', type=int, default=10, help='Rows per table (default: 10)')
 
   return parser
 
@@ -69,14 +111,62 @@ def main(argv):
   # Parse command line arguments
   results          = parser.parse_args()
   pysel_core.DEBUG = results.verbose
+  pysel_core.SILENT = bool(results.silent)
+  pysel_core.SESSION_MAX_USES = results.max_session_uses
+  pysel_core.SESSION_MAX_MEMORY_MB = results.max_session_memory
+  pysel_core.DRIVER_PROFILE = results.profile
+  pysel_core.TRACE_SAMPLE = results.trace_sample
+  pysel_core.CHECKPOINT_EVERY = results.checkpoint_every
+  pysel_core.FILE_DURATIONS = results.durations
+  runsTests = results.action in ('test', 'suite')
+  usesSuite = results.action == 'suite' or bool(getattr(results, 'shard', None))
+  if runsTests:
+    pysel_core.startRun()
+  else:
+    pysel_core.startTool()
   configureLogging(results.verbose, (results.nolog) or (results.action == 'create'))
+  if runsTests and not usesSuite: # runSuite prunes once its workers are forked
+    pysel_core.pruneRuns()
+  pysel_core.configureOutput()
+  pysel_core.configureScreenshots(results.screenshots, results.screenshot_every,
+                                  results.screenshot_scale, results.screenshot_quality)
 
   # Execute all the tests
   try:
     if results.action == 'test':
-      return pysel_core.runTest(results.test_name)
+      if bool(results.test_name) == bool(results.shard):
+        parser.error('test takes either a test_name or --shard')
+      if results.shard: # This node's share of every test, one at a time
+        exitCode = pysel_suite.runSuite('.', 1, results.shard, prune=True)
+      elif pysel_core.isDataTest(results.test_name): # One test per row of its dataset
+        pysel_core.openResults(results.test_name)
+        try:
+          runner = Runner(keepSteps=False)
+          exitCode = pysel_core.PYSEL_OK
+          for run in runner.runRows(results.test_name):
+            pysel_core.writeResult(runner.result(run))
+            exitCode = max(exitCode, run.exitCode)
+          logging.info("TEST:\t%s rows run, %s failed" % (runner.tests, runner.failed))
+        finally:
+          pysel_core.closeResults()
+      else:
+        pysel_core.openResults(results.test_name)
+        startTime = time.time()
+        try:
+          exitCode = pysel_core.runTest(results.test_name, results.resume_from, results.rerun_failed)
+          pysel_core.writeResult(pysel_core.testResult(results.test_name, exitCode, time.time() - startTime))
+        finally:
+          pysel_core.closeResults()
+      return exitCode
+    if results.action == 'suite':
+      exitCode = pysel_suite.runSuite(results.pattern, results.jobs, results.shard, results.share_prefix, prune=True)
+      return exitCode
     if results.action == 'create':
       return pysel_core.createTest()
+    if results.action == 'optimize':
+      return pysel_optimize.optimizeTest(results.test_name, results.dry_run)
+    if results.action == 'stats':
+      return pysel_stats.showStats(pysel_core.FILE_STATS, results.days, results.limit, results.test_name)
 
     else:
       logging.error('Unsupported command: %s' % results.action)
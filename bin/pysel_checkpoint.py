@@ -0,0 +1,119 @@
+#!/usr/bin/python
+import os, re
+import logging, hashlib
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+FILE_STATE       = "state.json"   # Where the last run stopped
+RE_CHECKPOINT    = re.compile(r"^step_(\d+)\.json$")
+
+_STORAGE_SCRIPT = r"""
+function dump(store) {
+  var out = {};
+  try { for (var i = 0; i < store.length; i++) out[store.key(i)] = store.getItem(store.key(i)); } catch (e) {}
+  return out;
+}
+return {url: window.location.href, local: dump(window.localStorage), session: dump(window.sessionStorage)};
+"""
+
+_RESTORE_STORAGE_SCRIPT = r"""
+function load(store, items) {
+  try { store.clear(); for (var key in items) store.setItem(key, items[key]); } catch (e) {}
+}
+load(window.localStorage, arguments[0]);
+load(window.sessionStorage, arguments[1]);
+"""
+
+######################################################################
+# Snapshot the browser: URL, cookies, localStorage and sessionStorage
+######################################################################
+def captureState(driver):
+  storage = driver.execute_script(_STORAGE_SCRIPT)
+  return {
+    "url":            storage["url"],
+    "cookies":        driver.get_cookies(),
+    "localStorage":   storage["local"],
+    "sessionStorage": storage["session"],
+  }
+
+######################################################################
+# Put a snapshot back into a (clean) browser
+######################################################################
+def restoreState(driver, state):
+  # Cookies and storage can only be set for the page's own origin, so go there first
+  driver.get(state["url"])
+  driver.delete_all_cookies()
+  for cookie in state["cookies"]:
+    driver.add_cookie(dict((k, v) for k, v in cookie.items() if v is not None))
+  driver.execute_script(_RESTORE_STORAGE_SCRIPT, state["localStorage"], state["sessionStorage"])
+  driver.get(state["url"]) # Reload so the page sees the restored state
+
+######################################################################
+# Identifies the steps leading up to a checkpoint, so checkpoints are
+# ignored once those steps are edited
+######################################################################
+def planHash(steps):
+  return hashlib.sha1(json.dumps(list(steps), sort_keys=True)).hexdigest()
+
+######################################################################
+# Checkpoint files: step_<n>.json holds the state before step n ran
+######################################################################
+def makeCheckpoint(stepNum, steps, state):
+  return {"step": stepNum, "plan": planHash(steps[:stepNum]), "state": state}
+
+def matchesPlan(checkpoint, steps):
+  return checkpoint["plan"] == planHash(steps[:checkpoint["step"]])
+
+def saveCheckpoint(checkpointDir, stepNum, steps, state):
+  if not os.path.isdir(checkpointDir):
+    os.makedirs(checkpointDir)
+  checkpoint = makeCheckpoint(stepNum, steps, state)
+  with open(os.path.join(checkpointDir, "step_%s.json" % stepNum), 'w') as checkpointFile:
+    json.dump(checkpoint, checkpointFile)
+  logging.debug("CHECKPOINT:\tSaved state before step %s" % (stepNum + 1))
+
+def findCheckpoint(checkpointDir, stepNum, steps):
+  if not os.path.isdir(checkpointDir):
+    return None
+  candidates = []
+  for f in os.listdir(checkpointDir):
+    match = RE_CHECKPOINT.match(f)
+    if match and int(match.group(1)) <= stepNum:
+      candidates.append(int(match.group(1)))
+  for candidate in sorted(candidates, reverse=True):
+    with open(os.path.join(checkpointDir, "step_%s.json" % candidate), 'r') as checkpointFile:
+      checkpoint = json.load(checkpointFile)
+    if matchesPlan(checkpoint, steps):
+      return checkpoint
+    logging.warning("CHECKPOINT:\tIgnoring checkpoint before step %s, the test has changed since" % (candidate + 1))
+  return None
+
+def clearCheckpoints(checkpointDir):
+  if not os.path.isdir(checkpointDir):
+    return
+  for f in os.listdir(checkpointDir):
+    os.unlink(os.path.join(checkpointDir, f))
+
+######################################################################
+# Remember where a run failed, for --rerun-failed
+######################################################################
+def saveFailedStep(checkpointDir, stepNum):
+  if not os.path.isdir(checkpointDir):
+    os.makedirs(checkpointDir)
+  with open(os.path.join(checkpointDir, FILE_STATE), 'w') as stateFile:
+    json.dump({"failedStep": stepNum}, stateFile)
+
+def loadFailedStep(checkpointDir):
+  statePath = os.path.join(checkpointDir, FILE_STATE)
+  if not os.path.exists(statePath):
+    return None
+  with open(statePath, 'r') as stateFile:
+    return json.load(stateFile).get("failedStep")
+
+def clearFailedStep(checkpointDir):
+  statePath = os.path.join(checkpointDir, FILE_STATE)
+  if os.path.exists(statePath):
+    os.unlink(statePath)
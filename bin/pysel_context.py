@@ -0,0 +1,50 @@
+#!/usr/bin/python
+import time
+
+######################################################################
+# The outcome of one step. Tests can be thousands of steps long, so
+# records use __slots__ rather than a dict each.
+######################################################################
+class StepRecord(object):
+  __slots__ = ("step", "directive", "status", "duration", "retries", "error")
+
+  # record is a step record from pysel_reporter
+  def __init__(self, record):
+    self.step      = record["step"]
+    self.directive = record["directive"]
+    self.status    = record["status"]
+    self.duration  = record["duration"]
+    self.retries   = record["retries"]
+    self.error     = record.get("error")
+
+######################################################################
+# Everything that belongs to one run of one test: where its output
+# goes, its counters and its step records. pysel_core.RUN is the
+# context of the test running (or the one that ran last); a fresh one
+# is made for every test, so nothing carries over between tests.
+######################################################################
+class RunContext(object):
+  __slots__ = ("test", "reportPath", "recordPath", "recordWriter", "checkpointDir", "screenshots", "steps",
+               "errors", "warnings", "pictures", "cacheHit", "cacheMiss", "failure", "exitCode", "start", "duration")
+
+  def __init__(self, testName=None, reportPath=None, recordPath=None, checkpointDir=None, keepSteps=True):
+    self.test          = testName
+    self.reportPath    = reportPath
+    self.recordPath    = recordPath    # JSON Lines file of the step records
+    self.recordWriter  = None
+    self.checkpointDir = checkpointDir # None when the run can't be resumed (e.g. a shared prefix)
+    self.screenshots   = []            # Manifest, filled in by the screenshot writer
+    self.steps         = [] if keepSteps else None
+    self.errors        = 0
+    self.warnings      = 0
+    self.pictures      = 0
+    self.cacheHit      = 0
+    self.cacheMiss     = 0
+    self.failure       = None          # First thing that went wrong
+    self.exitCode      = 0
+    self.start         = time.time()
+    self.duration      = None
+
+  def addStep(self, record):
+    if self.steps is not None:
+      self.steps.append(StepRecord(record))
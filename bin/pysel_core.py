@@ -7,13 +7,25 @@ from termcolor import colored, cprint
 
 import os, re, sys, time, datetime, pwd, grp
 import socket, httplib, urllib2
-import logging
+import logging, traceback, atexit, random
 import texttable as tt
 from colorama import Fore, Back, Style
 from time import strftime as date
 
 import pysel_util_core    as util_core
 import pysel_util_create  as util_create
+import pysel_directives   as directives
+import pysel_reporter     as reporter
+from pysel_session        import SessionPool, enableKeepAlive
+import pysel_screenshot   as screenshot
+import pysel_checkpoint   as checkpoint
+import pysel_profile      as profile
+import pysel_stats        as stats
+import pysel_events       as events
+import pysel_retention    as retention
+import pysel_dataset      as dataset
+import pysel_conditions   as conditions
+from pysel_context        import RunContext
 
 try:
   import json
@@ -23,6 +35,8 @@ except ImportError:
 # Debugging
 DEBUG = 0
 INTERACTIVE = False
+SILENT = False
+AUTO_PILOT = False
 
 # Directory specifiers
 APP                = 'pysel'
@@ -31,10 +45,17 @@ DIR_APP            = '%s'                     % (DIR_APP_ROOT)
 DIR_TEST           = '%s/test'                % (DIR_APP)
 DIR_LIB            = '%s/lib'                 % (DIR_APP)
 DIR_CONF           = '%s/conf'                % (DIR_APP)
-DIR_LOG            = '%s/output/log'          % (DIR_APP_ROOT)
-DIR_RAW            = '%s/output/raw'          % (DIR_APP_ROOT)
-DIR_REPORT         = '%s/output/report'       % (DIR_APP_ROOT)
+DIR_RUNS           = '%s/output/runs'         % (DIR_APP_ROOT) # One directory per invocation, see startRun
+RUN_ID             = '%s-%s'                  % (date("%Y%m%dT%H%M%S"), os.getpid())
+DIR_RUN            = '%s/%s'                  % (DIR_RUNS, RUN_ID)
+DIR_LOG            = '%s/log'                 % (DIR_RUN)
+DIR_TOOL_LOG       = '%s/output/log'          % (DIR_APP_ROOT) # Logs of actions that run no tests, see startTool
+DIR_RAW            = '%s/raw'                 % (DIR_RUN)
+DIR_REPORT         = '%s/report'              % (DIR_RUN)
+DIR_CHECKPOINT     = '%s/output/checkpoints'  % (DIR_APP_ROOT) # Kept across runs, for --rerun-failed
 DIR_RESPONSE       = '%s/output/response'     % (DIR_APP_ROOT)
+DIR_CACHE          = '%s/output/cache'        % (DIR_APP_ROOT)
+DIR_BLOB           = '%s/output/blobs'        % (DIR_APP_ROOT)
 DIR_CONF           = '%s/conf'                % (DIR_APP)
 
 # File Extensions
@@ -43,21 +64,53 @@ EXT_RAW            = 'raw'
 EXT_LOG            = 'log'
 EXT_REPORT         = 'rpt'
 EXT_RESPONSE       = 'txt'
+EXT_RECORD         = 'jsonl'
 BASH_EXEC          = '/bin/bash'
 
 FILE_LOG           = 'pysel_%s' % (date("%Y%m%dT%H%M%S"))
+FILE_CONF          = '%s/conf.json'           % (DIR_APP_ROOT)
+FILE_DURATIONS     = '%s/output/durations.json' % (DIR_APP_ROOT) # Test durations used to balance shards
+FILE_RESULTS       = '%s/results.jsonl'       % (DIR_REPORT) # One record per finished test, for CI
+FILE_JUNIT         = '%s/junit.xml'           % (DIR_REPORT)
+FILE_STATS         = '%s/output/stats.db'     % (DIR_APP_ROOT) # History of every run, see 'pysel.py stats'
+DIR_PREFIX         = '_prefixes'              # Reports of a suite's shared prefixes (under DIR_REPORT and DIR_RAW)
 
 # Customize the HTTP Request Headers
 USER_AGENT_STR     = 'FeedHenry PySel Automated Tester 0.2'
 CONNECTION_TIMEOUT = 30
 
-# Customize the Implicit waits for elements
-IMPLICIT_WAIT      = 30
+# Customize the waits for elements. Implicit waits stay off: every lookup polls
+# explicitly, so a negative check isn't held up by the driver.
+IMPLICIT_WAIT      = 0
+ELEMENT_TIMEOUT    = 30                   # Seconds to wait for an element to appear (step key: "timeout")
+ABSENT_TIMEOUT     = 2                    # Seconds to wait for an element to go away (step key: "absent_timeout")
+POLL_INTERVAL      = 0.1                  # Seconds between lookups while waiting
 
-# Create global counters
-COUNT_ERROR        = 0
-COUNT_WARNING      = 0
-COUNT_PIC          = 0
+# What a click waits for before the next step (step key: "settle", see pysel_conditions)
+SETTLE_DOM_QUIET   = 100                  # Milliseconds without DOM mutations
+SETTLE_NETWORK_IDLE= 0                    # Milliseconds without XHR/fetch in flight
+SETTLE_TIMEOUT     = 5                    # Seconds before giving up and moving on
+
+# Warm browser sessions reused across tests
+SESSION_MAX_USES      = 25                # Tests run before a browser is recycled (0 = never)
+SESSION_MAX_MEMORY_MB = 512               # JS heap size at which a browser is recycled (0 = never)
+SESSION_KEEP_ALIVE    = True              # Reuse one HTTP connection per session for WebDriver commands
+
+# Driver profile (see pysel_profile); a test's own "profile" key wins over this
+DRIVER_PROFILE     = profile.DEFAULT_PROFILE
+
+# Screenshot capture (see pysel_screenshot for the policies)
+SCREENSHOT_POLICY  = screenshot.POLICY_ALL
+SCREENSHOT_EVERY   = 1                    # Steps between captures for the 'every' policy
+SCREENSHOT_WRITER  = screenshot.ScreenshotWriter(DIR_BLOB)
+
+# Log every step in full for a random sample of steps, whatever the verbosity
+TRACE_SAMPLE       = 0.0                  # Fraction of steps traced (0 = off)
+LOG                = logging.getLogger()
+TRACE              = logging.getLogger("pysel.trace") # Propagates to the root handlers, bypassing the root level
+
+# Browser state checkpoints, for resuming a failed test part way through
+CHECKPOINT_EVERY   = 10                   # Steps between checkpoints (0 = only steps with "checkpoint": true)
 
 # Define our own severity levels
 PYSEL_OK           = 0                    # OK
@@ -81,57 +134,210 @@ except KeyError:
   UID = -1 # Apparently, this will cause the chown commands to ignore this variable -
   GID = -1 # both user and group
 
+util_core.UID = UID
+util_core.GID = GID
+util_core.PLAN_CACHE_DIR = DIR_CACHE
+if DIR_LIB not in sys.path: # Once per process, not per browser started
+  sys.path.append(DIR_LIB)
+
 # http://code.google.com/p/chromedriver/wiki/GettingStarted
 DRIVER = None
+# Pool the current DRIVER was leased from
+DRIVER_POOL = None
+# Driver profiles from FILE_CONF, loaded on first use
+DRIVER_PROFILES = None
+# One pool of warm sessions per profile
+SESSION_POOLS = {}
+
+# Run-wide result writers (JSON Lines and JUnit XML), see openResults
+RESULT_WRITERS = None
+# Counters, output paths and step records of the test running, or of the
+# last one (see pysel_context). Directives run outside a test count here.
+RUN = RunContext()
 
 ######################################################################
 # Create webdriver
 ######################################################################
-def initDriver():
-  global DRIVER
-  # DRIVER = webdriver.Firefox()
+def buildDriver(profileName=profile.DEFAULT_PROFILE):
+  # driver = webdriver.Firefox()
+  driverProfile = getDriverProfile(profileName)
   driverPath = "%s/chromedriver" % DIR_LIB
-  sys.path.append(DIR_LIB)
-  DRIVER = webdriver.Chrome(driverPath)
+  driver = webdriver.Chrome(driverPath, chrome_options=profile.chromeOptions(driverProfile))
+  if SESSION_KEEP_ALIVE:
+    enableKeepAlive(driver)
+  profile.applyProfile(driver, driverProfile)
+  return driver
+
+def getDriverProfile(profileName):
+  global DRIVER_PROFILES
+  if DRIVER_PROFILES is None:
+    DRIVER_PROFILES = profile.loadProfiles(FILE_CONF)
+  return profile.getProfile(DRIVER_PROFILES, profileName)
+
+######################################################################
+# Sessions of different profiles can't stand in for each other, so
+# each profile gets its own pool
+######################################################################
+def getSessionPool(profileName):
+  if profileName not in SESSION_POOLS:
+    getDriverProfile(profileName) # Fail on unknown profiles before anything is leased
+    SESSION_POOLS[profileName] = SessionPool(lambda: buildDriver(profileName),
+      maxUses=SESSION_MAX_USES, maxMemoryMB=SESSION_MAX_MEMORY_MB, onStop=conditions.forgetSession)
+  return SESSION_POOLS[profileName]
+
+######################################################################
+# Lease a webdriver from the session pool of a profile (DRIVER_PROFILE by default)
+######################################################################
+def initDriver(profileName=None):
+  global DRIVER, DRIVER_POOL
+  DRIVER_POOL = getSessionPool(profileName or DRIVER_PROFILE)
+  DRIVER = DRIVER_POOL.lease()
+  directives.clearCache()
   DRIVER.implicitly_wait(IMPLICIT_WAIT)
 
 ######################################################################
-# Quit the driver
+# Note a URL the driver is sent to, so its origin's storage is cleared
+# before the browser runs another test
+######################################################################
+def visitUrl(url):
+  if DRIVER_POOL is not None:
+    DRIVER_POOL.visit(DRIVER, url)
+
+######################################################################
+# Hand the driver back to the session pool
 ######################################################################
 def quitDriver():
   global DRIVER
-  DRIVER.quit() 
+  DRIVER_POOL.release(DRIVER)
+  DRIVER = None
+
+######################################################################
+# Quit every warm browser and drain the screenshot writer
+######################################################################
+def closeSessions():
+  for pool in SESSION_POOLS.values():
+    pool.closeAll()
+  SCREENSHOT_WRITER.close()
+  events.close()
+  retention.waitForPruner()
+
+atexit.register(closeSessions)
+
+######################################################################
+# Give this invocation its own output directory (DIR_RUN) and point
+# output/runs/latest at it
+######################################################################
+def startRun():
+  retention.startRun(DIR_RUNS, RUN_ID)
+  atexit.register(retention.finishRun, DIR_RUN)
+  # Logging isn't configured yet, and the first thing logged would configure it
+  if not os.path.isdir(DIR_LOG):
+    os.makedirs(DIR_LOG)
+
+######################################################################
+# Actions that run no tests (create, optimize, stats) get no run
+# directory, so they never push a test run out of the retention policy
+######################################################################
+def startTool():
+  global DIR_LOG
+  DIR_LOG = DIR_TOOL_LOG
+  if not os.path.isdir(DIR_LOG):
+    os.makedirs(DIR_LOG)
+
+######################################################################
+# Delete the runs outside the retention policy in conf.json, and the
+# screenshots only they referred to, on a background thread
+######################################################################
+def pruneRuns():
+  retention.startPruner(DIR_RUNS, retention.loadRetention(FILE_CONF), RUN_ID, collectScreenshots)
 
 ######################################################################
 # Raise an Error in the manner which you are acustomed to
 ######################################################################
 def raiseError(str, data=None):
-  global COUNT_ERROR
-  COUNT_ERROR = COUNT_ERROR + 1
-  cprint("\nError: %s " % str, 'red')
-  if data:
-    cprint(json.dumps(data, sort_keys=True, indent=4), 'cyan')
+  RUN.errors = RUN.errors + 1
+  events.publish(events.ERROR, message=str, data=data)
 
 ######################################################################
 # Raise a Warning for the craic
 ######################################################################
 def raiseWarning(str, data=None):
-  global COUNT_WARNING
-  COUNT_WARNING = COUNT_WARNING + 1
-  cprint("\nWarning: %s " % str, 'yellow')
+  RUN.warnings = RUN.warnings + 1
+  events.publish(events.WARNING, message=str, data=data)
+
+######################################################################
+# Output subscribers: what gets shown on the console and in the log.
+# Nothing is subscribed for output that is switched off, so it costs
+# nothing to publish.
+######################################################################
+OUTPUT_SUBSCRIPTIONS = []
+
+def configureOutput():
+  TRACE.setLevel(logging.INFO if TRACE_SAMPLE else logging.NOTSET)
+  while OUTPUT_SUBSCRIPTIONS: # Suite workers inherit the parent's subscriptions
+    events.unsubscribe(*OUTPUT_SUBSCRIPTIONS.pop())
+  subscriptions = []
+  if not SILENT:
+    util_core.watchTerminal()
+    subscriptions.extend([
+      (events.TEST_STARTED,  _showTest),
+      (events.STEP_STARTED,  _showProgress),
+      (events.STEP_FINISHED, _showProgress),
+      (events.STEP_FAILED,   _showFailure),
+      (events.TEST_DONE,     _showSummary),
+      (events.ERROR,         _showError),
+      (events.WARNING,       _showWarning),
+    ])
+  if logging.getLogger().isEnabledFor(logging.ERROR):
+    subscriptions.append((events.STEP_FAILED, _logFailure))
+  if logging.getLogger().isEnabledFor(logging.INFO):
+    subscriptions.append((events.TEST_DONE, _logDone))
+  for event, callback in subscriptions:
+    events.subscribe(event, callback)
+    OUTPUT_SUBSCRIPTIONS.append((event, callback))
+
+def _showTest(test, testObject):
+  util_core.displayTest(testObject)
+
+def _showProgress(step, numSteps, record=None, test=None):
+  if numSteps is None: # A step run on its own
+    return
+  if record is not None: # Finished
+    step = step + 1
+  util_core.drawProgress(step, numSteps)
+
+def _showFailure(test, step, numSteps, error, testObject):
+  util_core.displayTest(testObject, offset=step-1, currentStep=step, numSteps=3)
+
+def _showSummary(report, **result):
+  endSummary(report)
+
+def _showError(message, data):
+  cprint("\nError: %s " % message, 'red')
+  if data:
+    cprint(json.dumps(data, sort_keys=True, indent=4), 'cyan')
+
+def _showWarning(message, data):
+  cprint("\nWarning: %s " % message, 'yellow')
   if data:
     cprint(json.dumps(data, sort_keys=True, indent=4), 'cyan')
 
+def _logFailure(test, step, numSteps, error, testObject):
+  logging.error("Error detected: %s", describeError(error))
+
+def _logDone(test, exitCode, **result):
+  logging.info("TEST:\t%s finished with status %s", test, exitCode)
+
 ######################################################################
 # Summarise test results with various info
 ######################################################################
 def endSummary(reportPath):
   state = "Success"
   sumCol = "green"
-  if COUNT_WARNING > 0:
+  if RUN.warnings > 0:
     state = "Warning"
     sumCol = "yellow"
-  if COUNT_ERROR > 0:
+  if RUN.errors > 0:
     state = "Error"
     sumCol = "red"
 
@@ -139,9 +345,10 @@ def endSummary(reportPath):
   print "State:\t",
   cprint(state, sumCol)
   print "Warns:\t", 
-  cprint(COUNT_WARNING, "yellow")
+  cprint(RUN.warnings, "yellow")
   print "Errors:\t", 
-  cprint(COUNT_ERROR, "red")
+  cprint(RUN.errors, "red")
+  print "Cache:\t%s hits, %s misses" % (RUN.cacheHit, RUN.cacheMiss)
   print "Report:\t", 
   cprint(reportPath, "cyan")
   print "Log:\t", 
@@ -152,11 +359,14 @@ def endSummary(reportPath):
 # Offer the User to abandon the test as is in case of an error!
 #---------------------------------------------------------------------
 def suggestContinue():
+  if AUTO_PILOT:
+    return None
+  events.flush() # Show what went wrong before asking
   cont = ""
-  while cont not in ["y", "n"] and not AUTO_PILOT:
+  while cont not in ["y", "n"]:
     cont = raw_input("Continue? (y/n) ").lower()
   if cont == "n":
-    quitDriver()
+    return None
   else:
     stepNum = raw_input("Enter Step Number To Continue From: ")
     return int(stepNum) - 1
@@ -165,99 +375,388 @@ def suggestContinue():
 # Take a screenshot
 ######################################################################
 def takeScreenShot(name=None):
-  global COUNT_PIC
   if (name == None):
-    screenShotPath = "%s/screen_%s.png" % (DIR_REPORT, COUNT_PIC)
+    screenShotName = "screen_%s" % (RUN.pictures)
   else:
-    screenShotPath = "%s/screen_%s_%s.png" % (DIR_REPORT, COUNT_PIC, name)  
+    screenShotName = "screen_%s_%s" % (RUN.pictures, name)
+
+  RUN.pictures = RUN.pictures +1 
+  logging.debug("SCREEN:\tSaving Screenshot: %s", screenShotName)
+  # Only the capture happens here; hashing, encoding and storing happen on the writer thread
+  SCREENSHOT_WRITER.submit(screenShotName, DRIVER.get_screenshot_as_png(), RUN.screenshots)
+
+######################################################################
+# Remove screenshot blobs no report of any kept run refers to any more
+######################################################################
+def collectScreenshots():
+  return screenshot.collectGarbage(DIR_BLOB, DIR_RUNS)
 
-  COUNT_PIC = COUNT_PIC +1 
-  logging.debug("SCREEN:\tSaving Screenshot to: %s" % screenShotPath)
-  DRIVER.save_screenshot(screenShotPath)
+######################################################################
+# Configure when screenshots are taken and how they are stored
+######################################################################
+def configureScreenshots(policy, every=1, scale=1.0, jpegQuality=0):
+  global SCREENSHOT_POLICY, SCREENSHOT_EVERY
+  SCREENSHOT_POLICY = policy
+  SCREENSHOT_EVERY = every
+  SCREENSHOT_WRITER.scale = scale
+  SCREENSHOT_WRITER.jpegQuality = jpegQuality
+  if (scale != 1.0 or jpegQuality) and not screenshot.Image:
+    logging.warning("SCREEN:\tPIL is not installed, screenshots will be saved unscaled and uncompressed")
 
 ######################################################################
-# Find, load, and execute a test
+# Find, load, and execute a test. fromCheckpoint starts it from another
+# session's state (a suite's shared prefix) instead of from step 1.
+# The test's counters and step records are in RUN afterwards; keepSteps
+# False leaves the step records out (they are on disk either way).
+# testObject runs those steps instead of loading the test (the rows of a
+# data-driven test); they can't be resumed by name, so get no checkpoints.
 ######################################################################
-def runTest(testName):
-  global exitCode, DIR_REPORT, exitMsg
+def runTest(testName, resumeFrom=None, rerunFailed=False, fromCheckpoint=None, keepSteps=True, testObject=None):
+  global RUN
   exitCode = 0
 
-  DIR_REPORT = os.path.join(DIR_REPORT, testName)
-  util_core.mkdir(DIR_REPORT)
-  util_core.clearDirectory(DIR_REPORT, recursive)
+  # Tests outside DIR_TEST arrive as absolute paths; keep their reports inside DIR_REPORT
+  reportName = os.path.basename(testName) if os.path.isabs(testName) else testName
+  reportPath = os.path.join(DIR_REPORT, reportName)
+  checkpointDir = os.path.join(DIR_CHECKPOINT, reportName) if testObject is None else None
+  RUN = RunContext(testName, reportPath, os.path.join(DIR_RAW, reportName + '.' + EXT_RECORD),
+                   checkpointDir, keepSteps)
+  util_core.mkdir(RUN.reportPath) # A new run directory, so there is nothing to clear
+  RUN.recordWriter = reporter.RecordWriter(RUN.recordPath)
+
+  # Steps are numbered from 1 on the command line and from 0 here
+  resumeStep = None
+  if rerunFailed and RUN.checkpointDir is not None:
+    resumeStep = checkpoint.loadFailedStep(RUN.checkpointDir)
+    if resumeStep is None:
+      logging.warning("CHECKPOINT:\tNo failed step recorded for %s, running it from the start" % testName)
+  elif resumeFrom:
+    resumeStep = resumeFrom - 1
 
   # Check if file is already reachable using the file name given.
   try:
-    initDriver()
+    logging.debug('\nTEST:\tName=%s', testName)
+    logging.debug('Processing: %s', testName)
+    if testObject is None:
+      testPath = os.path.join(DIR_TEST, testName+'.'+EXT_TEST) 
+      testObject = util_core.loadTestfile(testPath)
+    if testObject.get("dataset"):
+      raise ValueError("%s is data-driven, run it with pysel.py test or dataRows()" % testName)
+    initDriver(testObject.get("profile"))
     
-    logging.debug('\nTEST:\tName=%s' % (testName))
-    logging.debug('Processing: %s' % (testName))
-    testPath = os.path.join(DIR_TEST, testName+'.'+EXT_TEST) 
-    testObject = util_core.loadTestfile(testPath)
-    
-    logging.info("TEST:\tTest File Loaded! %s" % testName)
-    util_core.displayTest(testObject)
+    logging.info("TEST:\tTest File Loaded! %s", testName)
+    events.publish(events.TEST_STARTED, test=testName, testObject=testObject)
+
+    startStep = 0
+    if resumeStep is not None:
+      startStep = resumeTest(testObject["steps"], resumeStep)
+    else:
+      if RUN.checkpointDir is not None:
+        checkpoint.clearCheckpoints(RUN.checkpointDir)
+      if fromCheckpoint is not None:
+        if checkpoint.matchesPlan(fromCheckpoint, testObject["steps"]):
+          startStep = restoreCheckpoint(fromCheckpoint)
+        else:
+          logging.warning("CHECKPOINT:\tShared prefix does not match %s, running it from the start" % testName)
     
-    executeTest(testName, testObject)
-    exitMsg = 'Test processed with overall status: %s' % (exitCode)
+    executeTest(testName, testObject, startStep)
+    if RUN.errors > 0:
+      exitCode = PYSEL_SEV5
+    elif RUN.checkpointDir is not None:
+      checkpoint.clearFailedStep(RUN.checkpointDir)
   except:
     exitCode = PYSEL_SEV1
+    RUN.failure = describeError(sys.exc_info()[1])
     logging.critical("ERROR!")
     logging.error(traceback.format_exc())
   finally:
-    quitDriver()
+    closeTest()
 
-  endSummary(DIR_REPORT)
+  RUN.exitCode = exitCode
+  RUN.duration = time.time() - RUN.start
+  events.publish(events.TEST_DONE, test=testName, exitCode=exitCode, errors=RUN.errors, warnings=RUN.warnings,
+                 cacheHit=RUN.cacheHit, cacheMiss=RUN.cacheMiss, report=RUN.reportPath)
+  events.flush()
   return exitCode
 
+######################################################################
+# Whether a test is data-driven (has a "dataset"). Only the test file
+# itself is read: anything wrong with it or its imports is left to
+# runTest, which reports it.
+######################################################################
+def isDataTest(testName):
+  testPath = os.path.join(DIR_TEST, testName+'.'+EXT_TEST)
+  try:
+    with open(testPath, 'r') as testFile:
+      testObject = json.load(testFile)
+  except (IOError, ValueError):
+    return False
+  return isinstance(testObject, dict) and bool(testObject.get("dataset"))
+
+######################################################################
+# The rows of a data-driven test (its "dataset" is relative to the test
+# file) as (rowTestName, testObject) pairs, made as they are asked for
+######################################################################
+def dataRows(testName):
+  testPath = os.path.join(DIR_TEST, testName+'.'+EXT_TEST)
+  testObject = util_core.loadTestfile(testPath)
+  datasetPath = dataset.datasetPath(testPath, testObject)
+  return (("%s_row%s" % (testName, rowNum), rowTest) for rowNum, rowTest in dataset.expandTest(testObject, datasetPath))
+
+######################################################################
+# Number of tests a test runs as: the rows of its dataset, or 1
+######################################################################
+def countRuns(testName):
+  testPath = os.path.join(DIR_TEST, testName+'.'+EXT_TEST)
+  try:
+    with open(testPath, 'r') as testFile:
+      testObject = json.load(testFile)
+    if not isinstance(testObject, dict) or not testObject.get("dataset"):
+      return 1
+    return dataset.countRows(dataset.datasetPath(testPath, testObject))
+  except (IOError, ValueError): # runTest or runRows reports it
+    return 1
+
+######################################################################
+# One line for an exception (some, like TimeoutException, have no message)
+######################################################################
+def describeError(e):
+  message = ("%s" % e).strip().split("\n")[0]
+  if message:
+    return "%s: %s" % (e.__class__.__name__, message)
+  return e.__class__.__name__
+
+######################################################################
+# The context of a test that failed before it could run (e.g. its
+# dataset can't be read), so it is recorded with its error all the same
+######################################################################
+def failedRun(testName, error, duration):
+  run = RunContext(testName)
+  run.failure = describeError(error)
+  run.exitCode = PYSEL_SEV1
+  run.duration = duration
+  return run
+
+######################################################################
+# Summary of the test that just ran (or of run, a RunContext), as
+# recorded in the results
+######################################################################
+def testResult(testName, exitCode, duration, run=None):
+  run = run or RUN
+  return {
+    "type":      "test",
+    "test":      testName,
+    "exitCode":  exitCode,
+    "errors":    run.errors,
+    "warnings":  run.warnings,
+    "cacheHit":  run.cacheHit,
+    "cacheMiss": run.cacheMiss,
+    "failure":   run.failure,
+    "report":    run.reportPath,
+    "records":   run.recordPath,
+    "start":     time.time() - duration,
+    "duration":  duration,
+  }
+
+######################################################################
+# Stream test results to FILE_RESULTS and FILE_JUNIT as they come in,
+# and add them to the history in FILE_STATS. Only the process that
+# collects the results writes them.
+######################################################################
+def openResults(runName):
+  global RESULT_WRITERS
+  RESULT_WRITERS = (reporter.RecordWriter(FILE_RESULTS), reporter.JUnitWriter(FILE_JUNIT, runName),
+                    stats.StatsStore(FILE_STATS, runName))
+
+def writeResult(result):
+  if RESULT_WRITERS is None:
+    return
+  records, junit, history = RESULT_WRITERS
+  records.write(result)
+  status = "passed"
+  if result["exitCode"] == PYSEL_SEV1:
+    status = "error"
+  elif result["exitCode"] != PYSEL_OK:
+    status = "failed"
+  testName = result["test"]
+  className = "pysel"
+  if not os.path.isabs(testName): # Tests in sub-directories of DIR_TEST get a package each
+    className = ".".join([className] + [part for part in os.path.dirname(testName).split(os.sep) if part])
+  junit.write(className, os.path.basename(testName), result["duration"], status,
+              result["failure"] or "%s errors" % result["errors"], "Report: %s" % result["report"])
+  history.addTest(result, status, result["records"])
+
+def closeResults():
+  global RESULT_WRITERS
+  if RESULT_WRITERS is None:
+    return
+  for writer in RESULT_WRITERS:
+    writer.close()
+  RESULT_WRITERS = None
+
+######################################################################
+# Run the steps a suite's tests share once and return a checkpoint of
+# the browser after them (None if they failed)
+######################################################################
+def runPrefix(prefixName, prefixSteps, fromCheckpoint=None, profileName=None):
+  global RUN
+  RUN = RunContext(prefixName, os.path.join(DIR_REPORT, DIR_PREFIX, prefixName),
+                   os.path.join(DIR_RAW, DIR_PREFIX, prefixName + '.' + EXT_RECORD), keepSteps=False)
+  util_core.mkdir(RUN.reportPath)
+  RUN.recordWriter = reporter.RecordWriter(RUN.recordPath)
+
+  shared = None
+  try:
+    initDriver(profileName)
+    startStep = 0
+    if fromCheckpoint is not None:
+      startStep = restoreCheckpoint(fromCheckpoint)
+    executeTest(prefixName, {"steps": prefixSteps}, startStep)
+    if RUN.errors == 0:
+      shared = checkpoint.makeCheckpoint(len(prefixSteps), prefixSteps, checkpoint.captureState(DRIVER))
+  except:
+    logging.error(traceback.format_exc())
+  finally:
+    closeTest()
+  return shared
+
+######################################################################
+# Release the driver and write out what the test produced
+######################################################################
+def closeTest():
+  if DRIVER:
+    quitDriver()
+  events.flush() # Step records are written on the bus thread
+  SCREENSHOT_WRITER.flush()
+  screenshot.writeManifest(RUN.reportPath, RUN.screenshots)
+  RUN.screenshots = []
+  RUN.recordWriter.close()
+  RUN.recordWriter = None
+
+######################################################################
+# Restore the nearest checkpoint at or before resumeStep, returning the
+# step to continue from (0 when there is none to restore)
+######################################################################
+def resumeTest(testSteps, resumeStep):
+  found = checkpoint.findCheckpoint(RUN.checkpointDir, resumeStep, testSteps)
+  if found is None:
+    logging.warning("CHECKPOINT:\tNo checkpoint at or before step %s, running from the start" % (resumeStep + 1))
+    return 0
+  return restoreCheckpoint(found)
+
+def restoreCheckpoint(found):
+  logging.info("CHECKPOINT:\tRestoring state before step %s", found["step"] + 1)
+  visitUrl(found["state"]["url"])
+  checkpoint.restoreState(DRIVER, found["state"])
+  directives.clearCache()
+  return found["step"]
+
 ######################################################################
 # Execute the specified test by sending the appropriate HTTP request
 ######################################################################
-def manageStep(step):
+def manageStep(step, stepNum=0, numSteps=None):
   stepType = step.keys()[0]
-  logging.debug("TEST:\tRunning step: %s" % stepType)
-  logging.info(json.dumps(step, sort_keys=True, indent=4))
+  traced = TRACE_SAMPLE and random.random() < TRACE_SAMPLE
+  if traced:
+    TRACE.info("TRACE:\tStep %s: %s", stepNum + 1, reporter.LazyJson(step))
+  elif LOG.isEnabledFor(logging.INFO):
+    logging.debug("TEST:\tRunning step: %s", stepType)
+    logging.info("%s", reporter.LazyJson(step))
 
   stepData = step[stepType]
 
   methodToCall = getattr(directives, stepType)
+  selector = stepData.get("selector") if isinstance(stepData, dict) else None
+  if selector is not None:
+    selector = json.dumps(selector, sort_keys=True)
+  timer = reporter.startStep(stepNum, stepType, selector)
   try:
     result = methodToCall(stepData)
-    takeScreenShot()
+    with timer.phase("screenshot"):
+      if screenshot.shouldCapture(SCREENSHOT_POLICY, stepNum, stepType, False, SCREENSHOT_EVERY):
+        takeScreenShot()
+    record = reporter.endStep("ok")
+    RUN.addStep(record)
+    if traced:
+      TRACE.info("TRACE:\tStep %s done: %s", stepNum + 1, reporter.LazyJson(record, None))
+    events.publish(events.STEP_FINISHED, step=stepNum, numSteps=numSteps, record=record)
     return PYSEL_OK, result
   except Exception, e:
-    takeScreenShot("ERROR")
+    with timer.phase("screenshot"):
+      takeScreenShot("ERROR")
+    record = reporter.endStep("error", e)
+    RUN.addStep(record)
+    if traced:
+      TRACE.info("TRACE:\tStep %s failed: %s", stepNum + 1, reporter.LazyJson(record, None))
+    events.publish(events.STEP_FINISHED, step=stepNum, numSteps=numSteps, record=record)
     return PYSEL_SEV5, e
+
+######################################################################
+# Append a record to the current test's timing records
+######################################################################
+def writeRecord(step, numSteps, record):
+  if RUN.recordWriter:
+    RUN.recordWriter.write(record)
+
+events.subscribe(events.STEP_FINISHED, writeRecord)
   
 ######################################################################
 # Once a URL has been generated - or otherwise ready - run the test
 ######################################################################
-def executeTest(testName, testObject):
+def executeTest(testName, testObject, startStep=0):
   testName = os.path.basename(testName)
   testSteps = testObject.get('steps')
   numSteps = len(testSteps)
-  for currentStep in range(numSteps):
-    drawProgress(currentStep, numSteps)
+  currentStep = startStep
+  while currentStep < numSteps:
+    events.publish(events.STEP_STARTED, test=testName, step=currentStep, numSteps=numSteps)
 
     step = testSteps[currentStep]
-    status, output = manageStep(step)
+    if currentStep > startStep and shouldCheckpoint(currentStep, step):
+      saveCheckpoint(currentStep, testSteps)
+
+    status, output = manageStep(step, currentStep, numSteps)
     if (status != PYSEL_OK):
-      logging.error("Error detected: %s" % output)
+      if RUN.failure is None:
+        RUN.failure = "Step %s (%s): %s" % (currentStep + 1, step.keys()[0], describeError(output))
       raiseError("Error in Step %s. Sub-section of steps shown below:" % currentStep)
-      displayTest(testObject, offset=currentStep-1, currentStep=currentStep, numSteps=3)
-      currentStep = suggestContinue()
+      if RUN.checkpointDir is not None:
+        checkpoint.saveFailedStep(RUN.checkpointDir, currentStep)
+      events.publish(events.STEP_FAILED, test=testName, step=currentStep, numSteps=numSteps, error=output, testObject=testObject)
+      nextStep = suggestContinue()
+      if nextStep is None:
+        break
+      currentStep = nextStep
     else:
       currentStep = currentStep + 1
-  drawProgress(currentStep, numSteps)
+
+######################################################################
+# Save the browser state before a step; a failed capture only costs the checkpoint
+######################################################################
+def saveCheckpoint(stepNum, testSteps):
+  try:
+    checkpoint.saveCheckpoint(RUN.checkpointDir, stepNum, testSteps, checkpoint.captureState(DRIVER))
+  except Exception, e:
+    logging.warning("CHECKPOINT:\tCould not checkpoint before step %s: %s" % (stepNum + 1, e))
+
+######################################################################
+# Checkpoint every CHECKPOINT_EVERY steps and before marked steps
+######################################################################
+def shouldCheckpoint(stepNum, step):
+  if RUN.checkpointDir is None:
+    return False
+  if CHECKPOINT_EVERY and stepNum % CHECKPOINT_EVERY == 0:
+    return True
+  return bool(step.values()[0].get("checkpoint"))
   
 ######################################################################
 # Prompt Loop to interact with user
 ######################################################################
 def createTest():
-  global exitCode, IMPLICIT_WAIT
+  global ELEMENT_TIMEOUT
 
   exitCode = 0
-  IMPLICIT_WAIT = 3
+  ELEMENT_TIMEOUT = 3
   initDriver()
 
   util_create.DRIVER = DRIVER
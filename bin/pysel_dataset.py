@@ -0,0 +1,137 @@
+#!/usr/bin/python
+import os, re, csv
+import logging
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+RE_PLACEHOLDER = re.compile(r"\$(\$?)\{(\w+)\}") # ${column}; $${column} is a literal ${column}
+TEMPLATE_KEYS  = ("value", "selector", "parent", "fields", "selectors") # Step keys whose placeholders are filled in
+
+######################################################################
+# Rows of a dataset, read one at a time: CSV with a header line, or
+# JSON Lines with one object per line. Each row maps column -> value.
+######################################################################
+def iterRows(path):
+  if path.endswith(".jsonl"):
+    with open(path, 'r') as dataFile:
+      for line in dataFile:
+        if line.strip():
+          yield json.loads(line)
+  elif path.endswith(".csv"):
+    with open(path, 'rb') as dataFile:
+      for row in csv.DictReader(dataFile):
+        yield row
+  else:
+    raise ValueError("%s: datasets must be .csv or .jsonl files" % path)
+
+######################################################################
+# Number of rows in a dataset, counted in one pass without keeping any
+######################################################################
+def countRows(path):
+  if path.endswith(".jsonl"):
+    with open(path, 'r') as dataFile:
+      return sum(1 for line in dataFile if line.strip())
+  elif path.endswith(".csv"):
+    with open(path, 'rb') as dataFile:
+      return max(sum(1 for record in csv.reader(dataFile) if record) - 1, 0) # Less the header; blank lines are skipped, as DictReader does
+  raise ValueError("%s: datasets must be .csv or .jsonl files" % path)
+
+# A test's "dataset" is relative to the test file
+def datasetPath(testPath, testObject):
+  return os.path.join(os.path.dirname(testPath), testObject["dataset"])
+
+######################################################################
+# A test's steps with ${column} placeholders, parsed once. Whatever
+# has no placeholders (most steps, and most of each step) is shared
+# by every row; only the strings with placeholders are built per row.
+######################################################################
+class Template:
+  def __init__(self, steps):
+    self.columns = set()
+    self.steps   = [(step, self._compileStep(step)) for step in steps]
+
+  # The steps for one row
+  def render(self, row):
+    return tuple([step if render is None else render(row) for step, render in self.steps])
+
+  #---------------------------------------------------------------------
+  # Internals: each _compile returns a function building the value for
+  # a row, or None if the value is the same for every row
+  #---------------------------------------------------------------------
+  def _compileStep(self, step):
+    directive = step.keys()[0]
+    stepData = step[directive]
+    renders = [(key, self._compile(stepData[key])) for key in TEMPLATE_KEYS if key in stepData]
+    renders = [(key, render) for key, render in renders if render is not None]
+    if not renders:
+      return None
+    def render(row):
+      rendered = dict(stepData)
+      for key, renderKey in renders:
+        rendered[key] = renderKey(row)
+      return {directive: rendered}
+    return render
+
+  def _compile(self, value):
+    if isinstance(value, basestring):
+      return self._compileString(value)
+    if isinstance(value, dict):
+      renders = [(key, self._compile(item)) for key, item in value.items()]
+      renders = [(key, render) for key, render in renders if render is not None]
+      if not renders:
+        return None
+      def renderDict(row):
+        rendered = dict(value)
+        for key, render in renders:
+          rendered[key] = render(row)
+        return rendered
+      return renderDict
+    if isinstance(value, list):
+      renders = [self._compile(item) for item in value]
+      if not any(renders):
+        return None
+      return lambda row: [item if render is None else render(row) for item, render in zip(value, renders)]
+    return None
+
+  def _compileString(self, value):
+    literals, columns = [""], []
+    last = 0
+    for match in RE_PLACEHOLDER.finditer(value):
+      literals[-1] = literals[-1] + value[last:match.start()]
+      last = match.end()
+      if match.group(1): # Escaped, keep it less the first $
+        literals[-1] = literals[-1] + match.group(0)[1:]
+      else:
+        columns.append(match.group(2))
+        literals.append("")
+    if last == 0:
+      return None
+    literals[-1] = literals[-1] + value[last:]
+    self.columns.update(columns)
+    tail = zip(columns, literals[1:])
+    def renderString(row):
+      out = [literals[0]]
+      for column, literal in tail:
+        out.append("%s" % row[column])
+        out.append(literal)
+      return "".join(out)
+    return renderString
+
+######################################################################
+# A data-driven test's rows as (rowNum, testObject) pairs, counted from
+# 1 and rendered only as they are asked for
+######################################################################
+def expandTest(testObject, datasetPath):
+  template = Template(testObject["steps"])
+  logging.debug("DATASET:\t%s steps, columns %s" % (len(template.steps), ", ".join(sorted(template.columns))))
+  rowObject = dict((key, value) for key, value in testObject.items() if key not in ("dataset", "steps"))
+  for rowIndex, row in enumerate(iterRows(datasetPath)):
+    missing = template.columns.difference(row)
+    if missing:
+      raise ValueError("%s: row %s has no column %s" % (datasetPath, rowIndex + 1, ", ".join(sorted(missing))))
+    rowTest = dict(rowObject)
+    rowTest["steps"] = template.render(row)
+    yield rowIndex + 1, rowTest
@@ -0,0 +1,86 @@
+#!/usr/bin/python
+import os
+import logging
+import threading, Queue
+
+######################################################################
+# Runner events and the data published with them
+######################################################################
+TEST_STARTED  = "test.started"  # test, testObject
+STEP_STARTED  = "step.started"  # test, step, numSteps
+STEP_FINISHED = "step.finished" # test, step, numSteps, record
+STEP_FAILED   = "step.failed"   # test, step, numSteps, error, testObject
+TEST_DONE     = "test.done"     # test, exitCode, errors, warnings, cacheHit, cacheMiss, report
+ERROR         = "error"         # message, data
+WARNING       = "warning"       # message, data
+SUITE_RESULT  = "suite.result"  # result, current, total
+SUITE_DONE    = "suite.done"    # tally, duration
+
+QUEUE_SIZE    = 1024 # Events waiting for subscribers before publish() blocks
+
+############ GLOBALS #################
+SUBSCRIBERS = {} # event -> [callback(**data)]
+_BUS = {"pid": None, "queue": None, "thread": None}
+
+######################################################################
+# Subscribers are called on the bus thread, in the order events were
+# published. An event nobody subscribes to costs a dict lookup.
+######################################################################
+def subscribe(event, callback):
+  SUBSCRIBERS.setdefault(event, []).append(callback)
+
+def unsubscribe(event, callback):
+  callbacks = SUBSCRIBERS.get(event, [])
+  if callback in callbacks:
+    callbacks.remove(callback)
+  if not callbacks:
+    SUBSCRIBERS.pop(event, None)
+
+def publish(event, **data):
+  if event not in SUBSCRIBERS:
+    return
+  _ensureThread()
+  _BUS["queue"].put((event, data))
+
+######################################################################
+# Wait until every published event has been handled (before prompting
+# the user, closing a report, or exiting)
+######################################################################
+def flush():
+  if _BUS["pid"] == os.getpid():
+    _BUS["queue"].join()
+
+def close():
+  if _BUS["pid"] == os.getpid():
+    _BUS["queue"].put(None)
+    _BUS["thread"].join()
+    _BUS["pid"] = None
+
+#---------------------------------------------------------------------
+# Internals
+#---------------------------------------------------------------------
+def _ensureThread():
+  if _BUS["pid"] == os.getpid():
+    return
+  # First event in this process (suite workers are forked without the parent's thread)
+  _BUS["pid"] = os.getpid()
+  _BUS["queue"] = Queue.Queue(QUEUE_SIZE)
+  _BUS["thread"] = threading.Thread(target=_run, args=(_BUS["queue"],), name="pysel-events")
+  _BUS["thread"].daemon = True
+  _BUS["thread"].start()
+
+def _run(queue):
+  while True:
+    item = queue.get()
+    if item is None:
+      queue.task_done()
+      break
+    event, data = item
+    try:
+      for callback in list(SUBSCRIBERS.get(event, [])):
+        try:
+          callback(**data)
+        except Exception, e:
+          logging.error("EVENTS:\tSubscriber %s failed on %s: %s" % (getattr(callback, "__name__", callback), event, e))
+    finally:
+      queue.task_done()
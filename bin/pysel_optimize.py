@@ -0,0 +1,245 @@
+#!/usr/bin/python
+import os, time
+import logging
+from collections import OrderedDict
+import texttable as tt
+from colorama import Fore, Style
+
+import pysel_core         as core
+import pysel_util_core    as util_core
+import pysel_directives   as directives
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+LOOKUP_REPEAT  = 5 # Lookups timed per selector, the fastest one counts
+MAX_CSS_DEPTH  = 5 # Levels a CSS path may climb before giving up
+
+######################################################################
+# Cheaper selectors for an element, cheapest first: its id, its name,
+# then the shortest child-combinator CSS path from it (or an ancestor
+# with an id) that is unique under the root. arguments[1] are the
+# elements the current selector resolves to; when there are several
+# (a "text" selector matches every ancestor of the text, up to html)
+# the innermost one is the element meant.
+######################################################################
+_CANDIDATES_SCRIPT = r"""
+var root = arguments[0] || document, matches = arguments[1], maxDepth = arguments[2], el = matches[0];
+if (matches.length > 1) {
+  var inner = matches.filter(function(m) { return !matches.some(function(o) { return o !== m && m.contains(o); }); });
+  if (inner.length != 1) return null;
+  el = inner[0];
+}
+function unique(css) {
+  try { var found = root.querySelectorAll(css); return found.length == 1 && found[0] === el; } catch (e) { return false; }
+}
+function quote(value) { return '"' + value.replace(/(["\\])/g, '\\$1') + '"'; }
+var out = [];
+if (el.id && unique('[id=' + quote(el.id) + ']')) out.push({id: el.id});
+var name = el.getAttribute('name');
+if (name && unique('[name=' + quote(name) + ']')) out.push({name: name});
+var path = [];
+for (var node = el; node && node.nodeType == 1 && node !== root && path.length < maxDepth; node = node.parentElement) {
+  if (node.id && node !== el) {
+    path.unshift('[id=' + quote(node.id) + ']');
+    if (unique(path.join(' > '))) { out.push({css_selector: path.join(' > ')}); break; }
+    path[0] = node.tagName.toLowerCase();
+  } else {
+    path.unshift(node.tagName.toLowerCase());
+  }
+  var same = 0, index = 0;
+  for (var sib = node.parentElement ? node.parentElement.firstElementChild : null; sib; sib = sib.nextElementSibling) {
+    if (sib.tagName == node.tagName) same++;
+    if (sib === node) index = same;
+  }
+  if (same > 1) path[0] = path[0] + ':nth-of-type(' + index + ')';
+  if (unique(path.join(' > '))) { out.push({css_selector: path.join(' > ')}); break; }
+}
+return {target: el, candidates: out};
+"""
+
+######################################################################
+# Seconds one lookup of a selector takes (the fastest of LOOKUP_REPEAT)
+######################################################################
+def lookupTime(parent, selector, repeat=LOOKUP_REPEAT):
+  fastest = None
+  for attempt in range(repeat):
+    start = time.time()
+    directives._resolveByScript(parent, selector)
+    elapsed = time.time() - start
+    if fastest is None or elapsed < fastest:
+      fastest = elapsed
+  return fastest
+
+######################################################################
+# The cheapest selector that resolves to the same element as selector,
+# or None if there is nothing better. Returns a dict with "selector",
+# "before" and "after" (lookup seconds) and "note".
+######################################################################
+def suggestSelector(parent, selector):
+  matches = directives._resolveByScript(parent, selector)
+  if not matches:
+    raise ValueError("%s matches nothing" % json.dumps(selector, sort_keys=True))
+  root = None
+  if not hasattr(parent, "execute_script"): # parent is an element, not the driver
+    root = parent
+  found = core.DRIVER.execute_script(_CANDIDATES_SCRIPT, root, matches, MAX_CSS_DEPTH)
+  if not found:
+    raise ValueError("%s matches %s elements, none of them innermost" % (json.dumps(selector, sort_keys=True), len(matches)))
+  note = ""
+  if len(matches) > 1:
+    note = "was ambiguous (%s matches)" % len(matches)
+
+  before = lookupTime(parent, selector)
+  for candidate in found["candidates"]:
+    if candidate == selector:
+      return None
+    resolved = directives._resolveByScript(parent, candidate) # Must resolve, as pySel does, to the same element
+    if len(resolved) != 1 or resolved[0] != found["target"]:
+      logging.debug("OPTIMIZE:\t%s does not resolve to the same element", candidate)
+      continue
+    after = lookupTime(parent, candidate)
+    if after >= before and not note:
+      return None
+    return {"selector": candidate, "before": before, "after": after, "note": note}
+  return None
+
+######################################################################
+# Replay a test, rewriting the selectors of its own steps (not those of
+# tests it imports) to the cheapest unique ones, and report the savings
+######################################################################
+def optimizeTest(testName, dryRun=False):
+  testPath = os.path.join(core.DIR_TEST, testName + '.' + core.EXT_TEST)
+  with open(testPath, 'r') as testFile:
+    rawText = testFile.read()
+  rawTest = json.loads(rawText, object_pairs_hook=OrderedDict)
+  owners = _stepOwners(testPath, rawTest["steps"])
+  testObject = util_core.loadTestfile(testPath)
+
+  rows = []
+  edits = {} # New selector by its path in the test file
+  core.initDriver(testObject.get("profile"))
+  try:
+    for stepNum, step in enumerate(testObject["steps"]):
+      stepType = step.keys()[0]
+      stepData = step[stepType]
+      if owners[stepNum] is not None:
+        for path, parent, selector in _stepSelectors(stepType, stepData):
+          try:
+            suggestion = suggestSelector(parent(), selector)
+          except Exception, e:
+            logging.warning("OPTIMIZE:\tStep %s: %s" % (stepNum + 1, core.describeError(e)))
+            continue
+          if suggestion:
+            rows.append((stepNum, stepType, path, selector, suggestion))
+            edits[("steps", owners[stepNum], rawTest["steps"][owners[stepNum]].keys()[0]) + path] = suggestion["selector"]
+      try:
+        getattr(directives, stepType)(stepData)
+      except Exception, e:
+        logging.error("OPTIMIZE:\tStep %s (%s) failed, not replaying the rest: %s" % (stepNum + 1, stepType, core.describeError(e)))
+        break
+  finally:
+    core.quitDriver()
+
+  _drawReport(rows)
+  if rows and not dryRun:
+    tmpPath = "%s.%s.tmp" % (testPath, os.getpid())
+    with open(tmpPath, 'w') as testFile:
+      testFile.write(rewriteValues(rawText, edits))
+    os.rename(tmpPath, testPath)
+    print Fore.GREEN + "Rewrote %s selectors in %s" % (len(rows), testPath) + Style.RESET_ALL
+  return core.PYSEL_OK
+
+######################################################################
+# Replace values of a JSON document in its text, leaving everything
+# else (indentation, key order, line breaks) as it was. edits maps the
+# path of a value (keys and list indexes) to its new value.
+######################################################################
+def rewriteValues(text, edits):
+  spans = _valueSpans(text)
+  for path in sorted(edits, key=lambda path: spans[path][0], reverse=True):
+    start, end = spans[path]
+    text = text[:start] + json.dumps(edits[path], sort_keys=True) + text[end:]
+  return text
+
+#---------------------------------------------------------------------
+# Internals
+#---------------------------------------------------------------------
+# (start, end) in text of every value of a JSON document, by path
+def _valueSpans(text):
+  spans = {}
+  decoder = json.JSONDecoder()
+  def skip(pos):
+    while text[pos] in " \t\r\n":
+      pos = pos + 1
+    return pos
+  def scan(pos, path):
+    start = pos = skip(pos)
+    if text[pos] in "{[":
+      close = "}" if text[pos] == "{" else "]"
+      pos, index = skip(pos + 1), 0
+      while text[pos] != close:
+        if close == "}":
+          key, pos = json.decoder.scanstring(text, pos + 1)
+          pos = skip(pos) + 1 # The colon
+        else:
+          key, index = index, index + 1
+        pos = skip(scan(pos, path + (key,)))
+        if text[pos] == ",":
+          pos = skip(pos + 1)
+      pos = pos + 1
+    else:
+      pos = decoder.raw_decode(text, pos)[1]
+    spans[path] = (start, pos)
+    return pos
+  scan(0, ())
+  return spans
+
+# The index in the test file of each compiled step, None for imported ones
+def _stepOwners(testPath, rawSteps):
+  basePath = os.path.dirname(os.path.realpath(testPath))
+  owners = []
+  for stepIndex, step in enumerate(rawSteps):
+    if step.keys()[0] == "import_test":
+      importPath = os.path.join(basePath, step["import_test"]["name"])
+      owners.extend([None] * len(util_core.compileTest(importPath)["steps"]))
+    else:
+      owners.append(stepIndex)
+  return owners
+
+# (path, parent getter, selector) for every selector a step looks up.
+# Selectors of assertNoElement(s) match nothing, and a clickSequence's
+# only appear as it runs, so those are left alone.
+def _stepSelectors(stepType, stepData):
+  selectors = []
+  if stepData.get("parent"):
+    selectors.append((("parent",), lambda: core.DRIVER, stepData["parent"]))
+  stepParent = lambda: directives._getStepParent(stepData)
+  if stepType in ("typeKeys", "click", "assertElement") and stepData.get("selector"):
+    selectors.append((("selector",), stepParent, stepData["selector"]))
+  if stepType == "fillForm":
+    for index, field in enumerate(stepData["fields"]):
+      selectors.append((("fields", index, "selector"), stepParent, field["selector"]))
+  if stepType == "assertElements":
+    for index, selector in enumerate(stepData["selectors"]):
+      selectors.append((("selectors", index), stepParent, selector))
+  return selectors
+
+def _drawReport(rows):
+  print Style.BRIGHT + Fore.GREEN + "\nSelector lookups" + Style.RESET_ALL
+  if not rows:
+    print "Nothing to optimize"
+    return
+  tab = tt.Texttable(max_width=1000)
+  tab.header(["Step", "Directive", "Field", "Old selector", "New selector", "Old ms", "New ms", "Saved ms", "Note"])
+  saved = 0
+  for stepNum, stepType, path, selector, suggestion in rows:
+    saved = saved + suggestion["before"] - suggestion["after"]
+    tab.add_row([stepNum + 1, stepType, ".".join(["%s" % key for key in path]),
+                 json.dumps(selector, sort_keys=True), json.dumps(suggestion["selector"], sort_keys=True),
+                 "%.1f" % (suggestion["before"] * 1000), "%.1f" % (suggestion["after"] * 1000),
+                 "%.1f" % ((suggestion["before"] - suggestion["after"]) * 1000), suggestion["note"]])
+  print Style.BRIGHT + Fore.CYAN + tab.draw() + Style.RESET_ALL
+  print "Saved %.1fms of lookups per run" % (saved * 1000)
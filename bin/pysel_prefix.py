@@ -0,0 +1,71 @@
+#!/usr/bin/python
+import logging
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+MIN_PREFIX_STEPS = 2 # Shorter shared prefixes cost more to fork than to replay
+
+######################################################################
+# One node of the step trie: the tests whose plans pass through it
+######################################################################
+class _Node:
+  def __init__(self, depth):
+    self.depth    = depth
+    self.children = {}
+    self.tests    = []
+
+######################################################################
+# Build a trie over the flattened plans ({testName: steps}), one level per step
+######################################################################
+def buildTrie(plans):
+  root = _Node(0)
+  for testName in sorted(plans.keys()):
+    node = root
+    node.tests.append(testName)
+    for step in plans[testName]:
+      key = json.dumps(step, sort_keys=True)
+      child = node.children.get(key)
+      if child is None:
+        child = node.children[key] = _Node(node.depth + 1)
+      node = child
+      node.tests.append(testName)
+  return root
+
+######################################################################
+# Find the prefixes worth running once: trie nodes where two or more
+# tests with steps left to run go separate ways. Returns the prefixes
+# (parents before children) and each test's deepest prefix (or None).
+#
+# A prefix is {"id", "parent", "steps", "tests"}; "tests" lists every
+# test below it, so they can be run in full if the prefix fails.
+######################################################################
+def planPrefixes(plans, minSteps=MIN_PREFIX_STEPS):
+  prefixes = []
+  assignments = dict((testName, None) for testName in plans)
+  stack = [(buildTrie(plans), None)]
+  while stack: # Depth first without recursion, plans can be thousands of steps long
+    node, parentId = stack.pop()
+    dependents = [t for t in node.tests if len(plans[t]) > node.depth]
+    passesThrough = len(node.children) == 1 and len(node.children.values()[0].tests) == len(node.tests)
+    if node.depth >= minSteps and len(dependents) > 1 and not passesThrough:
+      prefixes.append({
+        "id":     len(prefixes),
+        "parent": parentId,
+        "steps":  plans[dependents[0]][:node.depth],
+        "tests":  dependents,
+      })
+      parentId = len(prefixes) - 1
+      for testName in dependents: # Deeper prefixes overwrite this later
+        assignments[testName] = parentId
+    for key in sorted(node.children.keys(), reverse=True):
+      stack.append((node.children[key], parentId))
+
+  sharedSteps = 0
+  for prefix in prefixes: # Each prefix runs the steps after its parent's once instead of once per test
+    start = len(prefixes[prefix["parent"]]["steps"]) if prefix["parent"] is not None else 0
+    sharedSteps = sharedSteps + (len(prefix["steps"]) - start) * (len(prefix["tests"]) - 1)
+  logging.info("SUITE:\t%s shared prefixes, saving up to %s step executions" % (len(prefixes), sharedSteps))
+  return prefixes, assignments
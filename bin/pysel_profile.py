@@ -0,0 +1,85 @@
+#!/usr/bin/python
+import os
+import logging
+from selenium import webdriver
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+DEFAULT_PROFILE = "default"    # A plain, headed Chrome
+FONT_PATTERNS   = ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot"]
+
+######################################################################
+# Driver profiles from the "profiles" section of conf.json:
+#
+#   "lean": {
+#     "headless": true, "window_size": [1280, 800],
+#     "disable_extensions": true, "disable_gpu": true,
+#     "block_images": true, "block_fonts": true,
+#     "block_hosts": ["*.doubleclick.net"], "block_urls": ["*/analytics.js"],
+#     "arguments": ["--no-first-run"]
+#   }
+######################################################################
+def loadProfiles(confPath):
+  conf = {}
+  if os.path.exists(confPath):
+    try:
+      with open(confPath, 'r') as confFile:
+        conf = json.load(confFile)
+    except ValueError, e:
+      logging.warning("PROFILE:\tIgnoring unreadable conf (%s): %s" % (confPath, e))
+  profiles = conf.get("profiles", {})
+  profiles.setdefault(DEFAULT_PROFILE, {})
+  return profiles
+
+def getProfile(profiles, name):
+  if name not in profiles:
+    raise ValueError("Unknown driver profile '%s', conf.json defines: %s" % (name, ", ".join(sorted(profiles.keys()))))
+  return profiles[name]
+
+######################################################################
+# Chrome command line and preferences for a profile
+######################################################################
+def chromeOptions(profile):
+  options = webdriver.ChromeOptions()
+  if profile.get("headless"):
+    options.add_argument("--headless")
+  if profile.get("window_size"):
+    options.add_argument("--window-size=%s,%s" % tuple(profile["window_size"]))
+  if profile.get("disable_extensions"):
+    options.add_argument("--disable-extensions")
+  if profile.get("disable_gpu"):
+    options.add_argument("--disable-gpu")
+  if profile.get("block_images"):
+    options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+  if profile.get("block_hosts"):
+    # Blocked hosts fail to resolve, so requests to them fail at once instead of timing out
+    rules = ["MAP %s ~NOTFOUND" % host for host in profile["block_hosts"]]
+    options.add_argument("--host-resolver-rules=%s" % ", ".join(rules))
+  for argument in profile.get("arguments", []):
+    options.add_argument(argument)
+  return options
+
+######################################################################
+# URL patterns the browser should refuse to load
+######################################################################
+def blockedUrls(profile):
+  patterns = list(profile.get("block_urls", []))
+  if profile.get("block_fonts"):
+    patterns.extend(FONT_PATTERNS)
+  return patterns
+
+######################################################################
+# Settings that can only be made once the session is up
+######################################################################
+def applyProfile(driver, profile):
+  patterns = blockedUrls(profile)
+  if not patterns:
+    return
+  if not hasattr(driver, "execute_cdp_cmd"):
+    logging.warning("PROFILE:\tThis Selenium cannot block URLs (needs execute_cdp_cmd), loading them anyway")
+    return
+  driver.execute_cdp_cmd("Network.enable", {})
+  driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": patterns})
@@ -0,0 +1,167 @@
+#!/usr/bin/python
+import os, time, errno, shutil
+import logging
+import threading
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+LATEST        = "latest"  # Symlink to the newest run
+FILE_PID      = "pid"     # Process a run belongs to; runs still in progress are never pruned
+TRASH_PREFIX  = ".trash-" # Runs being deleted
+DEFAULT_RETENTION = {"keep_runs": 20, "max_age_days": 0, "max_bytes": 0}
+
+############ GLOBALS #################
+_PRUNER = {"pid": None, "thread": None}
+
+######################################################################
+# Retention policy from the "retention" section of conf.json:
+#
+#   "retention": {"keep_runs": 20, "max_age_days": 14, "max_bytes": 5000000000}
+#
+# A limit that is left out or 0 does not apply.
+######################################################################
+def loadRetention(confPath):
+  conf = {}
+  if os.path.exists(confPath):
+    try:
+      with open(confPath, 'r') as confFile:
+        conf = json.load(confFile)
+    except ValueError, e:
+      logging.warning("RETENTION:\tIgnoring unreadable conf (%s): %s" % (confPath, e))
+  retention = dict(DEFAULT_RETENTION)
+  retention.update(conf.get("retention", {}))
+  return retention
+
+######################################################################
+# Create a run's directory and point 'latest' at it
+######################################################################
+def startRun(runsDir, runId):
+  runDir = os.path.join(runsDir, runId)
+  if not os.path.isdir(runDir):
+    os.makedirs(runDir)
+  with open(os.path.join(runDir, FILE_PID), 'w') as pidFile:
+    pidFile.write("%s" % os.getpid())
+  # Replace the link atomically, so it never points nowhere
+  tmpLink = os.path.join(runsDir, ".%s.%s" % (LATEST, os.getpid()))
+  if os.path.lexists(tmpLink):
+    os.unlink(tmpLink)
+  os.symlink(runId, tmpLink)
+  os.rename(tmpLink, os.path.join(runsDir, LATEST))
+  return runDir
+
+######################################################################
+# Mark a run finished, so it can be pruned even if a later process gets
+# the same pid. Only the process that started the run may finish it.
+######################################################################
+def finishRun(runDir):
+  pidPath = os.path.join(runDir, FILE_PID)
+  try:
+    with open(pidPath, 'r') as pidFile:
+      if pidFile.read().strip() == "%s" % os.getpid():
+        os.unlink(pidPath)
+  except (IOError, OSError):
+    pass
+
+######################################################################
+# Runs, oldest first (run IDs start with their start time)
+######################################################################
+def listRuns(runsDir):
+  if not os.path.isdir(runsDir):
+    return []
+  return sorted(name for name in os.listdir(runsDir)
+                if not name.startswith(".") and name != LATEST and os.path.isdir(os.path.join(runsDir, name)))
+
+######################################################################
+# The runs to delete: walking back from the newest run, every run past
+# keep_runs, older than max_age_days or beyond max_bytes in total. The
+# current run and runs still in progress are always kept.
+######################################################################
+def selectPrunable(runsDir, retention, currentRun):
+  keepRuns = retention.get("keep_runs") or 0
+  maxAge   = (retention.get("max_age_days") or 0) * 86400
+  maxBytes = retention.get("max_bytes") or 0
+  now = time.time()
+  kept, keptBytes = 0, 0
+  prunable = []
+  for run in reversed(listRuns(runsDir)):
+    runDir = os.path.join(runsDir, run)
+    size = _dirSize(runDir) if maxBytes else 0
+    if run != currentRun and not _inProgress(runDir):
+      if ((keepRuns and kept >= keepRuns) or (maxAge and now - os.path.getmtime(runDir) > maxAge)
+          or (maxBytes and keptBytes + size > maxBytes)):
+        prunable.append(run)
+        continue
+    kept = kept + 1
+    keptBytes = keptBytes + size
+  return prunable
+
+######################################################################
+# Delete the runs outside the retention policy. Each is renamed out of
+# the way first, so an interrupted prune never leaves half a run
+# behind; the next prune finishes deleting it.
+######################################################################
+def pruneRuns(runsDir, retention, currentRun):
+  prunable = selectPrunable(runsDir, retention, currentRun)
+  for run in prunable:
+    try:
+      os.rename(os.path.join(runsDir, run), os.path.join(runsDir, TRASH_PREFIX + run))
+    except OSError, e:
+      logging.warning("RETENTION:\tCould not prune run %s: %s" % (run, e))
+  for name in os.listdir(runsDir):
+    if name.startswith(TRASH_PREFIX):
+      shutil.rmtree(os.path.join(runsDir, name), ignore_errors=True)
+  if prunable:
+    logging.info("RETENTION:\tPruned %s old runs: %s" % (len(prunable), ", ".join(prunable)))
+  return prunable
+
+######################################################################
+# Prune on a background thread, so the first step doesn't wait for it.
+# afterPrune runs on that thread once the runs are gone.
+######################################################################
+def startPruner(runsDir, retention, currentRun, afterPrune=None):
+  def prune():
+    try:
+      pruneRuns(runsDir, retention, currentRun)
+      if afterPrune:
+        afterPrune()
+    except Exception, e:
+      logging.warning("RETENTION:\tPruning failed: %s" % e)
+  _PRUNER["pid"] = os.getpid()
+  _PRUNER["thread"] = threading.Thread(target=prune, name="pysel-pruner")
+  _PRUNER["thread"].daemon = True
+  _PRUNER["thread"].start()
+
+# Let a prune in progress finish before the process exits
+def waitForPruner():
+  if _PRUNER["pid"] == os.getpid():
+    _PRUNER["thread"].join()
+
+#---------------------------------------------------------------------
+# Internals
+#---------------------------------------------------------------------
+def _dirSize(path):
+  total = 0
+  for root, subFolders, files in os.walk(path):
+    for f in files:
+      try:
+        total = total + os.lstat(os.path.join(root, f)).st_size
+      except OSError:
+        pass
+  return total
+
+def _inProgress(runDir):
+  try:
+    with open(os.path.join(runDir, FILE_PID), 'r') as pidFile:
+      pid = int(pidFile.read().strip())
+  except (IOError, ValueError):
+    return False
+  if pid == os.getpid():
+    return True
+  try:
+    os.kill(pid, 0)
+  except OSError, e:
+    return e.errno == errno.EPERM # Alive, but someone else's
+  return True
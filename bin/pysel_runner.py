@@ -0,0 +1,63 @@
+#!/usr/bin/python
+import time
+import logging, traceback
+import pysel_core         as core
+from pysel_context        import RunContext
+
+######################################################################
+# Runs tests back to back in one long-lived process:
+#
+#   runner = Runner()
+#   for testName in testNames:
+#     run = runner.run(testName)
+#     print run.exitCode, run.errors, [s.duration for s in run.steps]
+#   runner.close()
+#
+# Every run gets a fresh RunContext, which is handed to the caller and
+# not kept by pySel, and the runner itself only keeps totals, so memory
+# stays flat however many tests it runs.
+######################################################################
+class Runner:
+  def __init__(self, keepSteps=True):
+    self.keepSteps = keepSteps # False leaves the step records out of the contexts
+    self.tests     = 0
+    self.failed    = 0
+
+  def run(self, testName, resumeFrom=None, rerunFailed=False, fromCheckpoint=None, testObject=None):
+    core.runTest(testName, resumeFrom, rerunFailed, fromCheckpoint, self.keepSteps, testObject)
+    run = core.RUN
+    core.RUN = RunContext() # Directives run between tests must not count against this one
+    self.tests = self.tests + 1
+    if run.exitCode != core.PYSEL_OK:
+      self.failed = self.failed + 1
+    return run
+
+  # Runs a data-driven test one row at a time, yielding each row's context.
+  # If the test or its dataset can't be read, the rows so far are followed
+  # by a failed context for the test itself.
+  def runRows(self, testName):
+    startTime = time.time()
+    error, trace = None, None
+    try:
+      rows = core.dataRows(testName)
+      row = next(rows, None)
+    except Exception, e:
+      row, error, trace = None, e, traceback.format_exc()
+    while row is not None:
+      yield self.run(row[0], testObject=row[1])
+      try:
+        row = next(rows, None)
+      except Exception, e:
+        row, error, trace = None, e, traceback.format_exc()
+    if error is not None:
+      logging.error(trace)
+      self.tests = self.tests + 1
+      self.failed = self.failed + 1
+      yield core.failedRun(testName, error, time.time() - startTime)
+
+  # The record written to the results files for a run
+  def result(self, run):
+    return core.testResult(run.test, run.exitCode, run.duration, run)
+
+  def close(self):
+    core.closeSessions()
@@ -0,0 +1,172 @@
+#!/usr/bin/python
+import os, threading, Queue, time
+import logging, hashlib
+from cStringIO import StringIO
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+try: # Only needed to downscale or recompress screenshots
+  from PIL import Image
+except ImportError:
+  Image = None
+
+# Capture policies
+POLICY_ALL        = "all"         # Every step
+POLICY_EVERY      = "every"       # Every N steps (and on error)
+POLICY_ERROR      = "error"       # Only when a step fails
+POLICY_NAVIGATION = "navigation"  # Only after navigateUrl steps (and on error)
+POLICIES          = [POLICY_ALL, POLICY_EVERY, POLICY_ERROR, POLICY_NAVIGATION]
+
+FILE_MANIFEST     = "manifest.json"
+GC_GRACE_SECONDS  = 3600          # Unreferenced blobs younger than this may belong to a run in progress
+
+######################################################################
+# Decide whether a step should be captured under a policy
+######################################################################
+def shouldCapture(policy, stepNum, stepType, failed, every=1):
+  if failed:
+    return True
+  if policy == POLICY_ALL:
+    return True
+  if policy == POLICY_EVERY:
+    return every > 0 and stepNum % every == 0
+  if policy == POLICY_NAVIGATION:
+    return stepType == "navigateUrl"
+  return False
+
+######################################################################
+# Write a test's manifest: one entry per screenshot, pointing at its blob
+######################################################################
+def writeManifest(reportPath, manifest):
+  with open(os.path.join(reportPath, FILE_MANIFEST), 'w') as manifestFile:
+    json.dump({"screenshots": manifest}, manifestFile, indent=2)
+
+######################################################################
+# Delete blobs that no manifest under reportDir references any more
+######################################################################
+def collectGarbage(blobDir, reportDir, grace=GC_GRACE_SECONDS):
+  if not os.path.isdir(blobDir):
+    return 0
+  refCounts = {}
+  for root, subFolders, files in os.walk(reportDir):
+    if FILE_MANIFEST not in files:
+      continue
+    try:
+      with open(os.path.join(root, FILE_MANIFEST), 'r') as manifestFile:
+        for entry in json.load(manifestFile)["screenshots"]:
+          refCounts[entry["blob"]] = refCounts.get(entry["blob"], 0) + 1
+    except Exception, e:
+      logging.warning("SCREEN:\tSkipping unreadable manifest in (%s): %s" % (root, e))
+
+  removed = 0
+  cutoff = time.time() - grace
+  for root, subFolders, files in os.walk(blobDir):
+    for f in files:
+      blobPath = os.path.join(root, f)
+      blob = os.path.relpath(blobPath, blobDir)
+      if refCounts.get(blob, 0) == 0 and os.path.getmtime(blobPath) < cutoff:
+        os.unlink(blobPath)
+        removed = removed + 1
+  logging.debug("SCREEN:\tRemoved %s unreferenced screenshot blobs" % removed)
+  return removed
+
+######################################################################
+# Encodes and stores screenshots on a background thread so the
+# test only pays for the capture itself. Screenshots are stored once
+# per distinct image under blobDir, named by content hash.
+######################################################################
+class ScreenshotWriter:
+  def __init__(self, blobDir, queueSize=16, scale=1.0, jpegQuality=0):
+    self.blobDir     = blobDir     # Content-addressed store shared by every test and run
+    self.queueSize   = queueSize   # Captures waiting to be written before submit() blocks
+    self.scale       = scale       # Downscale factor (1.0 = original size)
+    self.jpegQuality = jpegQuality # Re-encode as JPEG at this quality (0 = keep the PNG)
+    self.pid         = None
+    self.queue       = None
+    self.thread      = None
+
+  def extension(self):
+    if self.jpegQuality and Image:
+      return "jpg"
+    return "png"
+
+  def submit(self, name, png, manifest):
+    self._ensureThread()
+    self.queue.put((name, png, manifest)) # Blocks when the queue is full so memory stays bounded
+
+  def flush(self):
+    if self.pid == os.getpid():
+      self.queue.join()
+
+  def close(self):
+    if self.pid == os.getpid():
+      self.queue.put(None)
+      self.thread.join()
+      self.pid = None
+
+  #---------------------------------------------------------------------
+  # Internals
+  #---------------------------------------------------------------------
+  def _ensureThread(self):
+    if self.pid == os.getpid():
+      return
+    # First use in this process (suite workers are forked without the parent's thread)
+    self.pid = os.getpid()
+    self.queue = Queue.Queue(self.queueSize)
+    self.thread = threading.Thread(target=self._run, name="pysel-screenshots")
+    self.thread.daemon = True
+    self.thread.start()
+
+  def _run(self):
+    while True:
+      item = self.queue.get()
+      if item is None:
+        self.queue.task_done()
+        break
+      name, png, manifest = item
+      try:
+        manifest.append({"name": name, "blob": self._store(png)})
+      except Exception, e:
+        logging.error("SCREEN:\tCould not store screenshot (%s): %s" % (name, e))
+      finally:
+        self.queue.task_done()
+
+  def _store(self, png):
+    # Hash the raw capture (plus the encoding settings) so duplicates skip encoding too
+    digest = hashlib.sha1(png)
+    digest.update("%s/%s" % (self.scale, self.jpegQuality))
+    digest = digest.hexdigest()
+    blob = os.path.join(digest[:2], "%s.%s" % (digest, self.extension()))
+    blobPath = os.path.join(self.blobDir, blob)
+
+    if os.path.exists(blobPath):
+      os.utime(blobPath, None) # Keeps it out of a concurrent collectGarbage's reach
+      return blob
+
+    if (self.scale != 1.0 or self.jpegQuality) and Image:
+      png = self._encode(png)
+    if not os.path.isdir(os.path.dirname(blobPath)):
+      try:
+        os.makedirs(os.path.dirname(blobPath))
+      except OSError: # Another worker got there first
+        pass
+    tmpPath = "%s.%s.tmp" % (blobPath, os.getpid())
+    with open(tmpPath, 'wb') as blobFile:
+      blobFile.write(png)
+    os.rename(tmpPath, blobPath)
+    return blob
+
+  def _encode(self, png):
+    image = Image.open(StringIO(png))
+    if self.scale != 1.0:
+      size = (max(1, int(image.size[0] * self.scale)), max(1, int(image.size[1] * self.scale)))
+      image = image.resize(size, Image.ANTIALIAS)
+    output = StringIO()
+    if self.jpegQuality:
+      image.convert("RGB").save(output, "JPEG", quality=self.jpegQuality, optimize=True)
+    else:
+      image.save(output, "PNG", optimize=True)
+    return output.getvalue()
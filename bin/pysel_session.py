@@ -0,0 +1,152 @@
+#!/usr/bin/python
+import logging
+import urlparse
+
+# Storage can only be cleared by script for the page a window is on
+_CLEAR_STORAGE_SCRIPT = "try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}"
+
+######################################################################
+# scheme://host[:port] of a URL, None for pages without one (about:, data:)
+######################################################################
+def urlOrigin(url):
+  parts = urlparse.urlsplit(url or "")
+  if parts.scheme not in ("http", "https") or not parts.netloc:
+    return None
+  return "%s://%s" % (parts.scheme, parts.netloc.rsplit("@", 1)[-1].lower())
+
+######################################################################
+# Swap a driver's command executor for one that keeps its HTTP
+# connection to the driver server open, instead of opening a new
+# connection for every WebDriver command
+######################################################################
+def enableKeepAlive(driver):
+  executor = driver.command_executor
+  if getattr(executor, "keep_alive", False):
+    return driver
+  try:
+    driver.command_executor = executor.__class__(executor._url, keep_alive=True)
+    logging.debug("SESSION:\tKeep-alive enabled for session (%s)" % driver.session_id)
+  except (TypeError, AttributeError), e: # Selenium releases without keep_alive support
+    logging.debug("SESSION:\tKeep-alive unavailable: %s" % e)
+  return driver
+
+######################################################################
+# Keeps browsers warm between tests instead of starting one per test
+######################################################################
+class SessionPool:
+  def __init__(self, factory, size=1, maxUses=25, maxMemoryMB=512, onStop=None):
+    self.factory     = factory     # Builds a fresh webdriver
+    self.onStop      = onStop      # Called with the session id of every session quit
+    self.size        = size        # Number of released sessions kept for reuse
+    self.maxUses     = maxUses     # Recycle a session after this many leases (0 = never)
+    self.maxMemoryMB = maxMemoryMB # Recycle a session once its JS heap passes this (0 = never)
+    self.idle        = []
+    self.uses        = {}
+    self.origins     = {}          # Origins each leased session was sent to, cleared on release
+
+  def lease(self):
+    if self.idle:
+      driver = self.idle.pop()
+      logging.debug("SESSION:\tReusing warm session (%s)" % driver.session_id)
+    else:
+      driver = self._start()
+    self.uses[driver.session_id] = self.uses.get(driver.session_id, 0) + 1
+    return driver
+
+  # Note a URL a session was sent to, so its origin's storage is cleared on release
+  def visit(self, driver, url):
+    self.origins.setdefault(driver.session_id, set()).add(urlOrigin(url))
+
+  def release(self, driver):
+    if driver is None:
+      return
+    reason = self._recycleReason(driver)
+    if reason is None and len(self.idle) >= self.size:
+      reason = "pool is full"
+    if reason is None:
+      try:
+        self._reset(driver)
+        self.idle.append(driver)
+        return
+      except Exception, e:
+        reason = "reset failed: %s" % e
+    logging.debug("SESSION:\tRecycling session (%s): %s" % (driver.session_id, reason))
+    self._stop(driver)
+
+  def closeAll(self):
+    while self.idle:
+      self._stop(self.idle.pop())
+
+  #---------------------------------------------------------------------
+  # Internals
+  #---------------------------------------------------------------------
+  def _start(self):
+    driver = self.factory()
+    logging.debug("SESSION:\tStarted session (%s)" % driver.session_id)
+    return driver
+
+  def _stop(self, driver):
+    self.uses.pop(driver.session_id, None)
+    self.origins.pop(driver.session_id, None)
+    if self.onStop:
+      self.onStop(driver.session_id)
+    try:
+      driver.quit()
+    except Exception, e:
+      logging.warning("SESSION:\tError quitting session: %s" % e)
+
+  def _recycleReason(self, driver):
+    if self.maxUses and self.uses.get(driver.session_id, 0) >= self.maxUses:
+      return "used %s times" % self.uses[driver.session_id]
+    if self.maxMemoryMB:
+      try:
+        heap = driver.execute_script(
+          "return window.performance && window.performance.memory ? window.performance.memory.usedJSHeapSize : 0;")
+      except Exception, e:
+        return "unresponsive: %s" % e
+      if heap and heap > self.maxMemoryMB * 1024 * 1024:
+        return "JS heap at %iMB" % (heap / (1024 * 1024))
+    return None
+
+  # Leave nothing for the next test: one fresh window (sessionStorage
+  # belongs to the window), and no cookies or storage for any origin the
+  # test visited. Without CDP, cookies and storage can only be cleared
+  # for the page a window is on. Raises when that can't be done, so the
+  # session is recycled instead.
+  def _reset(self, driver):
+    origins = self.origins.pop(driver.session_id, set())
+    cdp = hasattr(driver, "execute_cdp_cmd") # Chrome can clear any origin, not just the page's
+    handles = driver.window_handles
+    driver.switch_to_window(handles[0])
+    driver.execute_script("window.open('about:blank');")
+    fresh = [handle for handle in driver.window_handles if handle not in handles]
+    keep = fresh[0] if fresh else handles[0]
+    shown, keepOrigin = set(), None
+    for handle in handles:
+      driver.switch_to_window(handle)
+      origin = urlOrigin(driver.current_url)
+      shown.add(origin)
+      if cdp: # Also the origins reached by clicks and redirects
+        history = driver.execute_cdp_cmd("Page.getNavigationHistory", {})
+        origins.update(urlOrigin(entry["url"]) for entry in history.get("entries", []))
+      driver.execute_script(_CLEAR_STORAGE_SCRIPT)
+      driver.delete_all_cookies()
+      if handle == keep:
+        keepOrigin = origin
+      else:
+        driver.close()
+    driver.switch_to_window(keep)
+    origins.update(shown)
+    origins.discard(None)
+    stale = set()
+    if cdp:
+      for origin in origins:
+        driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+      driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+    else:
+      stale.update(origins - shown)
+    if not fresh: # The window we keep may hold sessionStorage of origins it left
+      stale.update(origins - set([keepOrigin]))
+    if stale:
+      raise ValueError("storage of %s can't be cleared" % ", ".join(sorted(stale)))
+    driver.get("about:blank")
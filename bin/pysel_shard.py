@@ -0,0 +1,112 @@
+#!/usr/bin/python
+import os, time, hashlib
+import logging
+import argparse
+
+import pysel_util_core    as util_core
+import pysel_dataset      as dataset
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+DEFAULT_STEP_SECONDS = 1.0  # Estimate per step when no test has any history yet
+HISTORY_WEIGHT       = 0.3  # Weight of the newest run in the moving average
+
+######################################################################
+# argparse type for "--shard i/N" (i is 1-based)
+######################################################################
+def parseShard(s):
+  try:
+    index, count = [int(part) for part in s.split("/")]
+  except ValueError:
+    raise argparse.ArgumentTypeError("'%s' is not a shard, expected i/N (e.g. 2/4)" % s)
+  if count < 1 or index < 1 or index > count:
+    raise argparse.ArgumentTypeError("Shard %s is out of range, i must be between 1 and N" % s)
+  return (index, count)
+
+######################################################################
+# Historical test durations: {testName: seconds (moving average)}
+######################################################################
+def loadDurations(path):
+  if not os.path.exists(path):
+    return {}
+  try:
+    with open(path, 'r') as durationFile:
+      return json.load(durationFile)
+  except Exception, e:
+    logging.warning("SHARD:\tIgnoring unreadable durations file (%s): %s" % (path, e))
+    return {}
+
+def recordDurations(path, results):
+  durations = loadDurations(path)
+  for result in results:
+    previous = durations.get(result["test"])
+    if previous is None:
+      durations[result["test"]] = result["duration"]
+    else:
+      durations[result["test"]] = (1 - HISTORY_WEIGHT) * previous + HISTORY_WEIGHT * result["duration"]
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  tmpPath = "%s.%s.tmp" % (path, os.getpid())
+  with open(tmpPath, 'w') as durationFile:
+    json.dump(durations, durationFile, indent=2, sort_keys=True)
+  os.rename(tmpPath, path)
+
+######################################################################
+# Estimate every test's duration: its history if it has one, otherwise
+# its step count times the average seconds per step of tests that do.
+# A data-driven test runs its steps once per row of its dataset.
+######################################################################
+def estimateDurations(testNames, testPaths, durations):
+  stepCounts = {}
+  for testName, testPath in zip(testNames, testPaths):
+    try:
+      plan = util_core.compileTest(testPath)
+      stepCounts[testName] = max(len(plan["steps"]), 1)
+      if plan.get("dataset"):
+        stepCounts[testName] = stepCounts[testName] * max(dataset.countRows(dataset.datasetPath(testPath, plan)), 1)
+    except Exception, e:
+      logging.warning("SHARD:\tCould not count steps of (%s): %s" % (testPath, e))
+      stepCounts[testName] = 1
+
+  known = [t for t in testNames if t in durations]
+  stepSeconds = DEFAULT_STEP_SECONDS
+  if known:
+    stepSeconds = sum([durations[t] for t in known]) / float(sum([stepCounts[t] for t in known]))
+
+  estimates = {}
+  for testName in testNames:
+    if testName in durations:
+      estimates[testName] = durations[testName]
+    else:
+      estimates[testName] = stepCounts[testName] * stepSeconds
+  return estimates
+
+######################################################################
+# Digest of everything a split depends on: the shard count, the tests
+# and their estimates. Nodes that log the same digest split the same way.
+######################################################################
+def inputDigest(estimates, count):
+  return hashlib.sha1(json.dumps([count, sorted(estimates.items())])).hexdigest()[:12]
+
+######################################################################
+# Split tests into count shards of similar total duration (longest
+# first onto the least loaded shard) and return shard index's tests.
+# Deterministic for the same tests and history on every node.
+######################################################################
+def selectShard(testNames, testPaths, index, count, durations):
+  estimates = estimateDurations(testNames, testPaths, durations)
+  logging.info("SHARD:\tInputs digest %s (%s tests, %s with history, %s shards)" % (
+    inputDigest(estimates, count), len(testNames), len([t for t in testNames if t in durations]), count))
+  loads = [0.0] * count
+  shards = [[] for i in range(count)]
+  for testName in sorted(testNames, key=lambda t: (-estimates[t], t)):
+    target = loads.index(min(loads))
+    shards[target].append(testName)
+    loads[target] = loads[target] + estimates[testName]
+
+  logging.info("SHARD:\tEstimated shard times: %s" % ", ".join(["%.1fs" % load for load in loads]))
+  selected = set(shards[index - 1])
+  return [t for t in testNames if t in selected]
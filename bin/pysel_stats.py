@@ -0,0 +1,190 @@
+#!/usr/bin/python
+import os, time, math
+import logging
+import sqlite3
+import texttable as tt
+from colorama import Fore, Style
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+BATCH_SIZE = 5000 # Rows buffered before they are written in one transaction
+
+# Run once on a database whose user_version is older, before _SCHEMA:
+# _MIGRATIONS[v] takes version v to v + 1
+_MIGRATIONS = [
+  # Indexes that didn't cover the stats queries
+  """
+DROP INDEX IF EXISTS steps_by_time;
+DROP INDEX IF EXISTS steps_by_selector;
+""",
+]
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+  id       INTEGER PRIMARY KEY,
+  name     TEXT,
+  started  REAL
+);
+CREATE TABLE IF NOT EXISTS tests (
+  id        INTEGER PRIMARY KEY,
+  run_id    INTEGER,
+  test      TEXT,
+  status    TEXT,
+  exit_code INTEGER,
+  errors    INTEGER,
+  warnings  INTEGER,
+  started   REAL,
+  duration  REAL
+);
+CREATE TABLE IF NOT EXISTS steps (
+  run_id    INTEGER,
+  test      TEXT,
+  step      INTEGER,
+  directive TEXT,
+  selector  TEXT,
+  status    TEXT,
+  retries   INTEGER,
+  started   REAL,
+  duration  REAL
+);
+CREATE INDEX IF NOT EXISTS tests_by_test     ON tests (test, started);
+CREATE INDEX IF NOT EXISTS tests_by_time     ON tests (started);
+CREATE INDEX IF NOT EXISTS steps_by_time     ON steps (started, test, step, directive, duration);
+CREATE INDEX IF NOT EXISTS steps_by_test     ON steps (test, started, step, directive, duration);
+CREATE INDEX IF NOT EXISTS steps_by_selector_retries ON steps (selector, started, status, retries);
+"""
+
+def connect(path):
+  if not os.path.isdir(os.path.dirname(path)):
+    os.makedirs(os.path.dirname(path))
+  conn = sqlite3.connect(path)
+  conn.execute("PRAGMA journal_mode=WAL")   # Readers (pysel.py stats) don't block the run
+  conn.execute("PRAGMA synchronous=NORMAL")
+  version = conn.execute("PRAGMA user_version").fetchone()[0]
+  if version < len(_MIGRATIONS):
+    for migration in _MIGRATIONS[version:]:
+      conn.executescript(migration)
+    conn.executescript(_SCHEMA)
+    conn.execute("PRAGMA user_version = %i" % len(_MIGRATIONS))
+  return conn
+
+######################################################################
+# Records each run's tests and steps. Rows are buffered and written in
+# batches, so a run pays for a transaction every BATCH_SIZE rows.
+######################################################################
+class StatsStore:
+  def __init__(self, path, runName):
+    self.conn  = connect(path)
+    self.runId = self.conn.execute("INSERT INTO runs (name, started) VALUES (?, ?)", (runName, time.time())).lastrowid
+    self.conn.commit()
+    self.tests = []
+    self.steps = []
+
+  # result is a core.testResult, recordPath the JSON Lines file of its step records
+  def addTest(self, result, status, recordPath=None):
+    self.tests.append((self.runId, result["test"], status, result["exitCode"], result["errors"],
+                       result["warnings"], result["start"], result["duration"]))
+    if recordPath and os.path.exists(recordPath):
+      with open(recordPath, 'r') as recordFile:
+        for line in recordFile:
+          record = json.loads(line)
+          if record.get("type") != "step":
+            continue
+          self.steps.append((self.runId, result["test"], record["step"], record["directive"], record.get("selector"),
+                             record["status"], record["retries"], record["start"], record["duration"]))
+    if len(self.tests) + len(self.steps) >= BATCH_SIZE:
+      self.flush()
+
+  def flush(self):
+    if not self.tests and not self.steps:
+      return
+    with self.conn: # One transaction
+      self.conn.executemany("INSERT INTO tests (run_id, test, status, exit_code, errors, warnings, started, duration) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self.tests)
+      self.conn.executemany("INSERT INTO steps (run_id, test, step, directive, selector, status, retries, started, duration) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.steps)
+    self.tests = []
+    self.steps = []
+
+  def close(self):
+    self.flush()
+    self.conn.close()
+
+######################################################################
+# Queries behind 'pysel.py stats'; since is a unix timestamp
+######################################################################
+def slowestSteps(conn, since, limit=10, testName=None):
+  query = "SELECT test, step, directive, COUNT(*), AVG(duration), MAX(duration) FROM steps"
+  args = [since]
+  if testName:
+    query = query + " WHERE started >= ? AND test = ?"
+    args.append(testName)
+  else: # SQLite would rather scan all of steps_by_test than just the window
+    query = query + " INDEXED BY steps_by_time WHERE started >= ?"
+  query = query + " GROUP BY test, step ORDER BY AVG(duration) DESC LIMIT ?"
+  return conn.execute(query, args + [limit]).fetchall()
+
+# Selectors that both passed and failed, most often failing first
+def flakiestSelectors(conn, since, limit=10):
+  return conn.execute(
+    "SELECT selector, COUNT(*) AS runs, SUM(status != 'ok') AS failures, AVG(retries) FROM steps "
+    "WHERE selector IS NOT NULL AND started >= ? GROUP BY selector "
+    "HAVING failures > 0 AND failures < runs ORDER BY failures * 1.0 / runs DESC, runs DESC LIMIT ?",
+    (since, limit)).fetchall()
+
+# Per day: number of test runs, p50 and p95 duration
+def durationTrend(conn, since, testName=None):
+  query = "SELECT date(started, 'unixepoch', 'localtime'), duration FROM tests WHERE started >= ?"
+  args = [since]
+  if testName:
+    query = query + " AND test = ?"
+    args.append(testName)
+  trend = []
+  day, durations = None, []
+  for rowDay, duration in conn.execute(query + " ORDER BY 1, 2", args):
+    if rowDay != day and durations:
+      trend.append((day, len(durations), percentile(durations, 50), percentile(durations, 95)))
+      durations = []
+    day = rowDay
+    durations.append(duration)
+  if durations:
+    trend.append((day, len(durations), percentile(durations, 50), percentile(durations, 95)))
+  return trend
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values, pct):
+  index = max(int(math.ceil(pct / 100.0 * len(values))) - 1, 0)
+  return values[min(index, len(values) - 1)]
+
+######################################################################
+# Print the stats tables
+######################################################################
+def _drawTable(title, header, rows):
+  print Style.BRIGHT + Fore.GREEN + "\n%s" % title + Style.RESET_ALL
+  if not rows:
+    print "No data"
+    return
+  tab = tt.Texttable(max_width=1000)
+  tab.header(header)
+  for row in rows:
+    tab.add_row(row)
+  print Style.BRIGHT + Fore.CYAN + tab.draw() + Style.RESET_ALL
+
+def showStats(path, days=30, limit=10, testName=None):
+  if not os.path.exists(path):
+    logging.error("STATS:\tNo statistics recorded yet (%s)" % path)
+    return 1
+  conn = connect(path)
+  since = time.time() - days * 86400
+  _drawTable("Slowest steps (last %s days)" % days, ["Test", "Step", "Directive", "Runs", "Avg s", "Max s"],
+    [(t, step + 1, d, n, "%.3f" % avg, "%.3f" % top) for t, step, d, n, avg, top in slowestSteps(conn, since, limit, testName)])
+  if not testName:
+    _drawTable("Flakiest selectors (last %s days)" % days, ["Selector", "Runs", "Failures", "Fail %", "Avg retries"],
+      [(s, n, f, "%.1f" % (100.0 * f / n), "%.1f" % r) for s, n, f, r in flakiestSelectors(conn, since, limit)])
+  _drawTable("Test durations by day%s" % (" (%s)" % testName if testName else ""), ["Day", "Runs", "p50 s", "p95 s"],
+    [(d, n, "%.2f" % p50, "%.2f" % p95) for d, n, p50, p95 in durationTrend(conn, since, testName)])
+  conn.close()
+  return 0
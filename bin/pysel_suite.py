@@ -0,0 +1,391 @@
+#!/usr/bin/python
+import os, sys, glob, time, collections
+import logging, traceback
+import multiprocessing, Queue
+from termcolor import colored, cprint
+
+import pysel_core         as core
+import pysel_events       as events
+import pysel_util_core    as util_core
+import pysel_shard        as shard
+import pysel_prefix       as prefix
+import pysel_retention    as retention
+from pysel_runner         import Runner
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+WORKER_POLL = 5 # Seconds between checks that every worker is still alive
+
+######################################################################
+# Resolve a directory or glob (absolute, or relative to DIR_TEST) into test paths
+######################################################################
+def resolveTests(pattern):
+  candidates = [os.path.join(core.DIR_TEST, pattern), pattern]
+  for candidate in candidates:
+    if os.path.isdir(candidate):
+      return sorted(util_core.getTestList(candidate))
+  for candidate in candidates:
+    testPaths = [f for f in glob.glob(candidate) if f.endswith('.' + core.EXT_TEST)]
+    if testPaths:
+      return sorted(testPaths)
+  return []
+
+######################################################################
+# Turn a test path into the name runTest expects (relative to DIR_TEST, no extension)
+######################################################################
+def testNameFromPath(testPath):
+  testPath = os.path.realpath(testPath)
+  testDir = os.path.realpath(core.DIR_TEST)
+  if testPath.startswith(testDir + os.sep):
+    testPath = os.path.relpath(testPath, testDir)
+  return os.path.splitext(testPath)[0]
+
+######################################################################
+# Worker process: runs the tasks the parent hands it, one at a time,
+# until it gets None. A task is (taskId, "test", testName, checkpoint)
+# or (taskId, "prefix", prefix, checkpoint), the checkpoint being the
+# browser state to start from (or None). A data-driven test sends a
+# result per row, then {"rowsDone": test}. Every result carries its
+# task's id and the worker's.
+######################################################################
+def _worker(workerId, taskQueue, resultQueue):
+  # Each worker is its own process, so the driver, report path and counters
+  # in pysel_core belong to this worker alone.
+  core.AUTO_PILOT = True
+  core.SILENT = True
+  core.configureOutput()
+  runner = Runner(keepSteps=False) # Results travel back as records, the step records are on disk
+  while True:
+    task = taskQueue.get()
+    if task is None:
+      break
+    taskId, kind, target, fromCheckpoint = task
+    startTime = time.time()
+    if kind == "prefix":
+      resultQueue.put({
+        "task":       taskId,
+        "worker":     workerId,
+        "prefix":     target["id"],
+        "checkpoint": core.runPrefix("prefix_%s" % target["id"], target["steps"], fromCheckpoint, target["profile"]),
+        "duration":   time.time() - startTime,
+      })
+      continue
+    try:
+      if core.isDataTest(target):
+        for run in runner.runRows(target):
+          result = runner.result(run)
+          result["task"] = taskId
+          result["worker"] = workerId
+          result["forked"] = False
+          result["row"] = True
+          resultQueue.put(result)
+        resultQueue.put({"task": taskId, "worker": workerId, "rowsDone": target, "duration": time.time() - startTime})
+        continue
+      result = runner.result(runner.run(target, fromCheckpoint=fromCheckpoint))
+    except Exception, e:
+      logging.error(traceback.format_exc())
+      duration = time.time() - startTime
+      result = core.testResult(target, core.PYSEL_SEV1, duration, core.failedRun(target, e, duration))
+    result["task"] = taskId
+    result["worker"] = workerId
+    result["forked"] = fromCheckpoint is not None
+    resultQueue.put(result)
+  # atexit handlers don't run in multiprocessing children
+  core.closeSessions()
+
+######################################################################
+# Compile every test and work out which prefixes to run once. Browser
+# state only carries over between tests of the same driver profile.
+######################################################################
+def _sharedPrefixes(testNames):
+  profiles = {}
+  for testName in testNames:
+    try:
+      plan = util_core.compileTest(os.path.join(core.DIR_TEST, testName + '.' + core.EXT_TEST))
+    except Exception, e: # runTest reports it properly
+      logging.warning("SUITE:\tNot sharing steps of (%s): %s" % (testName, e))
+      continue
+    if plan.get("dataset"): # Its steps are templates until a row fills them in
+      continue
+    profiles.setdefault(plan.get("profile"), {})[testName] = plan["steps"]
+
+  prefixes, assignments = [], dict((testName, None) for testName in testNames)
+  for profileName, plans in profiles.items():
+    offset = len(prefixes)
+    found, assigned = prefix.planPrefixes(plans)
+    for p in found:
+      p["id"] = p["id"] + offset
+      if p["parent"] is not None:
+        p["parent"] = p["parent"] + offset
+      p["profile"] = profileName
+      prefixes.append(p)
+    for testName, prefixId in assigned.items():
+      if prefixId is not None:
+        assignments[testName] = prefixId + offset
+  return prefixes, assignments
+
+######################################################################
+# Running totals of a suite's results. Only the failures are kept, so
+# memory doesn't grow with the number of tests (or dataset rows).
+######################################################################
+class SuiteTally:
+  def __init__(self):
+    self.tests     = 0
+    self.warnings  = 0
+    self.errors    = 0
+    self.cacheHit  = 0
+    self.cacheMiss = 0
+    self.forked    = 0
+    self.failed    = [] # (test, exitCode, report or failure)
+
+  def add(self, result):
+    self.tests     = self.tests + 1
+    self.warnings  = self.warnings + result["warnings"]
+    self.errors    = self.errors + result["errors"]
+    self.cacheHit  = self.cacheHit + result["cacheHit"]
+    self.cacheMiss = self.cacheMiss + result["cacheMiss"]
+    if result["forked"]:
+      self.forked = self.forked + 1
+    if result["exitCode"] != core.PYSEL_OK:
+      self.failed.append((result["test"], result["exitCode"], result["report"] or result["failure"]))
+
+  def exitCode(self):
+    if not self.failed:
+      return core.PYSEL_OK
+    return max([exitCode for testName, exitCode, where in self.failed])
+
+######################################################################
+# Run every test matching the pattern across a pool of worker processes
+######################################################################
+def runSuite(pattern, jobs=None, shardSpec=None, sharePrefix=False, prune=False):
+  testPaths = resolveTests(pattern)
+  if not testPaths:
+    logging.error("SUITE:\tNo tests found matching (%s)" % pattern)
+    return core.PYSEL_SEV5
+
+  testNames = [testNameFromPath(f) for f in testPaths]
+  if shardSpec:
+    index, count = shardSpec
+    durations = shard.loadDurations(core.FILE_DURATIONS)
+    testNames = shard.selectShard(testNames, testPaths, index, count, durations)
+    logging.info("SUITE:\tShard %s/%s runs %s tests, balanced on %s" % (index, count, len(testNames), core.FILE_DURATIONS))
+    if not testNames:
+      logging.warning("SUITE:\tShard %s/%s has no tests to run" % (index, count))
+      return core.PYSEL_OK
+  if not jobs or jobs < 1:
+    jobs = multiprocessing.cpu_count()
+  jobs = min(jobs, len(testNames))
+  logging.info("SUITE:\tRunning %s tests on %s workers" % (len(testNames), jobs))
+
+  prefixes, assignments = [], dict((testName, None) for testName in testNames)
+  if sharePrefix:
+    prefixes, assignments = _sharedPrefixes(testNames)
+  # Tests wait for their deepest prefix, prefixes for their parent
+  waiting = dict((p["id"], {"prefixes": [], "tests": []}) for p in prefixes)
+  for p in prefixes:
+    if p["parent"] is not None:
+      waiting[p["parent"]]["prefixes"].append(p)
+  for testName in testNames:
+    if assignments.get(testName) is not None:
+      waiting[assignments[testName]]["tests"].append(testName)
+
+  tasks = [] # (kind, target, checkpoint) by task id, None once it is done
+  pending = collections.deque() # Ids of the tasks no worker has been given yet
+  for p in prefixes:
+    if p["parent"] is None:
+      _queueTask(pending, tasks, "prefix", p, None)
+  for testName in testNames:
+    if assignments.get(testName) is None:
+      _queueTask(pending, tasks, "test", testName, None)
+
+  startTime = time.time()
+  configureOutput()
+  # The parent hands out every task, so it knows what a worker was running even if it dies
+  resultQueue = multiprocessing.Queue()
+  running = [None] * jobs # Task id by worker
+  workers, taskQueues = zip(*[_startWorker(workerId, resultQueue) for workerId in range(jobs)])
+  workers, taskQueues = list(workers), list(taskQueues)
+  # Only once the workers are forked: they would inherit any lock the pruner thread holds
+  if prune:
+    core.pruneRuns()
+
+  # Only totals are kept here, the full results are streamed to disk
+  tally = SuiteTally()
+  finished = 0
+  durations = [] # Of whole tests, for the shard estimates
+  runs = sum([core.countRuns(testName) for testName in testNames]) # Each row of a dataset is a run
+  core.openResults(pattern)
+  try:
+    while finished < len(testNames):
+      _handOut(taskQueues, running, pending, tasks)
+      try:
+        incoming = [resultQueue.get(timeout=WORKER_POLL)]
+      except Queue.Empty:
+        incoming = _replaceDeadWorkers(workers, taskQueues, running, tasks, resultQueue)
+      for result in incoming:
+        if tasks[result["task"]] is None: # Sent just before its worker died, and already failed for it
+          continue
+        if not result.get("row"):
+          tasks[result["task"]] = None
+          running[result["worker"]] = None
+        if "prefix" in result:
+          _forkPrefix(prefixes[result["prefix"]], result, waiting, pending, tasks)
+          continue
+        if "rowsDone" in result: # Shards are balanced on the whole test, not its rows
+          finished = finished + 1
+          durations.append({"test": result["rowsDone"], "duration": result["duration"]})
+          continue
+        core.writeResult(result)
+        tally.add(result)
+        if not result.get("row"):
+          finished = finished + 1
+          if not result["forked"]: # Its duration leaves out the prefix, so it would skew the estimates
+            durations.append({"test": result["test"], "duration": result["duration"]})
+        events.publish(events.SUITE_RESULT, result=result, current=tally.tests, total=max(runs, tally.tests))
+    for taskQueue in taskQueues:
+      taskQueue.put(None)
+    for worker in workers:
+      worker.join()
+  except KeyboardInterrupt:
+    logging.error("SUITE:\tInterrupted, terminating workers")
+    for worker in workers:
+      worker.terminate()
+    return core.PYSEL_SEV5
+  finally:
+    core.closeResults()
+
+  # Every node must split on the same durations, so a shard leaves the file as it found it
+  if shardSpec:
+    logging.info("SUITE:\tSharded run, not updating %s" % core.FILE_DURATIONS)
+  else:
+    shard.recordDurations(core.FILE_DURATIONS, durations)
+  duration = time.time() - startTime
+  retention.waitForPruner()
+  events.publish(events.SUITE_DONE, tally=tally, duration=duration)
+  events.flush()
+  return tally.exitCode()
+
+######################################################################
+# A prefix finished: start whatever waits on it from its browser state,
+# or run every test below it in full if it failed
+######################################################################
+def _forkPrefix(finished, result, waiting, pending, tasks):
+  if result["checkpoint"] is None:
+    logging.warning("SUITE:\tShared prefix %s failed, running its %s tests in full" % (finished["id"], len(finished["tests"])))
+    for testName in finished["tests"]:
+      _queueTask(pending, tasks, "test", testName, None)
+    return
+  logging.info("SUITE:\tShared prefix %s done in %.1fs" % (finished["id"], result["duration"]))
+  for p in waiting[finished["id"]]["prefixes"]:
+    _queueTask(pending, tasks, "prefix", p, result["checkpoint"])
+  for testName in waiting[finished["id"]]["tests"]:
+    _queueTask(pending, tasks, "test", testName, result["checkpoint"])
+
+def _queueTask(pending, tasks, kind, target, fromCheckpoint):
+  tasks.append((kind, target, fromCheckpoint))
+  pending.append(len(tasks) - 1)
+
+# Give every idle worker the next pending task
+def _handOut(taskQueues, running, pending, tasks):
+  for workerId in range(len(running)):
+    if not pending:
+      return
+    if running[workerId] is None:
+      taskId = pending.popleft()
+      running[workerId] = taskId
+      taskQueues[workerId].put((taskId,) + tasks[taskId])
+
+# Each worker gets a queue of its own, so a dead one can't leave it locked
+def _startWorker(workerId, resultQueue):
+  taskQueue = multiprocessing.Queue()
+  worker = multiprocessing.Process(target=_worker, args=(workerId, taskQueue, resultQueue))
+  worker.daemon = True
+  worker.start()
+  return worker, taskQueue
+
+######################################################################
+# Replace the workers that died (killed for memory, a crashed driver),
+# so the tasks still pending get run, and return results standing in
+# for the tasks they were running: an error for a test, a failed prefix
+# (its tests then run in full)
+######################################################################
+def _replaceDeadWorkers(workers, taskQueues, running, tasks, resultQueue):
+  results = []
+  for workerId, worker in enumerate(workers):
+    if worker.is_alive():
+      continue
+    message = "Worker %s died (exit code %s)" % (workerId, worker.exitcode)
+    taskId = running[workerId]
+    if taskId is not None and tasks[taskId] is not None:
+      kind, target, fromCheckpoint = tasks[taskId]
+      if kind == "prefix":
+        results.append({"task": taskId, "worker": workerId, "prefix": target["id"], "checkpoint": None, "duration": 0.0})
+      else:
+        result = core.testResult(target, core.PYSEL_SEV1, 0.0, core.failedRun(target, RuntimeError(message), 0.0))
+        result.update({"task": taskId, "worker": workerId, "forked": False})
+        results.append(result)
+      message = "%s running %s" % (message, "shared prefix %s" % target["id"] if kind == "prefix" else target)
+    logging.error("SUITE:\t%s, starting another" % message)
+    running[workerId] = None
+    # Nothing may hold the console or logging locks across the fork
+    events.flush()
+    retention.waitForPruner()
+    workers[workerId], taskQueues[workerId] = _startWorker(workerId, resultQueue)
+  return results
+
+######################################################################
+# Console output: one line per finished test, then the suite's totals.
+# Workers drop these subscriptions along with the rest of the output.
+######################################################################
+def configureOutput():
+  if core.SILENT:
+    return
+  for event, callback in ((events.SUITE_RESULT, _showResult), (events.SUITE_DONE, _showSummary)):
+    if (event, callback) not in core.OUTPUT_SUBSCRIPTIONS:
+      events.subscribe(event, callback)
+      core.OUTPUT_SUBSCRIPTIONS.append((event, callback))
+
+def _showResult(result, current, total):
+  color = "green"
+  if result["warnings"] > 0:
+    color = "yellow"
+  if result["exitCode"] != core.PYSEL_OK:
+    color = "red"
+  print "(%i/%i)" % (current, total),
+  cprint("%-6s %s (%.1fs)" % (result["exitCode"], result["test"], result["duration"]), color)
+
+def _showSummary(tally, duration):
+  failed = tally.failed
+  numWarnings = tally.warnings
+  numErrors = tally.errors
+
+  state = "Success"
+  sumCol = "green"
+  if numWarnings > 0:
+    state = "Warning"
+    sumCol = "yellow"
+  if failed:
+    state = "Error"
+    sumCol = "red"
+
+  cprint("\n########## SUITE SUMMARY #########", sumCol)
+  print "State:\t",
+  cprint(state, sumCol)
+  print "Tests:\t%s (%s failed)" % (tally.tests, len(failed))
+  if tally.forked:
+    print "Shared:\t%s tests started from a shared prefix" % tally.forked
+  print "Warns:\t",
+  cprint(numWarnings, "yellow")
+  print "Errors:\t",
+  cprint(numErrors, "red")
+  print "Cache:\t%s hits, %s misses" % (tally.cacheHit, tally.cacheMiss)
+  print "Time:\t%.1fs" % duration
+  for testName, exitCode, where in failed:
+    print "Failed:\t",
+    cprint("%s (%s)" % (testName, where), "red")
+  print "Log:\t",
+  cprint(os.path.join(core.DIR_LOG, core.FILE_LOG + '.' + core.EXT_LOG), "cyan")
+  cprint("##################################", sumCol)
@@ -1,7 +1,9 @@
 #!/usr/bin/python
 import os, re, sys, time, datetime, pwd, grp
 import socket, httplib, urllib2
-import logging
+import signal, struct, fcntl, termios
+import logging, hashlib
+import cPickle as pickle
 import texttable as tt
 from colorama import Fore, Back, Style
 from time import strftime as date
@@ -11,6 +13,13 @@ try:
 except ImportError:
   import simplejson as json
 
+############ GLOBALS #################
+UID           =-1
+GID           =-1
+PLAN_CACHE_DIR=None # Where compiled test plans are cached (None disables the cache)
+PROGRESS_INTERVAL=0.1 # Seconds between progress bar redraws
+TERMINAL      ={"width": None, "drawn": 0.0} # Cached terminal width (None = read it again) and last redraw
+
 ######################################################################
 # Create directory structure for file if folders are missing
 ######################################################################
@@ -21,32 +30,41 @@ def mkdir(path):
 
   os.chown(path, UID, GID)
 
-def clearDirectory(path, recursive=False):
-  if not os.path.isdir(path):
-    logging.warning("OS:\tDirectory does not exist (%s) " % path)
-    return
-  for delObj in os.listdir(path):
-    delPath = os.path.join(path, delObj)
-    try:
-        if (not recursive):
-          if os.path.isfile(delPath):
-            os.unlink(delPath)
-        else:
-          os.unlink(delPath)
-    except Exception, e:
-      raiseError("Error deleting files!", e)
-
 ######################################################################
-# Baby function to draw progress bar given a max and current value
+# Baby function to draw progress bar given a max and current value.
+# Redraws at most every PROGRESS_INTERVAL, except for the last step.
 ######################################################################
 def drawProgress(current, maxNum):
-  barWidth = int(int((os.popen('stty size', 'r').read().split())[1]) - 25)
-  countComplete = int(current*barWidth/maxNum)
+  now = time.time()
+  if current < maxNum and now - TERMINAL["drawn"] < PROGRESS_INTERVAL:
+    return
+  TERMINAL["drawn"] = now
+  barWidth = max(terminalWidth() - 25, 10)
+  countComplete = int(current*barWidth/max(maxNum, 1))
   countIdle = int(barWidth-countComplete)
   progressBar = '[' + ('#'*countComplete) + ('-'*countIdle) + ']'
   sys.stdout.write("\rStep: (%i/%i) %s" % (current, maxNum, progressBar))
   sys.stdout.flush()
 
+######################################################################
+# Terminal width, read once and again after the terminal is resized.
+# watchTerminal has to be called from the main thread.
+######################################################################
+def watchTerminal():
+  signal.signal(signal.SIGWINCH, _terminalResized)
+  signal.siginterrupt(signal.SIGWINCH, False) # A resize must not fail a recv or raw_input with EINTR
+
+def _terminalResized(signum, frame):
+  TERMINAL["width"] = None
+
+def terminalWidth():
+  if TERMINAL["width"] is None:
+    try:
+      TERMINAL["width"] = struct.unpack('hh', fcntl.ioctl(sys.stdout.fileno(), termios.TIOCGWINSZ, '1234'))[1]
+    except Exception: # Not a terminal
+      TERMINAL["width"] = int(os.environ.get("COLUMNS", 80))
+  return TERMINAL["width"]
+
 ######################################################################
 # Display the steps in a test, indicating what ones have been completed optionally
 ######################################################################
@@ -70,6 +88,11 @@ def displayTest(testObject, offset=0, currentStep=0, numSteps=None):
     step_val = stepData["value"] if "value" in stepData.keys() else ""
     step_pnt = json.dumps(stepData["parent"]) if "parent" in stepData.keys() else ""
     step_str = json.dumps(stepData["selector"]) if "selector" in stepData.keys() else ""
+    if "fields" in stepData.keys(): # fillForm: one line per field
+      step_val = "\n".join(["%s" % field["value"] for field in stepData["fields"]])
+      step_str = "\n".join([json.dumps(field["selector"]) for field in stepData["fields"]])
+    elif "selectors" in stepData.keys():
+      step_str = "\n".join([json.dumps(selector) for selector in stepData["selectors"]])
 
     row.append(step_com)
     row.append(step_val)
@@ -124,34 +147,110 @@ def loadTestfile(testPath):
     logging.error("ERROR:\tNo Test found at (%s)" % testPath)
     return False
 
-  f = open(testPath, 'r')
-  testData = json.load(f)
-  f.close()
+  plan = compileTest(testPath)
+  testData = dict(plan)
+  testData["steps"] = list(plan["steps"]) # Callers are free to edit their copy
+  return testData
 
-  basePath = os.path.dirname(testPath)
-  testData = augment_import(testData, basePath) # Include other tests
+######################################################################
+# Compile a test and its imports into a flat, validated plan.
+# Plans are cached on disk and reused until any file involved changes.
+######################################################################
+def compileTest(testPath):
+  realPath = os.path.realpath(testPath)
+  plan = _loadCachedPlan(realPath)
+  if plan is not None:
+    logging.debug("LOAD:\tUsing cached plan for %s" % testPath)
+    return plan
+
+  deps = {}
+  plan = _readTest(realPath, deps)
+  plan["steps"] = tuple(_flattenSteps(realPath, plan["steps"], [realPath], deps, {}))
+  _saveCachedPlan(realPath, plan, deps)
+  return plan
 
+# ----------------------------------------------
+# Parse and validate one test file, recording its mtime/size
+# ----------------------------------------------
+def _readTest(realPath, deps):
+  fileStat = os.stat(realPath)
+  deps[realPath] = (fileStat.st_mtime, fileStat.st_size)
+  with open(realPath, 'r') as testFile:
+    testData = json.load(testFile)
+  _validateTest(realPath, testData)
   return testData
 
 # ----------------------------------------------
-# Augment content of test file with another test
+# Inline every import_test step, detecting cycles
 # ----------------------------------------------
-def augment_import(test_json, basePath):
-  steps = test_json["steps"]
-  stepIndex = 0
-  for step in steps:
-    step = steps[stepIndex]
+def _flattenSteps(realPath, testSteps, stack, deps, flattened):
+  basePath = os.path.dirname(realPath)
+  steps = []
+  for stepIndex, step in enumerate(testSteps):
     stepType = step.keys()[0]
-    if (stepType == "import_test"):
-      importRelPath = step["import_test"]["name"]
-      logging.debug("LOAD:\tAugmenting test at step (%s) with test (%s)" % (stepIndex, importRelPath))
-      del test_json["steps"][stepIndex]
-      importPath = os.path.join(basePath, importRelPath) 
-      importTest_json = loadTestfile(importPath)
-      if (not importTest_json):
-        return test_json
-      stepInserts = importTest_json["steps"]
-      for stepInsert in reversed(stepInserts):
-        test_json["steps"].insert(stepIndex, stepInsert)
-    stepIndex = stepIndex + 1
-  return test_json
+    if (stepType != "import_test"):
+      steps.append(step)
+      continue
+
+    importPath = os.path.realpath(os.path.join(basePath, step["import_test"]["name"]))
+    logging.debug("LOAD:\tAugmenting test at step (%s) with test (%s)" % (stepIndex, importPath))
+    if importPath in stack:
+      cycle = stack[stack.index(importPath):] + [importPath]
+      raise ValueError("Import cycle: %s" % " -> ".join(cycle))
+    if importPath not in flattened: # The same test imported twice only gets parsed once
+      if not os.path.exists(importPath):
+        raise ValueError("%s: imported test not found (%s)" % (realPath, importPath))
+      importSteps = _readTest(importPath, deps)["steps"]
+      flattened[importPath] = _flattenSteps(importPath, importSteps, stack + [importPath], deps, flattened)
+    steps.extend(flattened[importPath])
+  return steps
+
+# ----------------------------------------------
+# Check the structure of a test file before it runs
+# ----------------------------------------------
+def _validateTest(testPath, testData):
+  if not isinstance(testData, dict) or not isinstance(testData.get("steps"), list):
+    raise ValueError("%s: expected an object with a 'steps' list" % testPath)
+  for stepIndex, step in enumerate(testData["steps"]):
+    if not isinstance(step, dict) or len(step) != 1 or not isinstance(step.values()[0], dict):
+      raise ValueError("%s: step %s must be an object with exactly one directive" % (testPath, stepIndex + 1))
+    if step.keys()[0] == "import_test" and "name" not in step["import_test"]:
+      raise ValueError("%s: step %s imports a test without a 'name'" % (testPath, stepIndex + 1))
+
+# ----------------------------------------------
+# On-disk plan cache, keyed by path and validated against every file's mtime/size
+# ----------------------------------------------
+def _cachedPlanPath(realPath):
+  return os.path.join(PLAN_CACHE_DIR, "%s.plan" % hashlib.sha1(realPath).hexdigest())
+
+def _loadCachedPlan(realPath):
+  if not PLAN_CACHE_DIR:
+    return None
+  cachePath = _cachedPlanPath(realPath)
+  if not os.path.exists(cachePath):
+    return None
+  try:
+    with open(cachePath, 'rb') as cacheFile:
+      cached = pickle.load(cacheFile)
+    for depPath, depStat in cached["deps"].iteritems():
+      fileStat = os.stat(depPath)
+      if (fileStat.st_mtime, fileStat.st_size) != depStat:
+        return None
+    return cached["plan"]
+  except Exception, e:
+    logging.debug("LOAD:\tIgnoring unreadable plan cache (%s): %s" % (cachePath, e))
+    return None
+
+def _saveCachedPlan(realPath, plan, deps):
+  if not PLAN_CACHE_DIR:
+    return
+  try:
+    if not os.path.isdir(PLAN_CACHE_DIR):
+      os.makedirs(PLAN_CACHE_DIR)
+    cachePath = _cachedPlanPath(realPath)
+    tmpPath = "%s.%s.tmp" % (cachePath, os.getpid())
+    with open(tmpPath, 'wb') as cacheFile:
+      pickle.dump({"deps": deps, "plan": plan}, cacheFile, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpPath, cachePath) # Atomic, so parallel workers never read half a plan
+  except Exception, e:
+    logging.warning("LOAD:\tCould not cache plan for (%s): %s" % (realPath, e))
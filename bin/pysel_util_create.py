@@ -12,6 +12,7 @@ import texttable as tt
 from colorama import Fore, Back, Style
 
 import pysel_util_core    as util_core
+import pysel_optimize     as optimize
 
 try:
   import json
@@ -42,6 +43,8 @@ def _displayHelp(section, colorCode=("%s" % Fore.MAGENTA + Style.BRIGHT)):
     print "%13s: Set the value of a typeKeys (text to type) or navigate (which URL to go to) operation" % "set_Value"
     print "%13s: Set the DOM element to type in or click on" % "set_Selector"
     print "%13s: Set the DOM element to search within when locating the selector" % "set_Parent"
+    print "%13s: Add a field (fillForm) or element (assertElements, assertNoElements, clickSequence)" % "add_Item"
+    print "%13s: Remove the last field or element added" % "remove_Item"
     print "%13s: Add this step to the current test" % "commit"
     print "------------------------------------------------------------------------"
   if section == "create":
@@ -101,7 +104,7 @@ def _promptChoice(choices, hide=False, lType="Action"):
 ######################################################################
 # Create a Selector
 ######################################################################
-def _createSelector():
+def _createSelector(verify=True):
   selector = {}
   os.system('clear')
   _displayBanner("Create Selector", Fore.YELLOW)
@@ -115,27 +118,47 @@ def _createSelector():
     selector[choice] = value
 
     print "Current Selector: %s" % selector
-    print "Searching for element...",
-    try:
-      elements = directives._getObject(DRIVER, selector, 3)
-      print Style.BRIGHT + Fore.GREEN + "Element Found!" + Style.RESET_ALL
-    
-    except Exception, e:
-      print Style.BRIGHT + Fore.RED + "Element Not Found! Aborting Selector Creation." + Style.RESET_ALL
-      raw_input("Continue..")
-      return None
+    if verify: # Selectors for assertNoElements are expected not to match
+      print "Searching for element...",
+      try:
+        elements = directives._getObject(DRIVER, selector, 3)
+        print Style.BRIGHT + Fore.GREEN + "Element Found!" + Style.RESET_ALL
+
+      except Exception, e:
+        print Style.BRIGHT + Fore.RED + "Element Not Found! Aborting Selector Creation." + Style.RESET_ALL
+        raw_input("Continue..")
+        return None
 
     print ""
     choice = ""
     while choice not in ["a", "s", "c"]:
-      choice = raw_input(Style.BRIGHT + "Select: (A)ppend," + Fore.GREEN + " (S)ubmit," + Fore.RESET + " (C)ancel >> [s]" + Style.RESET_ALL).lower()
+      choice = raw_input(Style.BRIGHT + "Select: (A)ppend, (O)ptimize," + Fore.GREEN + " (S)ubmit," + Fore.RESET + " (C)ancel >> [s]" + Style.RESET_ALL).lower()
       if len(choice) == 0:
         choice = "s"
+      if choice == "o":
+        selector = _optimizeSelector(selector)
     if choice == "s":
       return selector
     if choice == "c":
       return None
 
+######################################################################
+# Swap a selector for the cheapest unique one matching the same element
+######################################################################
+def _optimizeSelector(selector):
+  try:
+    suggestion = optimize.suggestSelector(DRIVER, selector)
+  except Exception, e:
+    print Style.BRIGHT + Fore.RED + "Could not optimize: %s" % e + Style.RESET_ALL
+    return selector
+  if not suggestion:
+    print Style.BRIGHT + Fore.GREEN + "Already the cheapest selector" + Style.RESET_ALL
+    return selector
+  print Style.BRIGHT + Fore.GREEN + "Optimized: %s (%.1fms -> %.1fms per lookup) %s" % (
+    json.dumps(suggestion["selector"]), suggestion["before"] * 1000, suggestion["after"] * 1000, suggestion["note"]) + Style.RESET_ALL
+  print "Current Selector: %s" % suggestion["selector"]
+  return suggestion["selector"]
+
 ######################################################################
 # Test a Step
 ######################################################################
@@ -167,6 +190,17 @@ def _drawStep(action, value, parent, selector):
 
   print Style.BRIGHT + Fore.CYAN + tab.draw() + Style.RESET_ALL
 
+######################################################################
+# Create a field ({"selector", "value"}) or selector for a batch step
+######################################################################
+def _createItem(action):
+  selector = _createSelector(verify=(action != "assertNoElements"))
+  if not selector:
+    return None
+  if action == "fillForm":
+    return {"selector": selector, "value": raw_input("Enter Value for (%s): " % json.dumps(selector))}
+  return selector
+
 ######################################################################
 # Create a Step for the testObject
 ######################################################################
@@ -175,26 +209,34 @@ def _createStep():
   parent = None
   action = None
   value = None
+  items = []
 
   os.system('clear')
   _displayBanner("ADD STEP", Style.BRIGHT + Fore.GREEN)
   _displayHelp("add")
-  actions = ["navigateUrl", "typeKeys", "click"]
+  actions = ["navigateUrl", "typeKeys", "click", "fillForm", "assertElements", "assertNoElements", "clickSequence"]
   action = _promptChoice(actions, lType="Test Action")
   if not action:
     return False
+  batch = action in ["fillForm", "assertElements", "assertNoElements", "clickSequence"]
   
   choices = ["commit"]
   if action in ["navigateUrl", "typeKeys"]:
     choices.append("set_Value")
   if action in ["typeKeys", "click"]:
     choices = choices + ["set_Selector", "set_Parent"]
+  if batch:
+    choices = choices + ["add_Item", "remove_Item", "set_Parent"]
   
   if "set_Value" in choices: # Set value before being prompted to help make this more fluid
     print "Set the value of typeKeys (text to type) or navigate (which URL to go to)"
     value = raw_input("Enter Value for (%s): " % action)
   if "set_Selector" in choices: # Set value before being prompted to help make this more fluid
     selector = _createSelector()
+  if batch:
+    item = _createItem(action)
+    if item:
+      items.append(item)
     
   while True:
     os.system('clear')
@@ -202,7 +244,11 @@ def _createStep():
     _displayHelp("add")
 
     print "\nCurrent Step:"
-    _drawStep(action, value, parent, selector)
+    if batch:
+      _drawStep(action, "\n".join(["%s" % item["value"] for item in items if "value" in item]), parent,
+                "\n".join([json.dumps(item.get("selector", item)) for item in items]))
+    else:
+      _drawStep(action, value, parent, selector)
 
     choice = _promptChoice(choices)
     if not choice or choice == "cancel":
@@ -214,13 +260,24 @@ def _createStep():
       selector = _createSelector()
     elif choice == "set_Parent":
       parent = _createSelector()
+    elif choice == "add_Item":
+      item = _createItem(action)
+      if item:
+        items.append(item)
+    elif choice == "remove_Item":
+      items = items[:-1]
      
     elif choice == "commit":
       step = { action : {} }
       if parent:
         step[action]["parent"] = parent
-      step[action]["selector"] = selector
-      step[action]["value"] = value
+      if action == "fillForm":
+        step[action]["fields"] = items
+      elif batch:
+        step[action]["selectors"] = items
+      else:
+        step[action]["selector"] = selector
+        step[action]["value"] = value
       _execStep(step)
       return step
 
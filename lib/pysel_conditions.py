@@ -0,0 +1,101 @@
+#!/usr/bin/python
+
+import logging
+import os, re, textwrap, time
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+############ GLOBALS #################
+SCRIPT_TIMEOUTS = {} # Async script timeout last set on each session, to skip redundant calls
+
+######################################################################
+# Instruments the page once: a MutationObserver timestamps the last DOM
+# change and XMLHttpRequest/fetch are wrapped to count requests in flight
+######################################################################
+_INSTRUMENT_SCRIPT = r"""
+if (!window.__pysel) {
+  var s = window.__pysel = {pending: 0, lastMutation: Date.now(), lastNetwork: Date.now()};
+  new MutationObserver(function() { s.lastMutation = Date.now(); }).observe(
+    document.documentElement, {subtree: true, childList: true, attributes: true, characterData: true});
+  var settled = function() { s.pending = Math.max(0, s.pending - 1); s.lastNetwork = Date.now(); };
+  var send = XMLHttpRequest.prototype.send;
+  XMLHttpRequest.prototype.send = function() {
+    s.pending++; s.lastNetwork = Date.now();
+    this.addEventListener('loadend', settled);
+    return send.apply(this, arguments);
+  };
+  if (window.fetch) {
+    var fetch = window.fetch;
+    window.fetch = function() {
+      s.pending++; s.lastNetwork = Date.now();
+      return fetch.apply(this, arguments).then(
+        function(r) { settled(); return r; }, function(e) { settled(); throw e; });
+    };
+  }
+}
+"""
+
+# arguments: domQuietMs (or null), networkIdleMs (or null)
+_CHECK_SCRIPT = _INSTRUMENT_SCRIPT + r"""
+var s = window.__pysel, now = Date.now(), domQuiet = arguments[0], networkIdle = arguments[1];
+return (domQuiet == null || now - s.lastMutation >= domQuiet) &&
+       (networkIdle == null || (s.pending == 0 && now - s.lastNetwork >= networkIdle));
+"""
+
+# arguments: domQuietMs (or null), networkIdleMs (or null), timeoutMs, callback
+_SETTLE_SCRIPT = _INSTRUMENT_SCRIPT + r"""
+var domQuiet = arguments[0], networkIdle = arguments[1], timeout = arguments[2];
+var done = arguments[arguments.length - 1], start = Date.now();
+(function check() {
+  var s = window.__pysel, now = Date.now();
+  if ((domQuiet == null || now - s.lastMutation >= domQuiet) &&
+      (networkIdle == null || (s.pending == 0 && now - s.lastNetwork >= networkIdle))) return done(true);
+  if (now - start >= timeout) return done(false);
+  setTimeout(check, 25);
+})();
+"""
+
+######################################################################
+# Install the page instrumentation (do this before an action so the
+# requests it triggers are counted)
+######################################################################
+def instrument(driver):
+  driver.execute_script(_INSTRUMENT_SCRIPT)
+
+######################################################################
+# Wait conditions for WebDriverWait: the DOM has not changed for ms
+######################################################################
+class DomQuiet:
+  def __init__(self, ms):
+    self.ms = ms
+
+  def __call__(self, driver):
+    return driver.execute_script(_CHECK_SCRIPT, self.ms, None)
+
+######################################################################
+# Wait conditions for WebDriverWait: no XHR/fetch in flight for ms
+######################################################################
+class NetworkIdle:
+  def __init__(self, ms):
+    self.ms = ms
+
+  def __call__(self, driver):
+    return driver.execute_script(_CHECK_SCRIPT, None, self.ms)
+
+######################################################################
+# Wait for the DOM to be quiet and/or the network idle in one round trip.
+# The polling happens in the browser; returns False on timeout.
+######################################################################
+def forgetSession(sessionId):
+  SCRIPT_TIMEOUTS.pop(sessionId, None)
+
+def waitForSettle(driver, domQuiet=None, networkIdle=None, timeout=5):
+  if SCRIPT_TIMEOUTS.get(driver.session_id) != timeout:
+    driver.set_script_timeout(timeout + 1)
+    SCRIPT_TIMEOUTS[driver.session_id] = timeout
+  settled = driver.execute_async_script(_SETTLE_SCRIPT, domQuiet, networkIdle, int(timeout * 1000))
+  logging.debug("WAIT:\tSettled=%s (dom_quiet=%s, network_idle=%s)", settled, domQuiet, networkIdle)
+  return settled
@@ -1,7 +1,10 @@
 #!/usr/bin/python
 
 import pysel_core as core
+import pysel_reporter as reporter
+import pysel_conditions as conditions
 from selenium.webdriver.support.ui import WebDriverWait # available since 2.4.0
+from selenium.common.exceptions import TimeoutException, WebDriverException, StaleElementReferenceException
 import logging
 
 import os, re, textwrap, time
@@ -11,18 +14,102 @@ try:
 except ImportError:
   import simplejson as json
 
+############ GLOBALS #################
+LOG = logging.getLogger()
+# Resolved elements for the current page, keyed by normalized parent+selector
+ELEMENT_CACHE = {}
+
+######################################################################
+# Resolves a whole selector object in the browser in one round trip.
+# arguments[0] is the parent element (null for the document), arguments[1]
+# the [key, value] pairs in the order _getObject would try them.
+######################################################################
+_RESOLVE_FUNCTIONS = r"""
+var root = arguments[0] || document;
+function snapshot(expr) {
+  var res = document.evaluate(expr, root, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null), out = [];
+  for (var i = 0; i < res.snapshotLength; i++) out.push(res.snapshotItem(i));
+  return out;
+}
+function attr(name, value) {
+  return root.querySelectorAll('[' + name + '="' + value.replace(/(["\\])/g, '\\$1') + '"]');
+}
+function links(value, partial) {
+  var all = root.getElementsByTagName('a'), out = [];
+  for (var i = 0; i < all.length; i++) {
+    var text = (all[i].innerText || all[i].textContent || '').trim();
+    if (partial ? text.indexOf(value) != -1 : text == value) out.push(all[i]);
+  }
+  return out;
+}
+function find(key, value) {
+  switch (key) {
+    case 'id':                return attr('id', value);
+    case 'name':              return attr('name', value);
+    case 'tag_name':          return root.getElementsByTagName(value);
+    case 'class_name':        return root.getElementsByClassName(value);
+    case 'css_selector':      return root.querySelectorAll(value);
+    case 'xpath':             return snapshot(value);
+    case 'text':              return snapshot("//*[contains(.,'" + value + "')]");
+    case 'link_text':         return links(value, false);
+    case 'partial_link_text': return links(value, true);
+  }
+  return null;
+}
+function clickable(el) {
+  if (el.disabled) return false;
+  var style = window.getComputedStyle(el);
+  return style.visibility != 'hidden' && style.display != 'none' &&
+         (el.offsetWidth > 0 || el.offsetHeight > 0 || el.getClientRects().length > 0);
+}
+function resolve(pairs) {
+  var primary = null;
+  for (var p = 0; p < pairs.length; p++) {
+    var found = find(pairs[p][0], pairs[p][1]);
+    if (found === null) continue;
+    var visible = [];
+    for (var i = 0; i < found.length; i++) if (clickable(found[i])) visible.push(found[i]);
+    if (visible.length == 0) return [];
+    if (primary === null || primary.length == 0) {
+      primary = visible;
+    } else {
+      var seen = new Set(primary);
+      primary = visible.filter(function(el) { return seen.has(el); });
+    }
+    if (primary.length == 1) break;
+  }
+  return primary || [];
+}
+"""
+
+_RESOLVE_SCRIPT = _RESOLVE_FUNCTIONS + r"""
+return resolve(arguments[1]);
+"""
+
+# arguments[1] is a list of pair lists; returns at most two matches per
+# selector, enough to tell a unique match from an ambiguous one
+_RESOLVE_ALL_SCRIPT = _RESOLVE_FUNCTIONS + r"""
+var selectors = arguments[1], out = [];
+for (var s = 0; s < selectors.length; s++) out.push(resolve(selectors[s]).slice(0, 2));
+return out;
+"""
+
+######################################################################
+# Raised by the batch directives once every item has been tried;
+# failures is a list of (index, selector, message)
+######################################################################
+class BatchError(Exception):
+  def __init__(self, directive, numItems, failures):
+    self.failures = failures
+    items = ["#%s %s: %s" % (index + 1, json.dumps(selector, sort_keys=True), message) for index, selector, message in failures]
+    Exception.__init__(self, "%s failed for %s of %s items: %s" % (directive, len(failures), numItems, "; ".join(items)))
+
 ######################################################################
 # Returns list of common objects between two lists using '_id'
 ######################################################################
 def _common_elements(list1, list2):
-  commonList = []
-  for se1 in list1:
-    se1_id = se1._id
-    for se2 in list2:
-      se2_id = se2._id
-      if se2_id == se1_id:
-        commonList.append(se1)      
-  return commonList
+  list2_ids = set([se2._id for se2 in list2])
+  return [se1 for se1 in list1 if se1._id in list2_ids]
 
 def _clickable(element_list):
   return_list = []
@@ -32,22 +119,59 @@ def _clickable(element_list):
   return return_list
 
 ######################################################################
-# Returns an object from a parent selector (can be driver)
+# Runs the resolution script, returns the visible and enabled matches
+######################################################################
+def _resolveByScript(parent, selectorObject):
+  root = None
+  if not hasattr(parent, "execute_script"): # parent is an element, not the driver
+    root = parent
+  pairs = [[selKey, selectorObject[selKey]] for selKey in selectorObject.keys()]
+  return core.DRIVER.execute_script(_RESOLVE_SCRIPT, root, pairs)
+
+######################################################################
+# Resolves several selectors under one parent in one round trip.
+# Returns a match list per selector, or None if scripts are unavailable.
 ######################################################################
-def _getObject(parent, selectorObject, timeout=0):
-  foundObject = None
+def _resolveAllByScript(parent, selectors):
+  root = None
+  if not hasattr(parent, "execute_script"):
+    root = parent
+  pairs = [[[selKey, selector[selKey]] for selKey in selector.keys()] for selector in selectors]
+  try:
+    return core.DRIVER.execute_script(_RESOLVE_ALL_SCRIPT, root, pairs)
+  except WebDriverException, e:
+    logging.debug("Script resolution unavailable (%s), falling back to lookups per selector", e)
+    return None
 
+######################################################################
+# Polls _resolveAllByScript until done(matchLists) holds or timeout
+# seconds have passed (a single attempt when timeout is 0)
+######################################################################
+def _resolveAll(parent, selectors, timeout, done=all):
+  deadline = time.time() + timeout
+  attempts = 0
+  try:
+    while True:
+      attempts = attempts + 1
+      found = _resolveAllByScript(parent, selectors)
+      if found is None or done(found) or time.time() >= deadline:
+        return found
+      time.sleep(core.POLL_INTERVAL)
+  finally:
+    reporter.retry(attempts - 1)
+
+######################################################################
+# Returns the matches of a selector using one lookup per selector key
+######################################################################
+def _resolveByKeys(parent, selectorObject):
   selectorKeys = selectorObject.keys()
   primarySelectors = []
 
-  if timeout == 0:
-    timeout = core.IMPLICIT_WAIT
-  
   # Iterate over selectorKeys narrowing down a list of primarySelectors until there is exactly 1 element (ideally)
   for selKey in selectorKeys:
     selectorList = []
     selVal = selectorObject[selKey]
-    logging.debug("Finding object by  %s: %s" % (selKey, selVal))
+    logging.debug("Finding object by  %s: %s", selKey, selVal)
 
     # If the selector Key is 'text', make the necessary adjustments to do an identical search using xpath (only way)
     if (selKey == "text"):
@@ -58,14 +182,15 @@ def _getObject(parent, selectorObject, timeout=0):
     methodName = "find_elements_by_%s" % selKey
     if (methodName in dir(parent)): # Ensure methodName exists
       locationMethod = getattr(parent, methodName) # Retrieve method
-      wait = WebDriverWait(core.DRIVER, timeout) # Create a webDriver wait
-      selectorList = wait.until(lambda d: _clickable(locationMethod(selVal))) # Return a refined selection of elements containing those which are visible and enabled
-    
+      selectorList = _clickable(locationMethod(selVal)) # Return a refined selection of elements containing those which are visible and enabled
+      if len(selectorList) == 0: # Every key has to match; the caller polls again
+        return []
 
     # Display IDs of selectors available during this iteration
-    logging.debug("Available Selectors for (%s: %s)" % (selKey, selVal))
-    for se in selectorList:
-      logging.debug("Available Selector (%s) ID (%s)" % (se, se._id))
+    if LOG.isEnabledFor(logging.DEBUG):
+      logging.debug("Available Selectors for (%s: %s)", selKey, selVal)
+      for se in selectorList:
+        logging.debug("Available Selector (%s) ID (%s)", se, se._id)
 
     # If primary selectors are still empty, set it to the results of the first scan
     if len(primarySelectors) == 0: 
@@ -75,13 +200,49 @@ def _getObject(parent, selectorObject, timeout=0):
       primarySelectors = _common_elements(selectorList, primarySelectors)
     
     # Displays IDs of selectors currently on the primary Stack - this has to be reduced to 1 for safe testing.
-    logging.debug("Current Selectors for (%s: %s)" % (selKey, selVal))
-    for se in primarySelectors:
-      logging.debug("Primary Selector(s) (%s) ID (%s)" % (se, se._id))
+    if LOG.isEnabledFor(logging.DEBUG):
+      logging.debug("Current Selectors for (%s: %s)", selKey, selVal)
+      for se in primarySelectors:
+        logging.debug("Primary Selector(s) (%s) ID (%s)", se, se._id)
 
     if len(primarySelectors) == 1: # if there is only one element found break out of loop
       break
 
+  return primarySelectors
+
+######################################################################
+# Returns a function doing one resolution attempt of a selector, by
+# script if the browser allows it and per selector key otherwise
+######################################################################
+def _resolver(parent, selectorObject):
+  state = {"script": True, "attempts": 0}
+  def resolve(driver=None):
+    state["attempts"] = state["attempts"] + 1
+    if state["script"]:
+      try:
+        return _resolveByScript(parent, selectorObject)
+      except WebDriverException, e:
+        logging.debug("Script resolution unavailable (%s), falling back to per-key lookups", e)
+        state["script"] = False
+    return _resolveByKeys(parent, selectorObject)
+  resolve.state = state
+  return resolve
+
+######################################################################
+# Returns an object from a parent selector (can be driver)
+######################################################################
+def _getObject(parent, selectorObject, timeout=None):
+  if timeout is None: # 0 is a single attempt
+    timeout = core.ELEMENT_TIMEOUT
+
+  # Poll a single resolution attempt until something matches (implicit waits are off)
+  resolve = _resolver(parent, selectorObject)
+  try:
+    wait = WebDriverWait(core.DRIVER, timeout, poll_frequency=core.POLL_INTERVAL)
+    primarySelectors = wait.until(resolve)
+  finally:
+    reporter.retry(resolve.state["attempts"] - 1)
+
   # Raise Error if empty selectors
   if len(primarySelectors) == 0:
     core.raiseError("No Selectors found", selectorObject)
@@ -93,50 +254,210 @@ def _getObject(parent, selectorObject, timeout=0):
     core.raiseWarning("Multiple Selectors found", selectorObject)
     return primarySelectors[0]
 
+######################################################################
+# Returns True once a selector matches nothing, polling for at most
+# timeout seconds so a passing negative check costs a single lookup
+######################################################################
+def _isAbsent(parent, selectorObject, timeout):
+  resolve = _resolver(parent, selectorObject)
+  try:
+    wait = WebDriverWait(core.DRIVER, timeout, poll_frequency=core.POLL_INTERVAL)
+    return wait.until(lambda d: len(resolve(d)) == 0)
+  except TimeoutException:
+    return False
+  finally:
+    reporter.retry(resolve.state["attempts"] - 1)
+
+######################################################################
+# Forget every cached element (new page or new driver)
+######################################################################
+def clearCache():
+  ELEMENT_CACHE.clear()
+
+def _cacheKey(parentSelector, selector):
+  return json.dumps([parentSelector, selector], sort_keys=True)
+
+######################################################################
+# Returns a cached element if it is still attached and displayed
+######################################################################
+def _cachedObject(key):
+  webObject = ELEMENT_CACHE.get(key)
+  if webObject is None:
+    return None
+  try:
+    if webObject.is_displayed(): # One round trip; raises if the element went stale
+      core.RUN.cacheHit = core.RUN.cacheHit + 1
+      return webObject
+  except StaleElementReferenceException:
+    pass
+  del ELEMENT_CACHE[key]
+  return None
+
+######################################################################
+# Per-step timeouts from the test JSON, falling back to the defaults
+######################################################################
+def _stepTimeout(stepData):
+  return stepData.get("timeout", core.ELEMENT_TIMEOUT)
+
+def _stepAbsentTimeout(stepData):
+  return stepData.get("absent_timeout", core.ABSENT_TIMEOUT)
+
+######################################################################
+# What to wait for after an action: a step's "settle" object, or the
+# defaults. "settle": false skips waiting.
+######################################################################
+def _stepSettle(stepData):
+  return stepData.get("settle", {
+    "dom_quiet":    core.SETTLE_DOM_QUIET,
+    "network_idle": core.SETTLE_NETWORK_IDLE,
+  })
+
+######################################################################
+# Wait in the browser until the page is settled, in a single call.
+# Falls back to a short sleep when async scripts are unavailable.
+######################################################################
+def _settle(settle):
+  try:
+    return conditions.waitForSettle(core.DRIVER, settle.get("dom_quiet"), settle.get("network_idle"),
+                                    settle.get("timeout", core.SETTLE_TIMEOUT))
+  except WebDriverException, e:
+    logging.debug("WAIT:\tSettle script unavailable (%s), sleeping instead", e)
+    time.sleep(0.1)
+    return True
+
+# Before every click: a click that navigated (a form submit, a link, a
+# redirect) left a page without it, and the script is a no-op otherwise
+def _instrumentPage():
+  try:
+    conditions.instrument(core.DRIVER)
+  except WebDriverException, e:
+    logging.debug("WAIT:\tCould not instrument page: %s", e)
+
+######################################################################
+# Resolves a step's parent (the driver if it has none), reusing earlier lookups
+######################################################################
+def _getStepParent(stepData):
+  parentSelector = stepData.get("parent")
+  if not parentSelector:
+    return core.DRIVER
+  parentKey = _cacheKey(None, parentSelector)
+  parent = _cachedObject(parentKey)
+  if parent is None:
+    core.RUN.cacheMiss = core.RUN.cacheMiss + 1
+    parent = _getObject(core.DRIVER, parentSelector, _stepTimeout(stepData))
+    if parent:
+      ELEMENT_CACHE[parentKey] = parent
+  return parent
+
+######################################################################
+# Resolves a step's parent and selector, reusing elements from earlier steps
+######################################################################
+def _getStepObject(stepData):
+  key = _cacheKey(stepData.get("parent"), stepData["selector"])
+  webObject = _cachedObject(key)
+  if webObject is not None:
+    return webObject
+  core.RUN.cacheMiss = core.RUN.cacheMiss + 1
+
+  parent = _getStepParent(stepData)
+  webObject = _getObject(parent, stepData["selector"], _stepTimeout(stepData))
+  if webObject:
+    ELEMENT_CACHE[key] = webObject
+  return webObject
+
+######################################################################
+# Resolves the selectors of a batch step together, waiting until all of
+# them match. Returns the elements (None where nothing matched) and the
+# failures as (index, selector, message). Found elements are cached for
+# later steps.
+######################################################################
+def _getStepObjects(stepData, selectors):
+  core.RUN.cacheMiss = core.RUN.cacheMiss + len(selectors)
+  parent = _getStepParent(stepData)
+  found = _resolveAll(parent, selectors, _stepTimeout(stepData))
+
+  webObjects = []
+  failures = []
+  for index, selector in enumerate(selectors):
+    webObject = None
+    if found is None: # No scripts, look each one up on its own
+      try:
+        webObject = _getObject(parent, selector, _stepTimeout(stepData))
+      except TimeoutException:
+        pass
+    elif found[index]:
+      if len(found[index]) > 1:
+        core.raiseWarning("Multiple Selectors found", selector)
+      webObject = found[index][0]
+
+    if webObject is None:
+      failures.append((index, selector, "No element found"))
+    else:
+      ELEMENT_CACHE[_cacheKey(stepData.get("parent"), selector)] = webObject
+    webObjects.append(webObject)
+  return webObjects, failures
+
 ######################################################################
 # Navigate to a page
 ######################################################################
 def navigateUrl(stepData):
   driver = core.DRIVER
   url = stepData['value']
-  logging.debug("TEST:\tnavigateUrl\t%s" % url)
-  driver.get(url)
+  logging.debug("TEST:\tnavigateUrl\t%s", url)
+  clearCache()
+  core.visitUrl(url)
+  with reporter.phase("action"):
+    driver.get(url)
 
 ######################################################################
 # Send keys to object
 ######################################################################
 def typeKeys(stepData):
-  selector = stepData["selector"]
   keyValue = stepData["value"]
-  parent = core.DRIVER
-
-  logging.debug("TEST:\ttyping\t%s" % keyValue)
 
-  if "parent" in stepData.keys():
-    parent = _getObject(parent, stepData["parent"])
+  logging.debug("TEST:\ttyping\t%s", keyValue)
 
-  webObject = _getObject(parent, selector)
-  webObject.send_keys(keyValue)
+  with reporter.phase("lookup"):
+    webObject = _getStepObject(stepData)
+  with reporter.phase("action"):
+    webObject.send_keys(keyValue)
 
 ######################################################################
 # Click on Object
 ######################################################################
 def click(stepData):
-  selector = stepData["selector"]
-  parent = core.DRIVER
-
   logging.debug("TEST:\tclicking\t")
 
-  if "parent" in stepData.keys():
-    parent = _getObject(parent, stepData["parent"])
-
-  webObject = _getObject(parent, selector)
+  with reporter.phase("lookup"):
+    webObject = _getStepObject(stepData)
   
   driver = core.DRIVER
-  elem_visible = WebDriverWait(driver, core.IMPLICIT_WAIT).until(lambda driver : webObject.is_displayed()) 
+  with reporter.phase("wait"):
+    WebDriverWait(driver, _stepTimeout(stepData), poll_frequency=core.POLL_INTERVAL).until(lambda driver : webObject.is_displayed()) 
   
-  webObject.click()
-  time.sleep(0.1)
+  settle = _stepSettle(stepData)
+  if settle:
+    _instrumentPage() # Count the requests the click starts
+  with reporter.phase("action"):
+    webObject.click()
+  if settle:
+    with reporter.phase("settle"):
+      if not _settle(settle):
+        logging.debug("WAIT:\tPage still busy after click, continuing")
+
+######################################################################
+# Wait until the DOM is quiet and/or the network is idle
+######################################################################
+def waitFor(stepData):
+  logging.debug("TEST:\twaitFor\t%s", stepData)
+
+  settle = dict(_stepSettle({}))
+  settle.update(stepData)
+  with reporter.phase("wait"):
+    settled = _settle(settle)
+
+  if not settled:
+    raise TimeoutException("Page did not settle within %ss" % settle.get("timeout", core.SETTLE_TIMEOUT))
 
 ######################################################################
 # Validate Element Exists
@@ -144,12 +465,8 @@ def click(stepData):
 def assertElement(stepData):
   logging.debug("TEST:\t Assert Element \t")
 
-  parent = core.DRIVER
-  if "parent" in stepData.keys():
-    parent = _getObject(parent, stepData["parent"])
-
-  selector = stepData["selector"]
-  webObject = _getObject(parent, selector)
+  with reporter.phase("lookup"):
+    webObject = _getStepObject(stepData)
 
   if webObject:
     return True
@@ -162,14 +479,108 @@ def assertElement(stepData):
 def assertNoElement(stepData):
   logging.debug("TEST:\t Assert No Element \t")
 
-  parent = core.DRIVER
-  if "parent" in stepData.keys():
-    parent = _getObject(parent, stepData["parent"])
-
-  selector = stepData["selector"]
-  webObject = _getObject(parent, selector)
+  with reporter.phase("lookup"):
+    parent = _getStepParent(stepData)
+    absent = _isAbsent(parent, stepData["selector"], _stepAbsentTimeout(stepData))
 
-  if webObject:
-    core.raiseWarning("Assertion Failed. Element found!", stepData)
+  if absent:
+    return True
   else:
-    return True
\ No newline at end of file
+    core.raiseWarning("Assertion Failed. Element found!", stepData)
+
+######################################################################
+# Type into several fields; "fields" is a list of {"selector", "value"}.
+# Every field is looked up in one call, and every field is tried before
+# the failures are reported.
+######################################################################
+def fillForm(stepData):
+  fields = stepData["fields"]
+  logging.debug("TEST:\tfillForm\t%s fields", len(fields))
+
+  with reporter.phase("lookup"):
+    webObjects, failures = _getStepObjects(stepData, [field["selector"] for field in fields])
+  with reporter.phase("action"):
+    for index, field in enumerate(fields):
+      if webObjects[index] is None:
+        continue
+      try:
+        webObjects[index].send_keys(field["value"])
+      except WebDriverException, e:
+        failures.append((index, field["selector"], core.describeError(e)))
+
+  if failures:
+    raise BatchError("fillForm", len(fields), sorted(failures))
+
+######################################################################
+# Click several elements in order, settling after each click like the
+# click directive. Elements already on the page are looked up together;
+# ones that only appear after an earlier click are waited for in turn.
+# An element looked up before the clicks that can't be clicked once its
+# turn comes (an earlier click replaced, hid or covered it) is looked up
+# again, as a click step of its own would.
+######################################################################
+def clickSequence(stepData):
+  selectors = stepData["selectors"]
+  logging.debug("TEST:\tclickSequence\t%s elements", len(selectors))
+
+  with reporter.phase("lookup"):
+    parent = _getStepParent(stepData)
+    found = _resolveAll(parent, selectors, 0)
+
+  settle = _stepSettle(stepData)
+  for index, selector in enumerate(selectors):
+    try:
+      webObject = found[index][0] if found and found[index] else None
+      preResolved = webObject is not None
+      if webObject is None:
+        with reporter.phase("lookup"):
+          webObject = _getObject(parent, selector, _stepTimeout(stepData))
+      if settle:
+        _instrumentPage()
+      with reporter.phase("action"):
+        try:
+          webObject.click()
+        except WebDriverException:
+          if not preResolved:
+            raise
+          webObject = _getObject(parent, selector, _stepTimeout(stepData))
+          webObject.click()
+    except WebDriverException, e:
+      # Later clicks depend on this one, so stop here
+      raise BatchError("clickSequence", len(selectors), [(index, selector, core.describeError(e))])
+    if settle:
+      with reporter.phase("settle"):
+        if not _settle(settle):
+          logging.debug("WAIT:\tPage still busy after click, continuing")
+
+######################################################################
+# Validate several Elements Exist, with one lookup for all of them
+######################################################################
+def assertElements(stepData):
+  selectors = stepData["selectors"]
+  logging.debug("TEST:\t Assert Elements \t%s", len(selectors))
+
+  with reporter.phase("lookup"):
+    webObjects, failures = _getStepObjects(stepData, selectors)
+
+  if failures:
+    raise BatchError("assertElements", len(selectors), failures)
+  return True
+
+######################################################################
+# Validate several Elements Do Not Exist, warning for each one found
+######################################################################
+def assertNoElements(stepData):
+  selectors = stepData["selectors"]
+  logging.debug("TEST:\t Assert No Elements \t%s", len(selectors))
+
+  with reporter.phase("lookup"):
+    parent = _getStepParent(stepData)
+    found = _resolveAll(parent, selectors, _stepAbsentTimeout(stepData), lambda found: not any(found))
+    if found is None: # No scripts, check each one on its own
+      found = [[] if _isAbsent(parent, selector, _stepAbsentTimeout(stepData)) else [True] for selector in selectors]
+
+  present = [selector for index, selector in enumerate(selectors) if found[index]]
+  for selector in present:
+    core.raiseWarning("Assertion Failed. Element found!", selector)
+  return len(present) == 0
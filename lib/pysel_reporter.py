@@ -2,9 +2,197 @@
 
 import logging
 import os, re, textwrap, time
+from xml.sax.saxutils import escape, quoteattr
 
 try:
   import json
 except ImportError:
   import simplejson as json
 
+############ GLOBALS #################
+CURRENT_STEP = None # StepTimer of the step currently running, if any
+
+######################################################################
+# Times the phases (lookup, wait, settle, action, screenshot) of one step
+######################################################################
+class StepTimer:
+  def __init__(self, stepNum, directive, selector=None):
+    self.stepNum   = stepNum
+    self.directive = directive
+    self.selector  = selector
+    self.phases    = {}
+    self.retries   = 0
+    self.start     = time.time()
+
+  def phase(self, name):
+    return _Phase(self, name)
+
+  def record(self, status, error=None):
+    duration = time.time() - self.start
+    phases = dict((name, round(elapsed, 6)) for name, elapsed in self.phases.iteritems())
+    phases["other"] = round(max(duration - sum(self.phases.values()), 0), 6)
+    record = {
+      "type":      "step",
+      "step":      self.stepNum,
+      "directive": self.directive,
+      "start":     round(self.start, 6),
+      "duration":  round(duration, 6),
+      "phases":    phases,
+      "retries":   self.retries,
+      "status":    status,
+    }
+    if self.selector is not None:
+      record["selector"] = self.selector
+    if error is not None:
+      record["error"] = "%s" % error
+    return record
+
+class _Phase:
+  def __init__(self, timer, name):
+    self.timer = timer
+    self.name  = name
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, excType, excValue, tb):
+    phases = self.timer.phases
+    phases[self.name] = phases.get(self.name, 0) + (time.time() - self.start)
+    return False
+
+class _NoPhase:
+  def __enter__(self):
+    return self
+
+  def __exit__(self, excType, excValue, tb):
+    return False
+
+_NO_PHASE = _NoPhase()
+
+######################################################################
+# Step timing hooks used by pysel_core and the directives
+######################################################################
+def startStep(stepNum, directive, selector=None):
+  global CURRENT_STEP
+  CURRENT_STEP = StepTimer(stepNum, directive, selector)
+  return CURRENT_STEP
+
+def phase(name):
+  if CURRENT_STEP is None: # Directives run outside a test (e.g. 'create') aren't timed
+    return _NO_PHASE
+  return CURRENT_STEP.phase(name)
+
+def retry(count=1):
+  if CURRENT_STEP is not None:
+    CURRENT_STEP.retries = CURRENT_STEP.retries + count
+
+def endStep(status, error=None):
+  global CURRENT_STEP
+  record = CURRENT_STEP.record(status, error)
+  CURRENT_STEP = None
+  return record
+
+######################################################################
+# Log argument that is only turned into JSON if the record is emitted
+######################################################################
+class LazyJson:
+  def __init__(self, value, indent=4):
+    self.value  = value
+    self.indent = indent
+
+  def __str__(self):
+    return json.dumps(self.value, sort_keys=True, indent=self.indent)
+
+######################################################################
+# Appends records to a JSON Lines file as they are produced
+######################################################################
+class RecordWriter:
+  def __init__(self, path):
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    self.path = path
+    self.file = open(path, 'w')
+
+  def write(self, record):
+    self.file.write(json.dumps(record, sort_keys=True) + "\n")
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
+
+######################################################################
+# Writes JUnit XML one testcase at a time. The closing tags are
+# rewritten after every testcase and the totals live in a fixed-width
+# opening tag that is rewritten in place, so the file is a complete
+# report at all times (even after a crash) and nothing is kept in memory.
+######################################################################
+class JUnitWriter:
+  HEADER_WIDTH = 256 # Room for the <testsuite> attributes, padded with spaces
+  NAME_WIDTH   = 100 # Bytes the escaped suite name may take of that
+  FOOTER       = "</testsuite>\n</testsuites>\n"
+
+  def __init__(self, path, suiteName):
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    self.path      = path
+    self.suiteName = suiteName
+    while len(_utf8(quoteattr(self.suiteName))) > self.NAME_WIDTH: # Escaping can make it several times longer
+      self.suiteName = self.suiteName[:-1]
+    self.timestamp = time.strftime("%Y-%m-%dT%H:%M:%S")
+    self.counts    = {"tests": 0, "failures": 0, "errors": 0}
+    self.time      = 0.0
+    self.file      = open(path, 'w+')
+    self.file.write('<?xml version="1.0" encoding="UTF-8"?>\n<testsuites>\n')
+    self.headerAt  = self.file.tell()
+    self.file.write(self._header())
+    self.bodyEnd   = self.file.tell()
+    self._writeFooter()
+
+  # status is "passed", "failed" (the test found a problem) or "error" (the test could not run)
+  def write(self, className, name, duration, status, message=None, output=None):
+    self.counts["tests"] = self.counts["tests"] + 1
+    self.time = self.time + duration
+    case = '  <testcase classname=%s name=%s time="%.3f"' % (quoteattr(className), quoteattr(name), duration)
+    if status == "passed" and not output:
+      case = case + '/>\n'
+    else:
+      case = case + '>\n'
+      if status == "failed":
+        self.counts["failures"] = self.counts["failures"] + 1
+        case = case + '    <failure message=%s/>\n' % quoteattr(message or "")
+      elif status == "error":
+        self.counts["errors"] = self.counts["errors"] + 1
+        case = case + '    <error message=%s/>\n' % quoteattr(message or "")
+      if output:
+        case = case + '    <system-out>%s</system-out>\n' % escape(output)
+      case = case + '  </testcase>\n'
+
+    self.file.seek(self.bodyEnd)
+    self.file.write(_utf8(case))
+    self.bodyEnd = self.file.tell()
+    self._writeFooter()
+    self.file.seek(self.headerAt)
+    self.file.write(self._header())
+    self.file.flush()
+
+  def close(self):
+    self.file.close()
+
+  #---------------------------------------------------------------------
+  # Internals
+  #---------------------------------------------------------------------
+  def _header(self):
+    header = '<testsuite name=%s tests="%i" failures="%i" errors="%i" skipped="0" time="%.3f" timestamp="%s"' % (
+      quoteattr(self.suiteName), self.counts["tests"], self.counts["failures"], self.counts["errors"],
+      self.time, self.timestamp)
+    return _utf8(header).ljust(self.HEADER_WIDTH) + '>\n'
+
+  def _writeFooter(self):
+    self.file.seek(self.bodyEnd)
+    self.file.write(self.FOOTER)
+    self.file.truncate()
+    self.file.flush()
+
+def _utf8(text):
+  return text.encode("utf-8") if isinstance(text, unicode) else text
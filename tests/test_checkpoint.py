@@ -0,0 +1,98 @@
+#!/usr/bin/python
+import os, sys, shutil, tempfile
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_checkpoint as checkpoint
+
+def nav(name):
+  return {"navigateUrl": {"value": "http://x/%s" % name}}
+
+######################################################################
+# A browser on one page, with its cookies and storage
+######################################################################
+class FakeBrowser:
+  def __init__(self, url="about:blank"):
+    self.url     = url
+    self.cookies = []
+    self.local   = {}
+    self.session = {}
+    self.visited = []
+
+  def get(self, url):
+    self.url = url
+    self.visited.append(url)
+
+  def get_cookies(self):
+    return [dict(cookie) for cookie in self.cookies]
+
+  def add_cookie(self, cookie):
+    if None in cookie.values():
+      raise ValueError("Selenium rejects null cookie fields")
+    self.cookies.append(cookie)
+
+  def delete_all_cookies(self):
+    self.cookies = []
+
+  def execute_script(self, script, *args):
+    if script == checkpoint._STORAGE_SCRIPT:
+      return {"url": self.url, "local": dict(self.local), "session": dict(self.session)}
+    if script == checkpoint._RESTORE_STORAGE_SCRIPT:
+      self.local, self.session = dict(args[0]), dict(args[1])
+
+######################################################################
+# Capturing and restoring browser state, and the checkpoint files
+######################################################################
+class CheckpointTest(unittest.TestCase):
+  def setUp(self):
+    self.checkpointDir = os.path.join(tempfile.mkdtemp(), "checkpoints")
+
+  def tearDown(self):
+    shutil.rmtree(os.path.dirname(self.checkpointDir))
+
+  def testStateIsRestoredIntoACleanBrowser(self):
+    browser = FakeBrowser("http://x/cart")
+    browser.cookies = [{"name": "sid", "value": "42", "expiry": None}]
+    browser.local, browser.session = {"cart": "3"}, {"tab": "2"}
+    state = checkpoint.captureState(browser)
+
+    clean = FakeBrowser()
+    clean.cookies = [{"name": "other", "value": "x"}]
+    checkpoint.restoreState(clean, state)
+    self.assertEqual(clean.url, "http://x/cart")
+    self.assertEqual(clean.cookies, [{"name": "sid", "value": "42"}])
+    self.assertEqual((clean.local, clean.session), ({"cart": "3"}, {"tab": "2"}))
+    self.assertEqual(clean.visited, ["http://x/cart", "http://x/cart"]) # Reloaded to see the state
+
+  def testTheNearestCheckpointAtOrBeforeTheStepIsFound(self):
+    steps = [nav(i) for i in range(6)]
+    for stepNum in (1, 3, 5):
+      checkpoint.saveCheckpoint(self.checkpointDir, stepNum, steps, {"url": "http://x/%s" % stepNum})
+    self.assertEqual(checkpoint.findCheckpoint(self.checkpointDir, 4, steps)["step"], 3)
+    self.assertEqual(checkpoint.findCheckpoint(self.checkpointDir, 3, steps)["state"], {"url": "http://x/3"})
+    self.assertEqual(checkpoint.findCheckpoint(self.checkpointDir, 0, steps), None)
+
+  def testCheckpointsOfEditedStepsAreIgnored(self):
+    steps = [nav(i) for i in range(6)]
+    for stepNum in (1, 3):
+      checkpoint.saveCheckpoint(self.checkpointDir, stepNum, steps, {})
+    edited = steps[:2] + [nav("changed")] + steps[3:]
+    self.assertEqual(checkpoint.findCheckpoint(self.checkpointDir, 4, edited)["step"], 1)
+    self.assertFalse(checkpoint.matchesPlan(checkpoint.makeCheckpoint(3, steps, {}), edited))
+    self.assertTrue(checkpoint.matchesPlan(checkpoint.makeCheckpoint(3, steps, {}), steps[:3] + [nav("later")]))
+
+  def testClearCheckpoints(self):
+    checkpoint.clearCheckpoints(self.checkpointDir) # Nothing saved yet
+    checkpoint.saveCheckpoint(self.checkpointDir, 1, [nav(0), nav(1)], {})
+    checkpoint.clearCheckpoints(self.checkpointDir)
+    self.assertEqual(checkpoint.findCheckpoint(self.checkpointDir, 1, [nav(0), nav(1)]), None)
+
+  def testTheFailedStepIsRememberedUntilCleared(self):
+    self.assertEqual(checkpoint.loadFailedStep(self.checkpointDir), None)
+    checkpoint.saveFailedStep(self.checkpointDir, 4)
+    self.assertEqual(checkpoint.loadFailedStep(self.checkpointDir), 4)
+    checkpoint.clearFailedStep(self.checkpointDir)
+    self.assertEqual(checkpoint.loadFailedStep(self.checkpointDir), None)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,112 @@
+#!/usr/bin/python
+import os, sys, shutil, tempfile
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_util_core as util_core
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+def nav(name):
+  return {"navigateUrl": {"value": "http://x/%s" % name}}
+
+def imports(name):
+  return {"import_test": {"name": name}}
+
+######################################################################
+# compileTest: imports inlined into one validated, cached plan
+######################################################################
+class CompileTestTest(unittest.TestCase):
+  def setUp(self):
+    self.testDir = tempfile.mkdtemp()
+    self.cacheDir = os.path.join(self.testDir, "cache")
+    util_core.PLAN_CACHE_DIR = self.cacheDir
+
+  def tearDown(self):
+    util_core.PLAN_CACHE_DIR = None
+    shutil.rmtree(self.testDir)
+
+  def writeTest(self, name, steps, **fields):
+    path = os.path.join(self.testDir, name)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    fields["steps"] = steps
+    with open(path, 'w') as testFile:
+      json.dump(fields, testFile)
+    return path
+
+  def testImportsAreInlinedRelativeToTheImportingTest(self):
+    self.writeTest("common/login.json", [nav("login"), imports("dash.json")])
+    self.writeTest("common/dash.json", [nav("dash")])
+    path = self.writeTest("main.json", [imports("common/login.json"), nav("main")], profile="lean")
+    plan = util_core.compileTest(path)
+    self.assertEqual(plan["steps"], (nav("login"), nav("dash"), nav("main")))
+    self.assertEqual(plan["profile"], "lean")
+
+  def testATestImportedTwiceIsInlinedTwice(self):
+    self.writeTest("login.json", [nav("login")])
+    path = self.writeTest("main.json", [imports("login.json"), nav("out"), imports("login.json")])
+    self.assertEqual(util_core.compileTest(path)["steps"], (nav("login"), nav("out"), nav("login")))
+
+  def testImportCyclesAreReported(self):
+    self.writeTest("a.json", [imports("b.json")])
+    self.writeTest("b.json", [nav("b"), imports("a.json")])
+    path = self.writeTest("main.json", [imports("a.json")])
+    try:
+      util_core.compileTest(path)
+    except ValueError, e:
+      self.assertTrue("Import cycle" in str(e))
+      testDir = os.path.realpath(self.testDir)
+      self.assertTrue(str(e).endswith("a.json -> %s -> %s" % (os.path.join(testDir, "b.json"), os.path.join(testDir, "a.json"))), str(e))
+    else:
+      self.fail("No import cycle found")
+    self.assertRaises(ValueError, util_core.compileTest, self.writeTest("self.json", [imports("self.json")]))
+
+  def testMissingImportsAndMalformedTestsAreRejected(self):
+    self.assertRaises(ValueError, util_core.compileTest, self.writeTest("a.json", [imports("missing.json")]))
+    self.assertRaises(ValueError, util_core.compileTest, self.writeTest("b.json", [{"click": {}, "typeKeys": {}}]))
+    self.assertRaises(ValueError, util_core.compileTest, self.writeTest("c.json", [{"import_test": {}}]))
+    self.assertRaises(ValueError, util_core.compileTest, self.writeTest("d.json", {"click": {}}))
+
+  def testPlansAreServedFromTheCache(self):
+    self.writeTest("login.json", [nav("login")])
+    path = self.writeTest("main.json", [imports("login.json")])
+    plan = util_core.compileTest(path)
+    readTest = util_core._readTest
+    util_core._readTest = None # Fails if anything is parsed again
+    try:
+      self.assertEqual(util_core.compileTest(path), plan)
+    finally:
+      util_core._readTest = readTest
+
+  def testTheCacheIsInvalidatedWhenAnImportChanges(self):
+    self.writeTest("login.json", [nav("login")])
+    path = self.writeTest("main.json", [imports("login.json")])
+    util_core.compileTest(path)
+    self.writeTest("login.json", [nav("login"), nav("again")]) # Changes its size
+    self.assertEqual(util_core.compileTest(path)["steps"], (nav("login"), nav("again")))
+
+  def testUnreadableCachesAreIgnored(self):
+    path = self.writeTest("main.json", [nav("main")])
+    util_core.compileTest(path)
+    for name in os.listdir(self.cacheDir):
+      with open(os.path.join(self.cacheDir, name), 'wb') as cacheFile:
+        cacheFile.write("not a pickle")
+    self.assertEqual(util_core.compileTest(path)["steps"], (nav("main"),))
+
+  def testNothingIsCachedWithoutACacheDir(self):
+    util_core.PLAN_CACHE_DIR = None
+    util_core.compileTest(self.writeTest("main.json", [nav("main")]))
+    self.assertFalse(os.path.exists(self.cacheDir))
+
+  def testLoadTestfileReturnsACopyToEdit(self):
+    path = self.writeTest("main.json", [nav("main")])
+    testData = util_core.loadTestfile(path)
+    testData["steps"].append(nav("more"))
+    self.assertEqual(util_core.compileTest(path)["steps"], (nav("main"),))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/python
+import os, sys, shutil, tempfile
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_dataset as dataset
+
+######################################################################
+# Template: ${column} placeholders filled in from a row
+######################################################################
+class TemplateTest(unittest.TestCase):
+  def render(self, step, row):
+    return dataset.Template([step]).render(row)[0]
+
+  def testPlaceholdersInValuesAndSelectorsAreFilledIn(self):
+    step = {"typeKeys": {"selector": {"id": "${field}"}, "value": "${first} ${last}!"}}
+    self.assertEqual(self.render(step, {"field": "name", "first": "Ada", "last": "Lovelace"}),
+                     {"typeKeys": {"selector": {"id": "name"}, "value": "Ada Lovelace!"}})
+
+  def testParentFieldsAndSelectorsAreFilledIn(self):
+    template = dataset.Template([
+      {"fillForm": {"parent": {"id": "${form}"}, "fields": [{"selector": {"name": "user"}, "value": "${user}"}]}},
+      {"assertElements": {"selectors": [{"text": "Hi ${user}"}, {"id": "logout"}]}},
+    ])
+    fillForm, assertElements = template.render({"form": "login", "user": "ada"})
+    self.assertEqual(fillForm["fillForm"]["parent"], {"id": "login"})
+    self.assertEqual(fillForm["fillForm"]["fields"], [{"selector": {"name": "user"}, "value": "ada"}])
+    self.assertEqual(assertElements["assertElements"]["selectors"], [{"text": "Hi ada"}, {"id": "logout"}])
+
+  def testColumnsAreCollectedOnce(self):
+    template = dataset.Template([
+      {"navigateUrl": {"value": "http://x/${page}?q=${query}"}},
+      {"typeKeys": {"selector": {"id": "q"}, "value": "${query}"}},
+    ])
+    self.assertEqual(template.columns, set(["page", "query"]))
+
+  def testStepsWithoutPlaceholdersAreSharedByEveryRow(self):
+    plain = {"click": {"selector": {"id": "go"}}}
+    template = dataset.Template([plain, {"navigateUrl": {"value": "http://x/${page}"}}])
+    first, second = template.render({"page": "a"}), template.render({"page": "b"})
+    self.assertTrue(first[0] is plain and second[0] is plain)
+    self.assertEqual(second[1], {"navigateUrl": {"value": "http://x/b"}})
+
+  def testRenderingDoesNotChangeTheTemplate(self):
+    step = {"typeKeys": {"selector": {"id": "q"}, "value": "${query}"}}
+    self.render(step, {"query": "x"})
+    self.assertEqual(step, {"typeKeys": {"selector": {"id": "q"}, "value": "${query}"}})
+
+  def testKeysOutsideTheTemplateKeysAreLeftAlone(self):
+    step = {"typeKeys": {"selector": {"id": "q"}, "value": "v", "comment": "${query}"}}
+    self.assertEqual(self.render(step, {}), step)
+
+  def testEscapedPlaceholdersAreLiteral(self):
+    step = {"typeKeys": {"selector": {"id": "q"}, "value": "$${query} is ${query}, $$ and $ stay"}}
+    self.assertEqual(self.render(step, {"query": "x"})["typeKeys"]["value"], "${query} is x, $$ and $ stay")
+    escapedOnly = {"navigateUrl": {"value": "http://x/$${page}"}}
+    self.assertEqual(self.render(escapedOnly, {}), {"navigateUrl": {"value": "http://x/${page}"}})
+    self.assertEqual(dataset.Template([escapedOnly]).columns, set())
+
+  def testRowValuesAreNotExpandedAgain(self):
+    step = {"typeKeys": {"selector": {"id": "q"}, "value": "${a}"}}
+    self.assertEqual(self.render(step, {"a": "${b} %s \\1 $${c}", "b": "no"})["typeKeys"]["value"], "${b} %s \\1 $${c}")
+
+  def testNonStringValuesAreFormatted(self):
+    step = {"typeKeys": {"selector": {"id": "q"}, "value": "${n}/${flag}"}}
+    self.assertEqual(self.render(step, {"n": 3, "flag": True})["typeKeys"]["value"], "3/True")
+
+  def testMalformedPlaceholdersAreLeftAsTheyAre(self):
+    step = {"typeKeys": {"selector": {"id": "q"}, "value": "${not valid} ${} $name {x}"}}
+    self.assertEqual(self.render(step, {}), step)
+
+######################################################################
+# Datasets: reading, counting and expanding rows
+######################################################################
+class DatasetTest(unittest.TestCase):
+  def setUp(self):
+    self.dataDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dataDir)
+
+  def writeData(self, name, text):
+    path = os.path.join(self.dataDir, name)
+    with open(path, 'w') as dataFile:
+      dataFile.write(text)
+    return path
+
+  def testCsvRows(self):
+    path = self.writeData("rows.csv", 'page,name\nlogin,"Lovelace, Ada"\n\nsignup,"two\nlines"\n')
+    self.assertEqual(list(dataset.iterRows(path)), [{"page": "login", "name": "Lovelace, Ada"}, {"page": "signup", "name": "two\nlines"}])
+    self.assertEqual(dataset.countRows(path), 2)
+
+  def testJsonLinesRows(self):
+    path = self.writeData("rows.jsonl", '{"page": "a"}\n\n{"page": "b", "n": 2}\n')
+    self.assertEqual(list(dataset.iterRows(path)), [{"page": "a"}, {"page": "b", "n": 2}])
+    self.assertEqual(dataset.countRows(path), 2)
+
+  def testOtherFormatsAreRejected(self):
+    path = self.writeData("rows.txt", "a\n")
+    self.assertRaises(ValueError, lambda: list(dataset.iterRows(path)))
+    self.assertRaises(ValueError, dataset.countRows, path)
+
+  def testExpandTestNumbersRowsFromOne(self):
+    path = self.writeData("rows.jsonl", '{"page": "a"}\n{"page": "b"}\n')
+    testObject = {"profile": "lean", "dataset": "rows.jsonl", "steps": [{"navigateUrl": {"value": "http://x/${page}"}}]}
+    rows = list(dataset.expandTest(testObject, path))
+    self.assertEqual([rowNum for rowNum, rowTest in rows], [1, 2])
+    self.assertEqual(rows[1][1], {"profile": "lean", "steps": ({"navigateUrl": {"value": "http://x/b"}},)})
+
+  def testExpandTestIsLazy(self):
+    path = self.writeData("rows.jsonl", '{"page": "a"}\n{"other": "b"}\n')
+    rows = dataset.expandTest({"steps": [{"navigateUrl": {"value": "${page}"}}]}, path)
+    self.assertEqual(next(rows)[0], 1) # The bad second row isn't read yet
+    self.assertRaises(ValueError, next, rows)
+
+  def testDatasetPathIsRelativeToTheTest(self):
+    self.assertEqual(dataset.datasetPath("/t/sub/login.json", {"dataset": "data/users.csv"}), "/t/sub/data/users.csv")
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,218 @@
+#!/usr/bin/python
+import os, sys
+import unittest
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path[:0] = [os.path.join(TESTS_DIR, "..", directory) for directory in ("bin", "lib", "bench")]
+
+import pysel_core         as core
+import pysel_directives   as directives
+from pysel_context        import RunContext
+from pysel_fakedriver     import FakeDriver
+
+######################################################################
+# Directives against the benchmark's fake WebDriver, counting the
+# commands they send
+######################################################################
+class DirectiveTestCase(unittest.TestCase):
+  def setUp(self):
+    self.driver = FakeDriver(200)
+    core.DRIVER = self.driver
+    core.RUN = RunContext("directives")
+    directives.clearCache()
+
+  def tearDown(self):
+    core.DRIVER = None
+    directives.clearCache()
+
+  # The first element from start on that is displayed and enabled
+  def visible(self, start):
+    for element in self.driver.elements[start:]:
+      if element.displayed and element.enabled:
+        return element
+    self.fail("No visible element after %s" % start)
+
+######################################################################
+# Selectors: every key resolved in the browser in one call
+######################################################################
+class ResolveSelectorTest(DirectiveTestCase):
+  def testAMultiKeySelectorIsOneScriptCall(self):
+    element = self.visible(42)
+    selector = {"class_name": element.attrs["class"], "name": element.attrs["name"], "tag_name": element.tag}
+    self.assertTrue(directives._getObject(self.driver, selector, 0) is element)
+    self.assertEqual(self.driver.commands, {"executeScript": 1})
+
+  def testWithoutScriptsEachKeyIsLookedUp(self):
+    element = self.visible(42)
+    selector = {"class_name": element.attrs["class"], "name": element.attrs["name"]}
+    self.driver.scripts = False
+    self.assertTrue(directives._getObject(self.driver, selector, 0) is element)
+    self.assertTrue(self.driver.commands["findElements"] >= 2)
+
+  def testHiddenAndDisabledElementsDoNotMatch(self):
+    hidden, disabled = self.driver.elements[7], self.driver.elements[11]
+    for element in (hidden, disabled):
+      for scripts in (True, False):
+        self.driver.scripts = scripts
+        self.assertEqual(directives._resolver(self.driver, {"id": element.attrs["id"]})(), [])
+
+  def testLookupsUnderAParentOnlySeeItsDescendants(self):
+    form, inside = self.driver.elements[40], self.visible(41)
+    outside = self.visible(21) # Forms nest: each one holds the next
+    self.assertTrue(directives._getObject(form, {"id": inside.attrs["id"]}, 0) is inside)
+    self.assertEqual(directives._resolveByScript(form, {"id": outside.attrs["id"]}), [])
+
+  def testSeveralMatchesWarnAndTakeTheFirst(self):
+    element = self.visible(1)
+    found = directives._getObject(self.driver, {"class_name": element.attrs["class"]}, 0)
+    self.assertTrue(found is element)
+    self.assertEqual(core.RUN.warnings, 1)
+
+######################################################################
+# The element cache: consecutive steps on the same element look it up once
+######################################################################
+class ElementCacheTest(DirectiveTestCase):
+  def step(self, element, **fields):
+    fields["selector"] = {"id": element.attrs["id"]}
+    return fields
+
+  def testAnElementIsLookedUpOnceForConsecutiveSteps(self):
+    element = self.visible(42)
+    directives.typeKeys(self.step(element, value="a"))
+    self.driver.resetCounts()
+    directives.typeKeys(self.step(element, value="b"))
+    directives.assertElement(self.step(element))
+    self.assertEqual(self.driver.commands, {"isElementDisplayed": 2, "sendKeysToElement": 1})
+    self.assertEqual((core.RUN.cacheHit, core.RUN.cacheMiss), (2, 1))
+
+  def testNavigatingForgetsEveryElement(self):
+    element = self.visible(42)
+    directives.typeKeys(self.step(element, value="a"))
+    directives.navigateUrl({"value": "http://x/next"})
+    self.assertEqual(directives.ELEMENT_CACHE, {})
+    directives.typeKeys(self.step(element, value="b"))
+    self.assertEqual(core.RUN.cacheMiss, 2)
+
+  def testAnElementNoLongerShownIsLookedUpAgain(self):
+    element = self.visible(42)
+    directives.typeKeys(self.step(element, value="a"))
+    element.displayed = False
+    self.assertRaises(directives.TimeoutException, directives.typeKeys, self.step(element, value="b", timeout=0))
+    self.assertEqual((core.RUN.cacheHit, core.RUN.cacheMiss), (0, 2))
+
+  def testAStaleElementIsDropped(self):
+    element = self.visible(42)
+    directives.typeKeys(self.step(element, value="a"))
+    key = directives._cacheKey(None, {"id": element.attrs["id"]})
+    def stale():
+      raise directives.StaleElementReferenceException("gone")
+    element.is_displayed = stale
+    self.assertEqual(directives._cachedObject(key), None)
+    self.assertFalse(key in directives.ELEMENT_CACHE)
+
+  def testElementsAreCachedPerParent(self):
+    form, inside = self.driver.elements[40], self.visible(41)
+    directives.typeKeys(self.step(inside, value="a", parent={"id": form.attrs["id"]}))
+    self.assertEqual(sorted(directives.ELEMENT_CACHE.values()), sorted([form, inside]))
+    self.assertEqual(core.RUN.cacheMiss, 2) # The parent and the field
+    directives.typeKeys(self.step(inside, value="b")) # Same selector, no parent
+    self.assertEqual(core.RUN.cacheMiss, 3)
+
+######################################################################
+# Batch directives: one lookup for every selector of a step
+######################################################################
+class BatchDirectivesTest(DirectiveTestCase):
+  def selector(self, element):
+    return {"id": element.attrs["id"]}
+
+  # Record the order elements are clicked in; onClick runs after the click
+  def trackClicks(self, elements, onClick=None):
+    clicked = []
+    for element in elements:
+      def click(element=element):
+        clicked.append(element)
+        if onClick:
+          onClick(element)
+      element.click = click
+    return clicked
+
+  def testFillFormLooksEveryFieldUpAtOnce(self):
+    fields = [{"selector": self.selector(self.visible(start)), "value": "v"} for start in (2, 22, 42)]
+    directives.fillForm({"fields": fields})
+    self.assertEqual(self.driver.commands, {"executeScript": 1, "sendKeysToElement": 3})
+
+  def testFillFormTriesEveryFieldBeforeFailing(self):
+    fields = [{"selector": self.selector(self.visible(2)), "value": "v"},
+              {"selector": {"id": "missing"}, "value": "v"},
+              {"selector": self.selector(self.visible(42)), "value": "v"}]
+    try:
+      directives.fillForm({"fields": fields, "timeout": 0})
+    except directives.BatchError, e:
+      self.assertEqual([index for index, selector, message in e.failures], [1])
+    else:
+      self.fail("fillForm ignored a missing field")
+    self.assertEqual(self.driver.commands["sendKeysToElement"], 2)
+
+  def testAssertElementsReportsEveryMissingSelector(self):
+    selectors = [{"id": "missing"}, self.selector(self.visible(2)), {"id": "gone"}]
+    self.assertTrue(directives.assertElements({"selectors": selectors[1:2]}))
+    try:
+      directives.assertElements({"selectors": selectors, "timeout": 0})
+    except directives.BatchError, e:
+      self.assertEqual([index for index, selector, message in e.failures], [0, 2])
+    else:
+      self.fail("assertElements passed with missing selectors")
+
+  def testAssertNoElementsWarnsForEachOneFound(self):
+    self.assertTrue(directives.assertNoElements({"selectors": [{"id": "missing"}, {"id": "gone"}]}))
+    self.assertEqual(self.driver.commands, {"executeScript": 1})
+    present = [self.selector(self.visible(2)), {"id": "missing"}, self.selector(self.visible(42))]
+    self.assertFalse(directives.assertNoElements({"selectors": present, "absent_timeout": 0}))
+    self.assertEqual(core.RUN.warnings, 2)
+
+  def testClickSequenceClicksInOrder(self):
+    elements = [self.visible(42), self.visible(2), self.visible(22)]
+    clicked = self.trackClicks(elements)
+    directives.clickSequence({"selectors": [self.selector(element) for element in elements], "settle": False})
+    self.assertEqual(clicked, elements)
+    self.assertEqual(self.driver.commands, {"executeScript": 1})
+
+  def testClickSequenceWaitsForElementsAnEarlierClickShows(self):
+    menu, item = self.visible(2), self.visible(22)
+    item.displayed = False
+    def show(element):
+      item.displayed = True
+    clicked = self.trackClicks([menu, item], show)
+    directives.clickSequence({"selectors": [self.selector(menu), self.selector(item)], "settle": False})
+    self.assertEqual(clicked, [menu, item])
+
+  def testClickSequenceLooksAnElementUpAgainWhenAnEarlierClickReplacedIt(self):
+    step, nextButton = self.visible(2), self.visible(22)
+    clicked = self.trackClicks([step, nextButton])
+    def covered():
+      del nextButton.click # Clickable again once looked up anew
+      raise directives.WebDriverException("element click intercepted")
+    def click(): # Replaces the next button's click with one that fails once
+      clicked.append(step)
+      nextButton.click = covered
+    step.click = click
+    directives.clickSequence({"selectors": [self.selector(step), self.selector(nextButton)], "settle": False})
+    self.assertEqual(clicked, [step])
+    self.assertEqual(self.driver.commands["executeScript"], 2) # The batch, then nextButton again
+    self.assertEqual(self.driver.commands["clickElement"], 1)
+
+  def testClickSequenceStopsAtAFailingClick(self):
+    elements = [self.visible(2), self.visible(22)]
+    def fail():
+      raise directives.WebDriverException("not clickable")
+    elements[0].click = fail
+    clicked = self.trackClicks(elements[1:])
+    try:
+      directives.clickSequence({"selectors": [self.selector(element) for element in elements], "settle": False, "timeout": 0})
+    except directives.BatchError, e:
+      self.assertEqual([index for index, selector, message in e.failures], [0])
+    else:
+      self.fail("clickSequence ignored a failing click")
+    self.assertEqual(clicked, [])
+
+if __name__ == '__main__':
+  unittest.main()
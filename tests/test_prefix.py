@@ -0,0 +1,82 @@
+#!/usr/bin/python
+import os, sys
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_prefix as prefix
+
+def nav(name):
+  return {"navigateUrl": {"value": "http://x/%s" % name}}
+
+def steps(*names):
+  return [nav(name) for name in names]
+
+######################################################################
+# planPrefixes: which leading steps are run once for several tests
+######################################################################
+class PlanPrefixesTest(unittest.TestCase):
+  def testTestsThatDivergeShareTheirCommonSteps(self):
+    plans = {"a": steps("login", "dash", "a"), "b": steps("login", "dash", "b")}
+    prefixes, assignments = prefix.planPrefixes(plans)
+    self.assertEqual(len(prefixes), 1)
+    self.assertEqual(prefixes[0]["steps"], steps("login", "dash"))
+    self.assertEqual(prefixes[0]["parent"], None)
+    self.assertEqual(sorted(prefixes[0]["tests"]), ["a", "b"])
+    self.assertEqual(assignments, {"a": 0, "b": 0})
+
+  def testPrefixesShorterThanMinStepsAreNotShared(self):
+    plans = {"a": steps("login", "a"), "b": steps("login", "b")}
+    prefixes, assignments = prefix.planPrefixes(plans)
+    self.assertEqual(prefixes, [])
+    self.assertEqual(assignments, {"a": None, "b": None})
+    prefixes, assignments = prefix.planPrefixes(plans, minSteps=1)
+    self.assertEqual(len(prefixes), 1)
+
+  def testTestsThatDivergeAtTheFirstStepShareNothing(self):
+    prefixes, assignments = prefix.planPrefixes({"a": steps("a", "x", "y"), "b": steps("b", "x", "y")})
+    self.assertEqual(prefixes, [])
+
+  def testNestedPrefixesPointAtTheirParent(self):
+    plans = {
+      "a": steps("login", "dash", "a"),
+      "b": steps("login", "dash", "admin", "users", "b"),
+      "c": steps("login", "dash", "admin", "users", "c"),
+    }
+    prefixes, assignments = prefix.planPrefixes(plans)
+    self.assertEqual(len(prefixes), 2)
+    outer, inner = prefixes
+    self.assertEqual(outer["steps"], steps("login", "dash"))
+    self.assertEqual(sorted(outer["tests"]), ["a", "b", "c"]) # Everything to run in full if it fails
+    self.assertEqual(inner["parent"], outer["id"])
+    self.assertEqual(inner["steps"], steps("login", "dash", "admin", "users"))
+    self.assertEqual(sorted(inner["tests"]), ["b", "c"])
+    self.assertEqual(assignments, {"a": outer["id"], "b": inner["id"], "c": inner["id"]})
+
+  def testATestThatEndsWhereOthersGoOnIsNotForked(self):
+    # "a" has no steps left after the shared ones, so only "b" would start from them
+    plans = {"a": steps("login", "dash", "x"), "b": steps("login", "dash", "x", "b")}
+    prefixes, assignments = prefix.planPrefixes(plans)
+    self.assertEqual(prefixes, [])
+    self.assertEqual(assignments, {"a": None, "b": None})
+
+  def testIdenticalTestsAreNotForked(self):
+    prefixes, assignments = prefix.planPrefixes({"a": steps("login", "dash", "x"), "b": steps("login", "dash", "x")})
+    self.assertEqual(prefixes, [])
+
+  def testStepsDifferingOnlyInAnArgumentDiverge(self):
+    plans = {
+      "a": steps("login", "dash") + [{"typeKeys": {"selector": {"id": "q"}, "value": "a"}}],
+      "b": steps("login", "dash") + [{"typeKeys": {"selector": {"id": "q"}, "value": "b"}}],
+    }
+    prefixes, assignments = prefix.planPrefixes(plans)
+    self.assertEqual(len(prefixes), 1)
+    self.assertEqual(len(prefixes[0]["steps"]), 2)
+
+  def testPlansAreDeterministicWhateverTheOrderOfTests(self):
+    plans = dict(("t%s" % i, steps("login", "dash", "p%s" % (i % 3), i)) for i in range(12))
+    first = prefix.planPrefixes(plans)
+    second = prefix.planPrefixes(dict(reversed(plans.items())))
+    self.assertEqual(first, second)
+
+if __name__ == '__main__':
+  unittest.main()
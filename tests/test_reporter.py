@@ -0,0 +1,75 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+import os, sys, shutil, tempfile
+import unittest
+from xml.dom import minidom
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "lib")]
+
+import pysel_reporter as reporter
+
+######################################################################
+# JUnitWriter: a complete report after every testcase
+######################################################################
+class JUnitWriterTest(unittest.TestCase):
+  def setUp(self):
+    self.outputDir = tempfile.mkdtemp()
+    self.path = os.path.join(self.outputDir, "report", "junit.xml")
+
+  def tearDown(self):
+    shutil.rmtree(self.outputDir)
+
+  def suite(self):
+    return minidom.parse(self.path).getElementsByTagName("testsuite")[0]
+
+  def testAnEmptyReportIsValid(self):
+    writer = reporter.JUnitWriter(self.path, "suite")
+    suite = self.suite()
+    self.assertEqual(suite.getAttribute("tests"), "0")
+    writer.close()
+
+  def testTheReportIsCompleteAfterEveryTestcase(self):
+    writer = reporter.JUnitWriter(self.path, "suite")
+    writer.write("pysel", "a", 1.5, "passed")
+    writer.write("pysel", "b", 2.0, "failed", "Element not found")
+    suite = self.suite() # Still open
+    self.assertEqual((suite.getAttribute("tests"), suite.getAttribute("failures"), suite.getAttribute("errors")), ("2", "1", "0"))
+    self.assertEqual(suite.getAttribute("time"), "3.500")
+    writer.write("pysel", "c", 0.1, "error", "Import cycle")
+    writer.close()
+    cases = minidom.parse(self.path).getElementsByTagName("testcase")
+    self.assertEqual([case.getAttribute("name") for case in cases], ["a", "b", "c"])
+    self.assertEqual(cases[2].getElementsByTagName("error")[0].getAttribute("message"), "Import cycle")
+
+  def testNamesAndMessagesAreEscaped(self):
+    writer = reporter.JUnitWriter(self.path, 'a "suite" <&>')
+    writer.write("pysel", 'name with "quotes" & <tags>', 1.0, "failed", "expected <b> & 'c'", output="out </system-out> &")
+    writer.close()
+    suite = self.suite()
+    self.assertEqual(suite.getAttribute("name"), 'a "suite" <&>')
+    case = suite.getElementsByTagName("testcase")[0]
+    self.assertEqual(case.getAttribute("name"), 'name with "quotes" & <tags>')
+    self.assertEqual(case.getElementsByTagName("failure")[0].getAttribute("message"), "expected <b> & 'c'")
+    self.assertEqual(case.getElementsByTagName("system-out")[0].firstChild.data, "out </system-out> &")
+
+  def testTheHeaderStaysInPlaceWhenTheEscapedNameIsLong(self):
+    # Escaping makes this name five times longer; the totals then grow by several digits
+    writer = reporter.JUnitWriter(self.path, "&" * 300)
+    for i in range(1200):
+      writer.write("pysel", "t%s" % i, 60.0, "failed" if i % 2 else "passed", "m")
+    writer.close()
+    suite = self.suite()
+    self.assertEqual((suite.getAttribute("tests"), suite.getAttribute("failures")), ("1200", "600"))
+    self.assertTrue(suite.getAttribute("name").startswith("&&&"))
+    self.assertEqual(len(suite.getElementsByTagName("testcase")), 1200)
+
+  def testNonAsciiNamesAreWrittenAsUtf8(self):
+    writer = reporter.JUnitWriter(self.path, u"süite " * 40)
+    for i in range(150):
+      writer.write("pysel", u"tést %s" % i, 100.0, "passed")
+    writer.close()
+    suite = self.suite()
+    self.assertTrue(suite.getAttribute("name").startswith(u"süite"))
+    self.assertEqual(suite.getElementsByTagName("testcase")[149].getAttribute("name"), u"tést 149")
+
+if __name__ == '__main__':
+  unittest.main()
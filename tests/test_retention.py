@@ -0,0 +1,112 @@
+#!/usr/bin/python
+import os, sys, time, shutil, tempfile
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_retention as retention
+
+######################################################################
+# Which runs are pruned, and how
+######################################################################
+class RetentionTest(unittest.TestCase):
+  def setUp(self):
+    self.runsDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.runsDir)
+
+  # A finished run, daysOld days old, holding size bytes
+  def makeRun(self, runId, daysOld=0, size=0):
+    runDir = os.path.join(self.runsDir, runId)
+    os.makedirs(os.path.join(runDir, "report"))
+    with open(os.path.join(runDir, "report", "results.jsonl"), 'w') as resultFile:
+      resultFile.write("x" * size)
+    mtime = time.time() - daysOld * 86400
+    os.utime(runDir, (mtime, mtime))
+    return runDir
+
+  def makeRuns(self, count):
+    runs = ["20260101T0000%02i-1" % i for i in range(count)]
+    for run in runs:
+      self.makeRun(run)
+    return runs
+
+  def policy(self, keepRuns=0, maxAgeDays=0, maxBytes=0):
+    return {"keep_runs": keepRuns, "max_age_days": maxAgeDays, "max_bytes": maxBytes}
+
+  def testOnlyTheNewestKeepRunsAreKept(self):
+    runs = self.makeRuns(5)
+    self.assertEqual(sorted(retention.selectPrunable(self.runsDir, self.policy(keepRuns=2), runs[-1])), runs[:3])
+
+  def testZeroLimitsKeepEverything(self):
+    runs = self.makeRuns(5)
+    self.assertEqual(retention.selectPrunable(self.runsDir, self.policy(), runs[-1]), [])
+
+  def testRunsOlderThanMaxAgeArePruned(self):
+    self.makeRun("20260101T000000-1", daysOld=40)
+    self.makeRun("20260201T000000-1", daysOld=10)
+    self.makeRun("20260301T000000-1")
+    self.assertEqual(retention.selectPrunable(self.runsDir, self.policy(maxAgeDays=30), "20260301T000000-1"),
+                     ["20260101T000000-1"])
+
+  def testOlderRunsBeyondMaxBytesArePruned(self):
+    self.makeRun("20260101T000000-1", size=400)
+    self.makeRun("20260201T000000-1", size=400)
+    self.makeRun("20260301T000000-1", size=400)
+    prunable = retention.selectPrunable(self.runsDir, self.policy(maxBytes=1000), "20260301T000000-1")
+    self.assertEqual(prunable, ["20260101T000000-1"])
+
+  def testTheCurrentRunIsAlwaysKept(self):
+    self.makeRuns(3)
+    self.makeRun("20250101T000000-1", daysOld=400)
+    prunable = retention.selectPrunable(self.runsDir, self.policy(keepRuns=1, maxAgeDays=1), "20250101T000000-1")
+    self.assertFalse("20250101T000000-1" in prunable)
+
+  def testRunsInProgressAreKept(self):
+    runs = self.makeRuns(3)
+    with open(os.path.join(self.runsDir, runs[0], retention.FILE_PID), 'w') as pidFile:
+      pidFile.write("%s" % os.getpid())
+    self.assertEqual(retention.selectPrunable(self.runsDir, self.policy(keepRuns=1), runs[-1]), [runs[1]])
+
+  def testRunsOfDeadProcessesArePruned(self):
+    runs = self.makeRuns(3)
+    with open(os.path.join(self.runsDir, runs[0], retention.FILE_PID), 'w') as pidFile:
+      pidFile.write("999999999") # No such process
+    self.assertTrue(runs[0] in retention.selectPrunable(self.runsDir, self.policy(keepRuns=1), runs[-1]))
+
+  def testLatestAndTrashAreNotRuns(self):
+    runs = self.makeRuns(2)
+    retention.startRun(self.runsDir, "20260101T000002-1")
+    os.makedirs(os.path.join(self.runsDir, retention.TRASH_PREFIX + "old"))
+    self.assertEqual(retention.listRuns(self.runsDir), runs + ["20260101T000002-1"])
+
+  def testStartRunPointsLatestAtTheRun(self):
+    retention.startRun(self.runsDir, "a")
+    retention.startRun(self.runsDir, "b")
+    self.assertEqual(os.readlink(os.path.join(self.runsDir, retention.LATEST)), "b")
+
+  def testFinishRunLetsTheRunBePruned(self):
+    runDir = retention.startRun(self.runsDir, "20260101T000000-1")
+    self.makeRun("20260101T000001-1")
+    policy = self.policy(keepRuns=1)
+    self.assertEqual(retention.selectPrunable(self.runsDir, policy, "20260101T000001-1"), [])
+    retention.finishRun(runDir)
+    self.assertEqual(retention.selectPrunable(self.runsDir, policy, "20260101T000001-1"), ["20260101T000000-1"])
+
+  def testPruneRunsDeletesRunsAndLeftoverTrash(self):
+    runs = self.makeRuns(3)
+    os.makedirs(os.path.join(self.runsDir, retention.TRASH_PREFIX + "interrupted"))
+    self.assertEqual(sorted(retention.pruneRuns(self.runsDir, self.policy(keepRuns=1), runs[-1])), runs[:2])
+    self.assertEqual(sorted(os.listdir(self.runsDir)), [runs[-1]])
+
+  def testRetentionIsReadFromConf(self):
+    confPath = os.path.join(self.runsDir, "conf.json")
+    with open(confPath, 'w') as confFile:
+      confFile.write('{"retention": {"keep_runs": 3}}')
+    retentionConf = retention.loadRetention(confPath)
+    self.assertEqual(retentionConf["keep_runs"], 3)
+    self.assertEqual(retentionConf["max_bytes"], retention.DEFAULT_RETENTION["max_bytes"])
+    self.assertEqual(retention.loadRetention(confPath + ".missing"), retention.DEFAULT_RETENTION)
+
+if __name__ == '__main__':
+  unittest.main()
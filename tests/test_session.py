@@ -0,0 +1,158 @@
+#!/usr/bin/python
+import os, sys
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_session as session
+
+######################################################################
+# A browser that keeps cookies and localStorage by origin and
+# sessionStorage by window, and only lets a page clear its own
+######################################################################
+class FakeBrowser:
+  started = 0
+
+  def __init__(self):
+    FakeBrowser.started = FakeBrowser.started + 1
+    self.session_id = "s%s" % FakeBrowser.started
+    self.cookies    = {} # origin -> {name: value}
+    self.local      = {} # origin -> {key: value}
+    self.windows    = {"w0": {"history": ["about:blank"], "session": {}}}
+    self.current    = "w0"
+    self.opened     = 0
+    self.quit_called = False
+
+  # What a page of the current origin leaves behind
+  def leaveState(self):
+    origin = session.urlOrigin(self.current_url)
+    self.cookies.setdefault(origin, {})["sid"] = "1"
+    self.local.setdefault(origin, {})["k"] = "v"
+    self.windows[self.current]["session"].setdefault(origin, {})["k"] = "v"
+
+  def leftover(self):
+    state = [origin for origin, cookies in self.cookies.items() if cookies]
+    state.extend([origin for origin, local in self.local.items() if local])
+    for window in self.windows.values():
+      state.extend([origin for origin, stored in window["session"].items() if stored])
+    return state
+
+  @property
+  def window_handles(self):
+    return sorted(self.windows)
+
+  @property
+  def current_url(self):
+    return self.windows[self.current]["history"][-1]
+
+  def switch_to_window(self, handle):
+    self.current = handle
+
+  def get(self, url):
+    self.windows[self.current]["history"].append(url)
+
+  def execute_script(self, script, *args):
+    if script.startswith("window.open"):
+      self.opened = self.opened + 1
+      self.windows["n%s" % self.opened] = {"history": ["about:blank"], "session": {}}
+    elif script == session._CLEAR_STORAGE_SCRIPT:
+      origin = session.urlOrigin(self.current_url)
+      self.local.pop(origin, None)
+      self.windows[self.current]["session"].pop(origin, None)
+    return 0
+
+  def delete_all_cookies(self):
+    self.cookies.pop(session.urlOrigin(self.current_url), None)
+
+  def close(self):
+    del self.windows[self.current]
+
+  def quit(self):
+    self.quit_called = True
+
+class FakeChrome(FakeBrowser):
+  def execute_cdp_cmd(self, cmd, params):
+    if cmd == "Page.getNavigationHistory":
+      return {"entries": [{"url": url} for url in self.windows[self.current]["history"]]}
+    if cmd == "Storage.clearDataForOrigin":
+      self.cookies.pop(params["origin"], None)
+      self.local.pop(params["origin"], None)
+    if cmd == "Network.clearBrowserCookies":
+      self.cookies.clear()
+    return {}
+
+######################################################################
+# Releasing a session: reset and kept warm, or recycled
+######################################################################
+class SessionPoolTest(unittest.TestCase):
+  def pool(self, browser=FakeBrowser, **args):
+    self.stopped = []
+    return session.SessionPool(browser, onStop=self.stopped.append, **args)
+
+  def visit(self, pool, driver, url):
+    driver.get(url)
+    pool.visit(driver, url)
+    driver.leaveState()
+
+  def testTheReusedSessionIsReset(self):
+    pool = self.pool()
+    driver = pool.lease()
+    self.visit(pool, driver, "http://a.test/login")
+    driver.execute_script("window.open('about:blank');") # A popup the test left open
+    pool.release(driver)
+    self.assertTrue(pool.lease() is driver)
+    self.assertEqual(driver.leftover(), [])
+    self.assertEqual(len(driver.window_handles), 1)
+    self.assertEqual(driver.current_url, "about:blank")
+
+  def testCookiesOfThePageTheTestEndedOnAreCleared(self):
+    pool = self.pool()
+    driver = pool.lease()
+    self.visit(pool, driver, "http://a.test/")
+    pool.release(driver)
+    self.assertEqual(driver.cookies, {})
+
+  def testWithoutCdpASessionThatLeftAnOriginIsRecycled(self):
+    pool = self.pool()
+    driver = pool.lease()
+    self.visit(pool, driver, "http://a.test/")
+    self.visit(pool, driver, "http://b.test/") # a.test's cookies are out of reach now
+    pool.release(driver)
+    self.assertTrue(driver.quit_called)
+    self.assertEqual(self.stopped, [driver.session_id])
+    self.assertFalse(pool.lease() is driver)
+
+  def testWithCdpEveryOriginVisitedIsCleared(self):
+    pool = self.pool(FakeChrome)
+    driver = pool.lease()
+    self.visit(pool, driver, "http://a.test/")
+    self.visit(pool, driver, "https://b.test:8443/")
+    driver.get("http://c.test/") # Reached by a click: only in the navigation history
+    driver.leaveState()
+    pool.release(driver)
+    self.assertFalse(driver.quit_called)
+    self.assertEqual(driver.leftover(), [])
+
+  def testSessionsAreRecycledAfterMaxUses(self):
+    pool = self.pool(maxUses=2)
+    driver = pool.lease()
+    pool.release(driver)
+    self.assertTrue(pool.lease() is driver)
+    pool.release(driver)
+    self.assertTrue(driver.quit_called)
+
+  def testOnlySizeSessionsAreKeptIdle(self):
+    pool = self.pool(size=1)
+    first, second = pool.lease(), pool.lease()
+    pool.release(first)
+    pool.release(second)
+    self.assertEqual((first.quit_called, second.quit_called), (False, True))
+    pool.closeAll()
+    self.assertTrue(first.quit_called)
+
+  def testUrlOrigin(self):
+    self.assertEqual(session.urlOrigin("HTTPS://user:pw@Example.COM:8443/a?b#c"), "https://example.com:8443")
+    self.assertEqual(session.urlOrigin("about:blank"), None)
+    self.assertEqual(session.urlOrigin(None), None)
+
+if __name__ == '__main__':
+  unittest.main()
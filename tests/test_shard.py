@@ -0,0 +1,123 @@
+#!/usr/bin/python
+import os, sys, shutil, tempfile
+import unittest
+sys.path[:0] = [os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "bin")]
+
+import pysel_shard as shard
+
+try:
+  import json
+except ImportError:
+  import simplejson as json
+
+######################################################################
+# selectShard: longest-processing-time split across nodes
+######################################################################
+class SelectShardTest(unittest.TestCase):
+  def setUp(self):
+    self.testDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.testDir)
+
+  def writeTest(self, name, numSteps, dataset=None):
+    testObject = {"steps": [{"navigateUrl": {"value": "http://x/%s" % i}} for i in range(numSteps)]}
+    if dataset is not None:
+      testObject["dataset"] = dataset
+    path = os.path.join(self.testDir, name + ".json")
+    with open(path, 'w') as testFile:
+      json.dump(testObject, testFile)
+    return path
+
+  def writeTests(self, stepCounts):
+    names = sorted(stepCounts)
+    return names, [self.writeTest(name, stepCounts[name]) for name in names]
+
+  def allShards(self, names, paths, count, durations):
+    return [shard.selectShard(names, paths, index, count, durations) for index in range(1, count + 1)]
+
+  def testEveryTestRunsOnExactlyOneShard(self):
+    names, paths = self.writeTests(dict(("t%02i" % i, i % 5 + 1) for i in range(23)))
+    shards = self.allShards(names, paths, 4, {})
+    ran = sorted(sum(shards, []))
+    self.assertEqual(ran, names)
+
+  def testLongestTestsGoToTheLeastLoadedShard(self):
+    names, paths = self.writeTests({"a": 1, "b": 1, "c": 1, "d": 1})
+    durations = {"a": 10.0, "b": 6.0, "c": 5.0, "d": 4.0}
+    # Longest first onto the least loaded: a -> 1 (10s), b -> 2 (6s), c -> 2 (11s), d -> 1 (14s)
+    self.assertEqual(self.allShards(names, paths, 2, durations), [["a", "d"], ["b", "c"]])
+
+  def testTiesAreBrokenByName(self):
+    names, paths = self.writeTests({"a": 1, "b": 1, "c": 1, "d": 1})
+    durations = dict((name, 1.0) for name in names)
+    self.assertEqual(self.allShards(names, paths, 2, durations), [["a", "c"], ["b", "d"]])
+
+  def testTheSplitIgnoresTheOrderTestsAreListedIn(self):
+    names, paths = self.writeTests(dict(("t%02i" % i, i % 7 + 1) for i in range(30)))
+    durations = {"t03": 12.5, "t11": 0.5, "t20": 7.0}
+    forward = self.allShards(names, paths, 3, durations)
+    backward = self.allShards(list(reversed(names)), list(reversed(paths)), 3, durations)
+    self.assertEqual([sorted(s) for s in forward], [sorted(s) for s in backward])
+
+  def testTheInputDigestTracksTheInputs(self):
+    names, paths = self.writeTests({"a": 2, "b": 3})
+    estimates = shard.estimateDurations(names, paths, {"a": 1.0})
+    self.assertEqual(shard.inputDigest(estimates, 2), shard.inputDigest(dict(reversed(estimates.items())), 2))
+    self.assertNotEqual(shard.inputDigest(estimates, 2), shard.inputDigest(estimates, 3))
+    self.assertNotEqual(shard.inputDigest(estimates, 2), shard.inputDigest(shard.estimateDurations(names, paths, {"a": 1.5}), 2))
+
+  def testTestsWithoutHistoryAreEstimatedFromTheirSteps(self):
+    names, paths = self.writeTests({"known": 4, "new": 10})
+    estimates = shard.estimateDurations(names, paths, {"known": 2.0})
+    self.assertEqual(estimates["known"], 2.0)
+    self.assertAlmostEqual(estimates["new"], 5.0) # 0.5s per step, as measured on "known"
+    estimates = shard.estimateDurations(names, paths, {})
+    self.assertEqual(estimates["new"], 10 * shard.DEFAULT_STEP_SECONDS)
+
+  def testDataDrivenTestsCountTheirStepsOncePerRow(self):
+    with open(os.path.join(self.testDir, "rows.csv"), 'w') as dataFile:
+      dataFile.write("page\na\nb\n\nc\n")
+    path = self.writeTest("data", 2, "rows.csv")
+    estimates = shard.estimateDurations(["data"], [path], {})
+    self.assertEqual(estimates["data"], 6 * shard.DEFAULT_STEP_SECONDS)
+
+  def testUnreadableTestsCountAsOneStep(self):
+    path = os.path.join(self.testDir, "broken.json")
+    with open(path, 'w') as testFile:
+      testFile.write("{not json")
+    estimates = shard.estimateDurations(["broken"], [path], {})
+    self.assertEqual(estimates["broken"], shard.DEFAULT_STEP_SECONDS)
+
+######################################################################
+# Duration history and --shard parsing
+######################################################################
+class DurationsTest(unittest.TestCase):
+  def setUp(self):
+    self.outputDir = tempfile.mkdtemp()
+    self.path = os.path.join(self.outputDir, "output", "durations.json")
+
+  def tearDown(self):
+    shutil.rmtree(self.outputDir)
+
+  def testDurationsAreAMovingAverage(self):
+    shard.recordDurations(self.path, [{"test": "a", "duration": 10.0}])
+    shard.recordDurations(self.path, [{"test": "a", "duration": 20.0}, {"test": "b", "duration": 1.0}])
+    durations = shard.loadDurations(self.path)
+    self.assertAlmostEqual(durations["a"], 10.0 + shard.HISTORY_WEIGHT * 10.0)
+    self.assertEqual(durations["b"], 1.0)
+
+  def testUnreadableDurationsAreIgnored(self):
+    os.makedirs(os.path.dirname(self.path))
+    with open(self.path, 'w') as durationFile:
+      durationFile.write("{")
+    self.assertEqual(shard.loadDurations(self.path), {})
+    self.assertEqual(shard.loadDurations(self.path + ".missing"), {})
+
+  def testParseShard(self):
+    self.assertEqual(shard.parseShard("2/4"), (2, 4))
+    for bad in ("0/4", "5/4", "1/0", "2", "a/b"):
+      self.assertRaises(Exception, shard.parseShard, bad)
+
+if __name__ == '__main__':
+  unittest.main()